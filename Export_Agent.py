@@ -7,7 +7,6 @@
 
 
 import re
-from matplotlib import text
 import requests
 import json
 import io
@@ -16,17 +15,8 @@ import time
 from datetime import datetime
 
 #SOP imports######
-import fitz  # PyMuPDF
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import Paragraph, Frame, Spacer, Table, TableStyle
-from reportlab.lib.units import inch
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.enums import TA_CENTER
-from reportlab.lib.utils import ImageReader
+# fitz (PyMuPDF), reportlab, matplotlib, pptx and docx are imported inside the
+# Call_* function that needs them, so importing this module stays cheap.
 
 ##################################################
 # Azure Blob Storage
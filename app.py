@@ -18,6 +18,7 @@ import os
 import re
 import json
 import asyncio
+import threading
 from threading import Lock
 from flask import Flask, request, jsonify, Response
 
@@ -30,6 +31,7 @@ from botbuilder.core.teams import TeamsInfo
 from botbuilder.schema import Activity
 
 from ask_func import Ask_Question, chat_history   # noqa: F401  (imported for its side-effects)
+import warm_start
 
 # ------------- global config -------------------------------------------------
 RENDER_MODE     = "markdown"
@@ -221,6 +223,38 @@ async def _bot_logic(turn_context: TurnContext):
         print(err)
         await turn_context.send_activity(err)
 
+# --------------------------------------------------------------- startup -----
+_background_started = False
+
+def start_background_services():
+    """
+    Runs once per worker process (gunicorn post_worker_init hook, or __main__).
+    Off the request path: pre-warms the OpenAI / Search / Blob connections, starts the
+    Tool-2 sandbox pool, restores the warm-start snapshot, primes whatever was not
+    restored, then keeps snapshotting.
+    """
+    global _background_started
+    if _background_started:
+        return
+    _background_started = True
+
+    def _warm():
+        import ask_func
+        import code_sandbox
+        ask_func.prewarm_connections()
+        code_sandbox.get_pool()     # fork the Tool-2 sandbox workers before the first question
+        warm_start.restore_snapshot()
+        try:
+            ask_func.load_rbac_files()
+            ask_func.get_table_catalog()
+            ask_func.get_rollup_cubes()
+        except Exception as e:
+            print(f"[Startup] cache priming failed: {e}")
+        warm_start.start_periodic_snapshots()
+
+    threading.Thread(target=_warm, name="warm-start", daemon=True).start()
+
 # ------------------------------------------------------------------ main -----
 if __name__ == "__main__":
+    start_background_services()
     app.run(host="0.0.0.0", port=80)
@@ -44,21 +44,23 @@ import logging
 import warnings
 import requests
 import contextlib
-import pandas as pd
-import numpy as np
 import csv
+import threading
 from io import BytesIO, StringIO
 from datetime import datetime
-from azure.storage.blob import BlobServiceClient
-from azure.search.documents import SearchClient
-from azure.core.credentials import AzureKeyCredential
-from tenacity import retry, stop_after_attempt, wait_fixed  # retrying
 from functools import lru_cache, wraps
 from collections import OrderedDict
 import difflib
 import time
-from rapidfuzz import process, fuzz
 import concurrent.futures     # std-lib, already available
+import hashlib
+import warm_start
+import code_cache
+import output_capture
+
+# Heavy third-party libraries (pandas, azure SDKs, rapidfuzz) are imported inside the
+# functions that use them, so `import ask_func` (and therefore `import app`) stays cheap
+# and does no network I/O. Gunicorn workers / new replicas boot faster this way.
 
 #######################################################################################
 #                               GLOBAL CONFIG / CONSTANTS
@@ -170,22 +172,142 @@ def azure_retry(max_attempts=3, delay=2):
         return wrapper
     return decorator
 
+#######################################################################################
+#                     SHARED CLIENTS (pooled connections, created once)
+#######################################################################################
+# One HTTP session for the OpenAI endpoints and one Blob / Search client per process,
+# so TLS connections and auth state are reused across requests (and can be pre-warmed
+# at worker start, see prewarm_connections()).
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _shared_client(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+def get_http_session():
+    def _make():
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        session.mount("https://", adapter)
+        return session
+    return _shared_client("http", _make)
+
+def get_blob_service_client():
+    def _make():
+        from azure.storage.blob import BlobServiceClient
+        return BlobServiceClient(account_url=CONFIG["ACCOUNT_URL"], credential=CONFIG["SAS_TOKEN"])
+    return _shared_client("blob", _make)
+
+def get_container_client():
+    return _shared_client(
+        "container", lambda: get_blob_service_client().get_container_client(CONFIG["CONTAINER_NAME"])
+    )
+
+def get_search_client():
+    def _make():
+        from azure.search.documents import SearchClient
+        from azure.core.credentials import AzureKeyCredential
+        return SearchClient(
+            endpoint=CONFIG["SEARCH_ENDPOINT"],
+            index_name=CONFIG["INDEX_NAME"],
+            credential=AzureKeyCredential(CONFIG["ADMIN_API_KEY"])
+        )
+    return _shared_client("search", _make)
+
+PREWARM_TIMEOUT_SECONDS = float(os.getenv("PREWARM_TIMEOUT_SECONDS", "10"))
+
+def _prewarm_openai(endpoint):
+    # Any HTTP answer is enough: DNS, TLS and the pooled keep-alive connection are set up.
+    from urllib.parse import urlsplit, parse_qs
+    parts = urlsplit(endpoint)
+    api_version = parse_qs(parts.query).get("api-version", ["2024-10-21"])[0]
+    url = f"{parts.scheme}://{parts.netloc}/openai/models?api-version={api_version}"
+    get_http_session().get(url, headers={"api-key": CONFIG["LLM_API_KEY"]}, timeout=5)
+
+def prewarm_connections(timeout=None):
+    """
+    Opens the pooled connections (OpenAI endpoints, Search, Blob) with cheap calls
+    and creates the shared clients, so the first user question does not pay for
+    DNS / TLS / client setup. Bounded by `timeout` seconds overall: a slow or failing
+    dependency is reported and skipped, never waited on past the deadline.
+    Returns {target: seconds | "error: ..." | "timeout"}.
+    """
+    timeout = PREWARM_TIMEOUT_SECONDS if timeout is None else timeout
+
+    timings = {}
+
+    def _timed(name, fn):
+        started = time.perf_counter()
+        try:
+            fn()
+            timings[name] = round(time.perf_counter() - started, 3)
+        except Exception as e:
+            timings[name] = f"error: {e}"
+
+    targets = {
+        "blob": lambda: get_container_client().get_container_properties(timeout=5),
+        "search": lambda: get_search_client().get_document_count(),
+    }
+    for key in ("LLM_ENDPOINT", "LLM_ENDPOINT_CODE", "LLM_ENDPOINT_AUX"):
+        host = CONFIG[key].split("/openai/")[0]
+        targets.setdefault(f"openai:{host}", lambda ep=CONFIG[key]: _prewarm_openai(ep))
+
+    # Daemon threads (not an executor): a hung dependency must not hold up boot or exit.
+    threads = [
+        threading.Thread(target=_timed, args=(name, fn), name=f"prewarm-{name}", daemon=True)
+        for name, fn in targets.items()
+    ]
+    for t in threads:
+        t.start()
+    deadline = time.monotonic() + timeout
+    for t in threads:
+        t.join(max(0.0, deadline - time.monotonic()))
+
+    timings = {name: timings.get(name, "timeout") for name in targets}
+    logging.info(f"[Prewarm] connection warm-up: {timings}")
+    return timings
+
 #######################################################################################
 #                           RBAC HELPERS (User & File Tiers)
 #######################################################################################
-@lru_cache(maxsize=1)
-@azure_retry()
+RBAC_FOLDER_PATH = "UI/2024-11-20_142337_UTC/cxqa_data/RBAC/"
+
+# Process-wide RBAC frames (df_user, df_file). Loaded once, or restored from the
+# warm-start snapshot at boot; _rbac_epoch is the data epoch they were loaded under.
+_rbac_frames = None
+_rbac_epoch = None
+_rbac_lock = threading.Lock()
+
 def load_rbac_files():
+    """
+    Returns the cached (df_user, df_file) RBAC frames, downloading them on first use.
+    """
+    global _rbac_frames, _rbac_epoch
+    if _rbac_frames is None:
+        with _rbac_lock:
+            if _rbac_frames is None:
+                epoch = _data_epoch_or_none()
+                _rbac_frames = _download_rbac_files()
+                _rbac_epoch = epoch
+    return _rbac_frames
+
+@azure_retry()
+def _download_rbac_files():
     """
     Loads User_rbac.xlsx and File_rbac.xlsx from the RBAC folder in Azure Blob Storage, 
     returns them as two DataFrame objects: (df_user, df_file).
     If anything fails, returns two empty dataframes.
     """
-    account_url = CONFIG["ACCOUNT_URL"]
-    sas_token = CONFIG["SAS_TOKEN"]
-    container_name = CONFIG["CONTAINER_NAME"]
+    import pandas as pd
 
-    rbac_folder_path = "UI/2024-11-20_142337_UTC/cxqa_data/RBAC/"
+    rbac_folder_path = RBAC_FOLDER_PATH
     user_rbac_file = "User_rbac.xlsx"
     file_rbac_file = "File_rbac.xlsx"
 
@@ -193,8 +315,7 @@ def load_rbac_files():
     df_file = pd.DataFrame()
 
     try:
-        blob_service_client = BlobServiceClient(account_url=account_url, credential=sas_token)
-        container_client = blob_service_client.get_container_client(container_name)
+        container_client = get_container_client()
 
         # Load User_rbac.xlsx
         user_rbac_blob = container_client.get_blob_client(rbac_folder_path + user_rbac_file)
@@ -216,7 +337,13 @@ def get_file_tier(file_name):
     Checks the file name in the File_rbac.xlsx file, returns the tier needed to access it.
     Now uses fuzzy matching via difflib to find the best match if the exact or partial
     match isn't found. If best match ratio is below 0.8, defaults to tier=1.
+    A join view (join_views.py) requires the highest tier of its source tables.
     """
+    import join_views
+    view = join_views.get_view(file_name)
+    if view is not None:
+        return max(get_file_tier(source) for source in view.sources)
+
     _, df_file = load_rbac_files()
     if df_file.empty or ("File_Name" not in df_file.columns) or ("Tier" not in df_file.columns):
         # default if not loaded or columns missing
@@ -280,8 +407,7 @@ def get_file_tier(file_name):
 #######################################################################################
 @lru_cache(maxsize=1)
 def load_table_metadata(sample_n: int = 2):
-    container = BlobServiceClient(account_url=CONFIG["ACCOUNT_URL"], credential=CONFIG["SAS_TOKEN"])\
-                    .get_container_client(CONFIG["CONTAINER_NAME"])
+    container = get_container_client()
     prefix = CONFIG["TARGET_FOLDER_PATH"]
     meta = OrderedDict()
 
@@ -290,15 +416,48 @@ def load_table_metadata(sample_n: int = 2):
         if not fn.lower().endswith((".xlsx", ".xls", ".csv")):
             continue
 
-        data = container.get_blob_client(blob.name).download_blob().readall()
-        df = (pd.read_excel if fn.lower().endswith((".xlsx", ".xls")) else pd.read_csv)(BytesIO(data))
+        # Parsed through the shared table cache, so Tool-2 finds these frames warm.
+        df = get_table_cache().get(fn)
 
         schema = {col: str(dt) for col, dt in df.dtypes.items()}
         sample = df.head(sample_n).to_dict(orient="records")
         meta[fn] = {"schema": schema, "sample": sample}
 
+    # Join views over the listed tables are tables of their own (join_views.py).
+    import join_views
+    for view in join_views.get_views():
+        if not all(source in meta for source in view.sources):
+            logging.warning(f"[JoinViews] '{view.name}' skipped: source table missing")
+            continue
+        try:
+            df = get_table_cache().get(view.name)
+        except Exception as e:
+            logging.error(f"[JoinViews] could not build '{view.name}': {e}")
+            continue
+        meta[view.name] = {
+            "schema": {col: str(dt) for col, dt in df.dtypes.items()},
+            "sample": df.head(sample_n).to_dict(orient="records"),
+            "view": view.describe(),
+        }
+
     return meta
 
+def get_table_cache():
+    """
+    Process-wide TableCache for the tabular folder (see table_cache.py).
+    """
+    def _make():
+        import join_views
+        from table_cache import TableCache
+        from table_store import TableStore
+        # Parsed frames survive restarts through the local columnar store (keyed by
+        # ETag), so they are not part of the warm-start snapshot.
+        cache = TableCache(get_container_client, CONFIG["TARGET_FOLDER_PATH"], store=TableStore())
+        for view in join_views.get_views():
+            cache.register_view(view.name, view.sources, view.build)
+        return cache
+    return _shared_client("table_cache", _make)
+
 def format_tables_text(meta: dict) -> str:
     lines = []
     for i, (fn, info) in enumerate(meta.items(), 1):
@@ -315,6 +474,8 @@ def format_schema_and_sample(meta: dict, sample_n: int = 2, char_limit: int = 40
     lines = []
     for fn, info in meta.items():
         lines.append(f"{fn}: {info['schema']}")
+        if info.get("view"):
+            lines.append(f"    View: {info['view']}")
         truncated = [
             {col: truncate_val(val) for col, val in row.items()}
             for row in info["sample"][:sample_n]
@@ -322,10 +483,116 @@ def format_schema_and_sample(meta: dict, sample_n: int = 2, char_limit: int = 40
         lines.append(f"    Sample: {truncated},")
     return "\n".join(lines)
 
-_metadata   = load_table_metadata(sample_n=2)
-TABLES      = format_tables_text(_metadata)
-SCHEMA_TEXT = format_schema_and_sample(_metadata, sample_n=2, char_limit=40)
-#SAMPLE_TEXT = SCHEMA_TEXT  # if SAMPLE_TEXT needed separately
+# The catalog used to be built at import time (one blob download per table before the
+# worker could serve anything). It is now built on first use and kept for the process.
+_catalog_lock = threading.Lock()
+_catalog = None
+_catalog_epoch = None     # data epoch the catalog was built under (warm-start snapshot)
+
+def get_table_catalog():
+    """
+    Returns (metadata, TABLES text, SCHEMA_TEXT text), loading them from blob storage
+    the first time it is called.
+    """
+    global _catalog, _catalog_epoch
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                epoch = _data_epoch_or_none()
+                _catalog = _build_catalog(load_table_metadata(sample_n=2))
+                _catalog_epoch = epoch
+    return _catalog
+
+def _build_catalog(meta):
+    return (
+        meta,
+        format_tables_text(meta),
+        format_schema_and_sample(meta, sample_n=2, char_limit=40),
+    )
+
+def get_tables_text():
+    return get_table_catalog()[1]
+
+def get_schema_version():
+    """Short hash of the table names, columns and dtypes (sample rows excluded)."""
+    meta = get_table_catalog()[0]
+    schema = json.dumps({fn: info["schema"] for fn, info in meta.items()}, sort_keys=True, default=str)
+    return hashlib.sha1(schema.encode("utf-8")).hexdigest()[:16]
+
+def get_schema_text():
+    return get_table_catalog()[2]
+
+def __getattr__(name):
+    # Keeps `ask_func._metadata`, `ask_func.TABLES` and `ask_func.SCHEMA_TEXT` working
+    # for external callers now that they are built lazily.
+    if name == "_metadata":
+        return get_table_catalog()[0]
+    if name == "TABLES":
+        return get_tables_text()
+    if name == "SCHEMA_TEXT":
+        return get_schema_text()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+#######################################################################################
+#                   DATA EPOCH + WARM-START SNAPSHOT REGISTRATION
+#######################################################################################
+DATA_EPOCH_TTL_SECONDS = 300
+_data_epoch = {"tag": None, "checked": 0.0}
+_data_epoch_lock = threading.Lock()
+
+def get_data_epoch():
+    """
+    Returns a short tag for the current version of the source data: a hash of
+    (name, ETag) of every blob under the tabular and RBAC folders.
+    The listing is repeated at most every DATA_EPOCH_TTL_SECONDS.
+    """
+    with _data_epoch_lock:
+        if _data_epoch["tag"] and time.time() - _data_epoch["checked"] < DATA_EPOCH_TTL_SECONDS:
+            return _data_epoch["tag"]
+
+        container = get_container_client()
+        digest = hashlib.sha1()
+        for prefix in (CONFIG["TARGET_FOLDER_PATH"], RBAC_FOLDER_PATH):
+            for blob in container.list_blobs(name_starts_with=prefix):
+                digest.update(f"{blob.name}|{blob.etag}\n".encode("utf-8"))
+
+        _data_epoch["tag"] = digest.hexdigest()[:16]
+        _data_epoch["checked"] = time.time()
+        return _data_epoch["tag"]
+
+def _data_epoch_or_none():
+    """get_data_epoch(), or None if the listing fails (the content is then never snapshotted)."""
+    try:
+        return get_data_epoch()
+    except Exception as e:
+        logging.warning(f"[WarmStart] data epoch unavailable: {e}")
+        return None
+
+# Snapshots carry the epoch the content was built under, read before building it: a
+# blob that changes meanwhile makes the content older than its tag, never newer.
+# A restored payload only passes when its epoch is the current one.
+def _restore_rbac_frames(payload):
+    global _rbac_frames, _rbac_epoch
+    with _rbac_lock:
+        if _rbac_frames is None:
+            _rbac_frames = payload
+            _rbac_epoch = _data_epoch_or_none()
+
+def _restore_catalog(meta):
+    global _catalog, _catalog_epoch
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = _build_catalog(meta)
+            _catalog_epoch = _data_epoch_or_none()
+
+warm_start.register_warm_cache(
+    "rbac_frames", dump=lambda: (_rbac_frames, _rbac_epoch) if _rbac_frames is not None else None,
+    restore=_restore_rbac_frames, epoch=get_data_epoch
+)
+warm_start.register_warm_cache(
+    "table_catalog", dump=lambda: (_catalog[0], _catalog_epoch) if _catalog else None,
+    restore=_restore_catalog, epoch=get_data_epoch
+)
 
 #######################################################################################
 #                   CENTRALIZED LLM CALL (Point #1 Optimization)
@@ -349,7 +616,7 @@ def call_llm(system_prompt, user_prompt, max_tokens=500, temperature=0.0):
             "max_tokens": max_tokens,
             "temperature": temperature
         }
-        response = requests.post(CONFIG["LLM_ENDPOINT"], headers=headers, json=payload)
+        response = get_http_session().post(CONFIG["LLM_ENDPOINT"], headers=headers, json=payload)
         response.raise_for_status()
         data = response.json()
         if "choices" in data and data["choices"]:
@@ -401,7 +668,7 @@ def call_llm_aux(system_prompt, user_prompt, max_tokens=300, temperature=0.0):
 
     for attempt in range(3):
         try:
-            r = requests.post(CONFIG["LLM_ENDPOINT_AUX"], headers=headers, json=payload, timeout=30)
+            r = get_http_session().post(CONFIG["LLM_ENDPOINT_AUX"], headers=headers, json=payload, timeout=30)
             if r.status_code == 429:
                 time.sleep(1.5 * (attempt + 1))
                 continue
@@ -550,12 +817,64 @@ NUMERIC_HINT = re.compile(
     r"\b(count|how many|total|sum|average|revenue|visits?|visitation|incidents?|sales|footfall|foreigners?|utili[sz]ation)\b",
     re.I,
 )
+# Process-wide copy of the table-need classifier results (the per-conversation copy
+# lives in tool_cache["table_need"]): question -> (result, data epoch it was classified
+# under), LRU-bounded. The warm-start snapshot keeps the entries of the current epoch.
+TABLE_NEED_CACHE_MAX_ENTRIES = int(os.getenv("TABLE_NEED_CACHE_MAX_ENTRIES", "5000"))
+_table_need_cache = OrderedDict()
+_table_need_lock = threading.Lock()
+
+def _remember_table_need(key, value, epoch):
+    with _table_need_lock:
+        _table_need_cache[key] = (value, epoch)
+        _table_need_cache.move_to_end(key)
+        while len(_table_need_cache) > TABLE_NEED_CACHE_MAX_ENTRIES:
+            _table_need_cache.popitem(last=False)
+
+def _lookup_table_need(key):
+    with _table_need_lock:
+        found = _table_need_cache.get(key)
+        if found is not None:
+            _table_need_cache.move_to_end(key)
+    return None if found is None else found[0]
+
+def _dump_table_need():
+    current = _data_epoch_or_none()
+    if current is None:
+        return None
+    with _table_need_lock:
+        payload = {key: value for key, (value, epoch) in _table_need_cache.items() if epoch == current}
+    return (payload, current) if payload else None
+
+def _restore_table_need(payload):
+    epoch = _data_epoch_or_none()
+    for key, value in payload.items():
+        if _lookup_table_need(key) is None:
+            _remember_table_need(key, value, epoch)
+
+warm_start.register_warm_cache(
+    "table_need", dump=_dump_table_need, restore=_restore_table_need, epoch=get_data_epoch, version=2
+)
+# Successful (question, code) pairs for reuse (code_reuse.py); scoped by schema version.
+warm_start.register_warm_cache(
+    "tool2_code_reuse", dump=lambda: get_code_reuse_store().dump(),
+    restore=lambda payload: get_code_reuse_store().restore(payload)
+)
+# Tool-2 execution results (code_cache.py); keys embed the table ETags, so no epoch.
+warm_start.register_warm_cache(
+    "tool2_results", dump=code_cache.get_result_cache().dump,
+    restore=code_cache.get_result_cache().restore
+)
 # ------------------------------------------------------
 def references_tabular_data(question, tables_text):
     # ---- NEW: cache classifier result ----
     cache_key = question.lower().strip()
     if cache_key in tool_cache.get("table_need", {}):
         return tool_cache["table_need"][cache_key]
+    known = _lookup_table_need(cache_key)
+    if known is not None:
+        tool_cache.setdefault("table_need", {})[cache_key] = known
+        return known
     # ---- NEW: short-circuit obvious numeric questions ----
     if NUMERIC_HINT.search(question):
         tool_cache.setdefault("table_need", {})[cache_key] = True
@@ -598,11 +917,14 @@ def references_tabular_data(question, tables_text):
 
     Final instruction: Reply ONLY with 'YES' or 'NO'.
     """
+    epoch = _data_epoch_or_none()
     llm_response = call_llm_aux(llm_system_message, llm_user_message, max_tokens=5, temperature=0.0)
     clean_response = llm_response.strip().upper()
     logging.info(f"[Table-Need] '{question[:60]}' → {clean_response}")
     final = "YES" in clean_response
     tool_cache.setdefault("table_need", {})[cache_key] = final
+    if not clean_response.startswith("LLM ERROR"):
+        _remember_table_need(cache_key, final, epoch)
     return final
 
 # In ask_func_client_2.py
@@ -680,11 +1002,7 @@ def tool_1_index_search(user_question, top_k=5, user_tier=1, question_primarily_
     #print(f"DEBUG: [Tool 1] Subquestions: {subquestions}")
 
     try:
-        search_client = SearchClient(
-            endpoint=SEARCH_ENDPOINT,
-            index_name=INDEX_NAME,
-            credential=AzureKeyCredential(ADMIN_API_KEY)
-        )
+        search_client = get_search_client()
 
         merged_docs = []
         all_raw_results_count = 0 # To count total raw results
@@ -811,24 +1129,65 @@ def tool_1_index_search(user_question, top_k=5, user_tier=1, question_primarily_
 #######################################################################################
 #                 HELPER to check table references vs. user tier
 #######################################################################################
-def reference_table_data(code_str, user_tier):
+def get_code_reuse_store():
+    from code_reuse import get_code_reuse_store as _get
+    return _get()
+
+def is_standalone_question(question):
+    from code_reuse import is_standalone
+    return is_standalone(question)
+
+def get_table_resolver():
+    """TableResolver (table_resolver.py) over the current catalog's file names."""
+    from table_resolver import TableResolver
+    names = tuple(get_table_catalog()[0])
+    resolver = _shared_client("table_resolver", lambda: TableResolver(names))
+    if tuple(resolver.names) != names:
+        with _clients_lock:
+            resolver = _clients["table_resolver"] = TableResolver(names)
+    return resolver
+
+def resolve_table_names(code_str):
+    """
+    Rewrites misspelled table names in generated code to their catalog names.
+    Returns (code, corrections); the code is unchanged without a catalog.
+    """
+    try:
+        resolver = get_table_resolver()
+    except Exception as e:
+        logging.warning(f"Table catalog unavailable for table name resolution: {e}")
+        return code_str, []
+    return resolver.rewrite_code(code_str)
+
+def analyze_generated_code(code_str):
+    """
+    Runs code_analysis.analyze_code on generated code with the catalog schemas, so
+    column pruning knows every table's columns. Without a catalog (blob storage not
+    reachable) tables are still extracted, columns are just not pruned.
+    """
+    from code_analysis import analyze_code
+    try:
+        schemas = {fn: list(info["schema"]) for fn, info in get_table_catalog()[0].items()}
+    except Exception as e:
+        logging.warning(f"Table catalog unavailable for code analysis: {e}")
+        schemas = None
+    return analyze_code(code_str, schemas)
+
+def reference_table_data(code_str, user_tier, facts=None):
     """
-    Scans the generated Python code for references to specific table filenames 
+    Finds the table files referenced by the generated Python code
     (like "Al-Bujairy Terrace Footfalls.xlsx" etc.). For each referenced file, we check 
     the file tier from File_rbac.xlsx. If the user tier < file tier => no access => 
     we immediately return a short message that the user is not authorized.
 
     If all references are okay, return None (meaning "all good").
+    `facts` is the CodeFacts of code_str, if already computed.
     """
-    # We'll look for patterns like "dataframes.get("SomeFile.xlsx") or the actual file references 
-    pattern = re.compile(
-    r'(?:dataframes\.get|pd\.read_(?:excel|csv))\(\s*[\'"]([^\'"]+)[\'"]\s*\)'
-    )
-    found_files = pattern.findall(code_str)
-    unique_files = list(set(found_files))
+    # dataframes.get("x") / dataframes["x"] / pd.read_excel("x"), variables holding
+    # file names and any other file-name literal (see code_analysis.py).
+    facts = facts or analyze_generated_code(code_str)
 
-    # Modify the loop to iterate over unique_files instead of found_files:
-    for fname in unique_files:
+    for fname in facts.tables:
         # ... rest of the loop checking required_tier ...
         required_tier = get_file_tier(fname)
         if user_tier < required_tier:
@@ -836,6 +1195,75 @@ def reference_table_data(code_str, user_tier):
 
     return None # all good
 
+#######################################################################################
+#                              ROLLUPS (pre-aggregated cubes)
+#######################################################################################
+def get_rollup_cube(file_name):
+    """
+    Rollup cube (rollups.py) of the current version of `file_name`, or None. The frame
+    comes from the table cache, so this only parses the table if it changed.
+    """
+    import rollups
+    schema = get_table_catalog()[0].get(file_name, {}).get("schema")
+    if not rollups.USE_ROLLUPS or schema is None:
+        return None
+    table_cache = get_table_cache()
+    df = table_cache.get(file_name)
+    return rollups.get_cube(file_name, table_cache.etag(file_name), df, schema)
+
+def get_rollup_cubes():
+    """Cubes of every catalog table (built on first use, then per new table version)."""
+    cubes = []
+    for file_name in get_table_catalog()[0]:
+        try:
+            cube = get_rollup_cube(file_name)
+        except Exception as e:
+            logging.warning(f"[Rollups] no cube for '{file_name}': {e}")
+            continue
+        if cube is not None:
+            cubes.append(cube)
+    return cubes
+
+def get_rollups_text():
+    """Prompt lines describing the cubes already built ("" if none)."""
+    import rollups
+    return rollups.describe_cubes(rollups.current_cubes()) if rollups.USE_ROLLUPS else ""
+
+def answer_from_rollups(user_question, user_tier):
+    """
+    Tool-2 style result for questions a rollup cube answers directly (no codegen, no
+    table load), or None to go through code generation.
+    """
+    import rollups
+    if not rollups.USE_ROLLUPS or not is_standalone_question(user_question):
+        return None
+    try:
+        cubes = rollups.current_cubes() or get_rollup_cubes()
+        intent = rollups.match_intent(user_question, cubes)
+        if intent is None:
+            return None
+        # Matched on the last known version: make sure it is still the current one.
+        cube = get_rollup_cube(intent.cube.name)
+        if cube is None:
+            return None
+        if cube is not intent.cube:
+            intent = rollups.match_intent(user_question, [cube])
+            if intent is None:
+                return None
+    except Exception as e:
+        logging.warning(f"[Rollups] intent matching failed: {e}")
+        return None
+
+    required_tier = get_file_tier(cube.name)
+    if user_tier < required_tier:
+        return {"result": f"User does not have access to {cube.name} (requires tier {required_tier}).",
+                "code": "", "table_names": []}
+    result = rollups.answer(intent)
+    if result is None:
+        return None
+    print(f"[ROLLUPS] answered from the cube of '{cube.name}'")
+    return {"result": result, "code": intent.to_code(), "table_names": [cube.name]}
+
 #######################################################################################
 #                              TOOL #2 - Code Run
 #######################################################################################
@@ -848,6 +1276,48 @@ def tool_2_code_run(user_question, user_tier=1, recent_history=None):
     # Centralize fallback logic for chat history
     rhistory = recent_history if recent_history else []
 
+    # "Total X by month for site Y" style questions: answered from the rollup cubes.
+    rollup_outcome = answer_from_rollups(user_question, user_tier)
+    if rollup_outcome is not None:
+        return rollup_outcome
+
+    # TOOL2_ENGINE=sql / duckdb / sqlite: one SQL query instead of pandas code. Pandas
+    # codegen stays the fallback when the SQL path cannot answer.
+    import sql_engine
+    engine = sql_engine.resolve_engine()
+    if engine is not None:
+        sql_outcome = tool_2_sql_run(user_question, user_tier, rhistory, engine)
+        if sql_outcome is not None:
+            return sql_outcome
+        logging.info("SQL engine could not answer, falling back to pandas code generation")
+
+    # Code that already answered the same (or an almost identical) question on this
+    # schema skips the codegen call; it only counts if it runs successfully.
+    reuse_store = get_code_reuse_store()
+    reusable, schema_version = is_standalone_question(user_question), None
+    if reusable:
+        try:
+            schema_version = get_schema_version()
+        except Exception as e:
+            logging.warning(f"Schema version unavailable, code reuse disabled: {e}")
+            reusable = False
+    if reusable:
+        for reused_code, changes in reuse_store.candidates(user_question, schema_version):
+            outcome = _run_tool2_code(reused_code, user_tier)
+            if not tool2_execution_failed(outcome["result"]):
+                logging.info(f"Tool-2 reused stored code (changes: {changes or 'none'})")
+                return outcome
+            if outcome["result"] == SANDBOX_BUSY_MESSAGE:
+                return outcome      # the next candidate would only wait for the sandbox again
+            logging.info("Reused Tool-2 code failed, trying the next candidate / codegen")
+
+    rollups_text = get_rollups_text()
+    rollups_section = f"""
+Precomputed rollups (faster than the raw tables for sums / counts / averages by day, week or month):
+`rollups[(file_name, grain, dimension)]` is a DataFrame with columns `period` (start of the day / week / month), the dimension column (omitted when dimension is None), `rows` (row count), one column per measure holding its sum and `<measure>__n` holding its non-null count. grain is "day", "week" or "month".
+{rollups_text}
+""" if rollups_text else ""
+
     system_prompt = f"""
 You are a python expert. Use the User Question along with the Chat_history to make the python code that will get the answer from the provided Dataframes schemas and samples.
 Only provide the python code and nothing else, without any markdown fences like ```python or ```.
@@ -865,25 +1335,26 @@ Don't give examples, only provide the actual code. If you can't provide the code
 7. Do not use Chat_history information directly within the generated code logic or print statements, but use it for context if needed to understand the user's question.
 
 **Data Handling Rules for Pandas Code**:
-A. **Numeric Conversion:** When a column is expected to be numeric for calculations (e.g., for .sum(), .mean(), comparisons):
-   - First, replace common non-numeric placeholders (like '-', 'N/A', or strings containing only spaces) with `pd.NA` or `numpy.nan`. For example: `df['column_name'] = df['column_name'].replace(['-', 'N/A', ' ', '  '], pd.NA)`
-   - Then, explicitly convert the column to a numeric type using `pd.to_numeric(df['column_name'], errors='coerce')`. This will turn any remaining unparseable values into `NaN`.
+A. **Pre-cleaned Columns:** The tables are cleaned when loaded: placeholders ('-', 'N/A', blanks) are already NA, numeric columns are already numeric and date columns are already `datetime64` — the dtypes in the schemas below are the real ones (`category` columns hold text: filter and compare them like strings). Do NOT re-convert those columns. Only if a column you need for math is still `object`, convert it with `pd.to_numeric(df['column_name'], errors='coerce')`.
 B. **Handle NaN Values:** Before performing aggregate functions (like `.sum()`, `.mean()`) or arithmetic operations on numeric columns, ensure `NaN` values are handled, e.g., by using `skipna=True` (which is default for many aggregations like `.sum()`) or by explicitly filling them (e.g., `df['numeric_column'].fillna(0).sum()`).
-C. **Date Columns:** If the question involves dates:
-   - Convert date-like columns to datetime objects using `pd.to_datetime(df['Date_column'], errors='coerce')`.
-   - When comparing or merging data based on dates across multiple dataframes, ensure date columns are of a consistent datetime type and format. Be careful with operations that require aligned date indexes.
+C. **Date Columns:** Compare `datetime64` columns directly with `pd.Timestamp('YYYY-MM-DD')` or use the `.dt` accessor. Only an `object` column that holds dates needs `pd.to_datetime(df['Date_column'], errors='coerce')`.
 D. **Complex Lookups:** For questions requiring data from multiple tables (e.g., "find X in table A on the date of max Y in table B"):
+   - If a table in the schemas is marked `View:`, it already joins those tables: use it on its own instead of merging them yourself.
    - First, determine the intermediate value (e.g., the date of max Y).
    - Then, use that value to filter/query the second table.
    - Ensure data types are compatible for lookups or merges.
 E. **Error Avoidance:** Generate code that is robust. If a filtering step might result in an empty DataFrame or Series, check for this (e.g., `if not df_filtered.empty:`) before trying to access elements by index (e.g., `.iloc[0]`) or perform calculations that would fail on empty data. If data is not found after filtering, print a message like "No data available for the specified criteria." 
+F. **Fast Row Lookups:** Two helpers are available without import and return the matching rows of a loaded table in their original order, using precomputed indexes instead of scanning every row:
+   - `rows_between(df, 'Date_column', 'YYYY-MM-DD', 'YYYY-MM-DD')`: rows whose date is within the bounds (both inclusive; pass `None` for an open bound).
+   - `rows_where(df, {'Column': 'value', 'Other_column': ['a', 'b']})`: rows where each column equals the value (a list means any of the values).
+   Prefer them over boolean masks for date-range and equality filters on a table as loaded from `dataframes`; they also work on any other DataFrame.
 
 User question:
 {user_question}
 
 Dataframes schemas and sample:
-{SCHEMA_TEXT}
-
+{get_schema_text()}
+{rollups_section}
 Chat_history:
 {rhistory}
 
@@ -891,22 +1362,11 @@ Todays date (dd/mm/yyyy):
 {todays_date}
 """
 
-    code_str = call_llm(system_prompt, user_question, max_tokens=1200, temperature=0.0)
-
-    # 1️⃣ Treat "404" as a retry-able error
-    MAX_RETRIES = 3          # 1 original + 2 more tries
-    attempt = 1
-    while code_str.strip() == "404" and attempt < MAX_RETRIES:
-        # ——— 2️⃣  DISTINCT REPROMPT ———
-        reprompt = (
-            system_prompt.replace("Don't give examples,", f"Retry attempt {attempt:02d} – produce real code,")
-            + "\n\n[Retry] Previous answer was '404'. "
-              "Generate executable pandas code that answers the question."
-        )
-        code_str = call_llm(reprompt, user_question, max_tokens=1200, temperature=0.0)
-        attempt += 1
+    # 1️⃣ Several candidates in parallel (hedged) instead of sequential "404" re-prompts;
+    #    the first one passing the static checks is used.
+    code_str = generate_code_candidates(system_prompt, user_question)
 
-    # 3️⃣ Cache the last good code
+    # 2️⃣ Cache the last good code
     cache_key_code = f"code_cache::{user_question.lower().strip()}"
     if code_str.strip() != "404":
         tool_cache[cache_key_code] = code_str
@@ -914,7 +1374,7 @@ Todays date (dd/mm/yyyy):
         logging.info("Using cached code for identical question after 404 refusal")
         code_str = tool_cache[cache_key_code]
 
-    # 4️⃣ Graceful final fallback
+    # 3️⃣ Graceful final fallback
     if code_str.strip() == "404":
         return {
             "result": "The data exists, but automatic code generation failed. Please try again later.",
@@ -924,126 +1384,326 @@ Todays date (dd/mm/yyyy):
     if not code_str:
         return {"result": "No information", "code": "", "table_names": []}
 
+    outcome = _run_tool2_code(code_str, user_tier)
+    if reusable and not tool2_execution_failed(outcome["result"]):
+        reuse_store.add(user_question, code_str, schema_version)
+    return outcome
+
+def tool_2_sql_run(user_question, user_tier, rhistory, engine):
+    """
+    Tool-2 through the embedded SQL engine (sql_engine.py). Returns the usual
+    {"result", "code", "table_names"} dict, or None when no valid query could be
+    generated or it failed (the caller then generates pandas code).
+    """
+    import sql_engine
+    from code_cache import get_result_cache
+
+    meta = get_table_catalog()[0]
+    system_prompt = f"""
+You are a SQL expert. Use the User Question along with the Chat_history to write ONE {engine} SQL query that answers it from the tables below.
+Only provide the SQL query and nothing else, without any markdown fences like ```sql or ```.
+If you can't answer with a single query over these tables, say "404" as a string.
+
+**Rules**:
+1. Only a single SELECT (or WITH ... SELECT) statement. No semicolons, no DDL/DML, no file or extension functions.
+2. Reference tables and columns exactly as listed, in double quotes (e.g. "Table Name"."Column Name").
+3. Only use columns that exist. Do NOT invent columns or tables.
+4. Give result columns readable aliases; the result is shown as a table (at most {sql_engine.SQL_MAX_ROWS} rows).
+5. Aggregate in SQL (SUM, COUNT, AVG, GROUP BY) rather than returning raw rows.
+6. Do not use Chat_history information directly in the query, only for context.
+
+Tables:
+{sql_engine.describe_tables(meta, engine)}
+
+Samples:
+{get_schema_text()}
+
+Chat_history:
+{rhistory}
+
+Todays date (dd/mm/yyyy):
+{todays_date}
+"""
+    sql = call_llm(system_prompt, user_question, max_tokens=800, temperature=0.0)
+    if not sql or sql.strip() == "404":
+        return None
+    try:
+        facts = sql_engine.validate_sql(sql, {fn: list(info["schema"]) for fn, info in meta.items()})
+    except sql_engine.SqlError as e:
+        logging.warning(f"[SQL] rejected generated query: {e}\n{sql}")
+        return None
+    print(f"\n[LLM GENERATED SQL]\n{facts.sql}")
+
+    for fname in facts.tables:
+        required_tier = get_file_tier(fname)
+        if user_tier < required_tier:
+            return {"result": f"User does not have access to {fname} (requires tier {required_tier}).",
+                    "code": "", "table_names": []}
+
+    table_cache = get_table_cache()
+    result_cache = get_result_cache()
+    key = sql_engine.sql_result_key(facts, {t: table_cache.fresh_etag(t) for t in facts.tables})
+    output = result_cache.get(key)
+    if output is None:
+        try:
+            dataframes = {fn: table_cache.get(fn, columns=facts.columns.get(fn)) for fn in facts.tables}
+            output = sql_engine.run_sql(facts.sql, dataframes, engine)
+        except Exception as e:
+            logging.warning(f"[SQL] query failed: {e}")
+            return None
+        key = key or sql_engine.sql_result_key(facts, {t: table_cache.etag(t) for t in facts.tables})
+        result_cache.put(key, output)
+    return {"result": output, "code": facts.sql, "table_names": facts.tables[:3],
+            "truncated": output_capture.is_truncated(output)}
+
+# Codegen candidates: the first one is requested at temperature 0; the others (slightly
+# higher temperatures) start when it comes back unusable or after CODEGEN_HEDGE_SECONDS,
+# so easy questions still cost one call. Keep the delay near the p90 codegen latency (a
+# 1200-token answer usually takes well over 4s): only the slow tail should be hedged.
+# CODEGEN_HEDGE_SECONDS=0 requests all at once.
+CODEGEN_CANDIDATES = int(os.getenv("CODEGEN_CANDIDATES", "3"))
+CODEGEN_TEMPERATURES = (0.0, 0.3, 0.6, 0.8)
+CODEGEN_HEDGE_SECONDS = float(os.getenv("CODEGEN_HEDGE_SECONDS", "20"))
+CODEGEN_REPAIRS = int(os.getenv("CODEGEN_REPAIRS", "2"))   # targeted regenerations after a failed validation
+_codegen_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.getenv("CODEGEN_WORKERS", "16")), thread_name_prefix="codegen")
+
+def validate_generated_code(code_str):
+    """
+    Static checks on a codegen candidate before anything runs (code_validation.py).
+    Returns None if it looks runnable, else the problems, one per line.
+    """
+    from code_validation import validate_code
+    text = (code_str or "").strip()
+    if not text:
+        return "empty answer"
+    if text == "404":
+        return "model answered 404"
+    if text.startswith(("LLM Error", "No content from LLM", "No choices from LLM")):
+        return text
+    try:
+        catalog = {fn: list(info["schema"]) for fn, info in get_table_catalog()[0].items()}
+    except Exception:
+        catalog = None
+    problems = validate_code(text, analyze_generated_code(text), catalog)
+    return "\n".join(f"- {p}" for p in problems) if problems else None
+
+def _is_repairable(reason):
+    # Code with concrete problems is worth one targeted fix; refusals / LLM errors are not.
+    return reason is not None and reason.startswith("- ")
+
+def _codegen_candidate(system_prompt, user_question, temperature, release, stop):
+    # Hedged candidates wait for `release` (first candidate unusable) or the hedge delay.
+    if release is not None:
+        release.wait(CODEGEN_HEDGE_SECONDS)
+    if stop.is_set():
+        return None
+    return call_llm(system_prompt, user_question, max_tokens=1200, temperature=temperature)
+
+def _codegen_repair(system_prompt, user_question, code_str, problems, stop):
+    if stop.is_set():
+        return None
+    repair_prompt = (
+        system_prompt
+        + "\n\nYour previous code was rejected before running:\n"
+        + code_str
+        + "\n\nProblems found:\n"
+        + problems
+        + "\n\nReturn the corrected code only (or \"404\" if the question cannot be answered from these tables)."
+    )
+    return call_llm(repair_prompt, user_question, max_tokens=1200, temperature=0.0)
+
+def generate_code_candidates(system_prompt, user_question, candidates=None):
+    """
+    Requests up to `candidates` codes in parallel and returns the first one that passes
+    validate_generated_code. A candidate failing validation immediately triggers a
+    targeted regeneration with its problems (up to CODEGEN_REPAIRS). Candidates not
+    started yet are cancelled, answers still in flight are discarded. Returns "404"
+    when none is usable.
+    """
+    candidates = max(1, min(candidates or CODEGEN_CANDIDATES, len(CODEGEN_TEMPERATURES)))
+    release, stop = threading.Event(), threading.Event()
+    if CODEGEN_HEDGE_SECONDS <= 0:
+        release.set()
+    labels = {
+        _codegen_executor.submit(
+            _codegen_candidate, system_prompt, user_question, CODEGEN_TEMPERATURES[i],
+            None if i == 0 else release, stop,
+        ): f"candidate {i} (t={CODEGEN_TEMPERATURES[i]})"
+        for i in range(candidates)
+    }
+    pending, repairs = set(labels), 0
+    started = time.time()
+    try:
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                label = labels[future]
+                try:
+                    code_str = future.result()
+                except Exception as e:
+                    code_str, reason = None, str(e)
+                else:
+                    if code_str is not None and code_str.strip() != "404":
+                        code_str, _ = resolve_table_names(code_str)   # before the table check
+                    reason = validate_generated_code(code_str) if code_str is not None else "cancelled"
+                if reason is None:
+                    logging.info(f"Codegen {label} accepted after {time.time() - started:.1f}s")
+                    return code_str.strip()
+                logging.info(f"Codegen {label} rejected:\n{reason}")
+                release.set()          # start the remaining candidates now
+                if _is_repairable(reason) and repairs < CODEGEN_REPAIRS:
+                    repairs += 1
+                    repair = _codegen_executor.submit(
+                        _codegen_repair, system_prompt, user_question, code_str.strip(), reason, stop)
+                    labels[repair] = f"repair {repairs} of {label}"
+                    pending.add(repair)
+    finally:
+        stop.set()
+        release.set()
+        for future in labels:
+            future.cancel()
+    return "404"
+
+def tool2_execution_failed(result):
+    """True if a Tool-2 result string is an error / refusal rather than an answer."""
+    text = str(result or "").strip()
+    return (
+        not text
+        or text.startswith(("An error occurred during code execution", "Error", "Azure connection error",
+                            "User does not have access", "The data exists, but", SANDBOX_BUSY_MESSAGE))
+        or text == "Execution completed with no output."
+    )
+
+def _run_tool2_code(code_str, user_tier):
+    # Canonical table names first: the access check and the blob paths use them.
+    code_str, corrections = resolve_table_names(code_str)
+    if corrections:
+        print(f"[TABLE NAMES CORRECTED] {corrections}")
+
+    # One analysis of the code drives the access check, table loading, column
+    # pruning and fuzzy literal correction.
+    facts = analyze_generated_code(code_str)
+
     # Check references vs. user tier
-    access_issue = reference_table_data(code_str, user_tier)
+    access_issue = reference_table_data(code_str, user_tier, facts=facts)
     if access_issue:
         # Return a short "no access" style message
         return {"result": access_issue, "code": "", "table_names": []}
     
-    # Extract table names from the code - check both patterns
-    table_names = []
-    
-    # Pattern 1: dataframes.get("filename")
-    pattern1 = re.compile(r'dataframes\.get\(\s*[\'\"]([^\'\"]+)[\'\"]\s*\)')
-    matches1 = pattern1.findall(code_str)
-    if matches1:
-        for match in matches1:
-            if match not in table_names:
-                table_names.append(match)
-    
-    # Pattern 2: pd.read_excel("filename") or pd.read_csv("filename")
-    pattern2 = re.compile(r'pd\.read_(?:excel|csv)\(\s*[\'\"]([^\'\"]+)[\'\"]\s*\)')
-    matches2 = pattern2.findall(code_str)
-    if matches2:
-        for match in matches2:
-            if match not in table_names:
-                table_names.append(match)
-    
     # Limit to max 3 table names, but keep file extensions
-    table_names = table_names[:3]
+    table_names = facts.tables[:3]
 
     #print(f"DEBUG: For question '{user_question[:50]}...'") # Identify which question run
     #print(f"DEBUG: Generated code_str:\n---\n{code_str}\n---")
     #print(f"DEBUG: Extracted table_names: {table_names}")
     #This line was changed to include only the tables needed
-    execution_result = execute_generated_code(code_str, required_tables=table_names) # Pass table_names
-    return {"result": execution_result, "code": code_str, "table_names": table_names}
-
-def execute_generated_code(code_str, required_tables=None):
-    import re
-    from rapidfuzz import process, fuzz
-
-    def fuzzy_correct_code(code_str, dataframes):
-        corrected_code = code_str
-
-        # Match exact filters: df['col'] == 'val' or df.col == 'val'
-        exact_pattern = r"((\w+)(?:\[['\"]([^'\"]+)['\"]\]|\.(\w+))\s*(?:==|eq)\s*['\"]([^'\"]+)['\"])"
-        exact_matches = re.findall(exact_pattern, code_str)
-        print(f"[FUZZY DEBUG] Found {len(exact_matches)} exact-match filters.")
-
-        for match in exact_matches:
-            full_expr, df_prefix, col1, col2, val = match
-            col = col1 or col2
-            for fname, df in dataframes.items():
-                if col in df.columns and pd.api.types.is_string_dtype(df[col]):
-                    try:
-                        unique_vals = df[col].dropna().astype(str).unique().tolist()
-                        best_match = process.extractOne(val, unique_vals, scorer=fuzz.token_sort_ratio)
-                        if best_match and best_match[1] > 85:
-                            print(f"[FUZZY FIX - EXACT] '{val}' → '{best_match[0]}' in column '{col}' (score={best_match[1]})")
-                            corrected_expr = f"{df_prefix}['{col}'] == '{best_match[0]}'"
-                            corrected_code = corrected_code.replace(full_expr, corrected_expr)
-                    except Exception as e:
-                        print(f"[FUZZY ERROR] {e}")
-
-        # Match fuzzy filters like: df['col'].str.contains('val')
-        contains_pattern = r"((\w+)(?:\[['\"]([^'\"]+)['\"]\]|\.(\w+))\.str\.contains\(\s*['\"]([^'\"]+)['\"])"
-        try:
-            contains_matches = re.findall(contains_pattern, code_str)
-        except re.error as e:
-            print(f"[REGEX ERROR] Invalid contains pattern: {e}")
-            contains_matches = []
-
-        print(f"[FUZZY DEBUG] Found {len(contains_matches)} .str.contains filters.")
-
-        for match in contains_matches:
-            if len(match) >= 5:
-                full_expr, df_prefix, col1, col2, val = match
-                col = col1 or col2
-                for fname, df in dataframes.items():
-                    if col in df.columns and pd.api.types.is_string_dtype(df[col]):
-                        try:
-                            unique_vals = df[col].dropna().astype(str).unique().tolist()
-                            best_match = process.extractOne(val, unique_vals, scorer=fuzz.token_sort_ratio)
-                            if best_match and best_match[1] > 85:
-                                print(f"[FUZZY FIX - CONTAINS] '{val}' → '{best_match[0]}' in column '{col}' (score={best_match[1]})")
-                                corrected_code = corrected_code.replace(
-                                    f".str.contains('{val}'", f".str.contains('{best_match[0]}'"
-                                )
-                        except Exception as e:
-                            print(f"[FUZZY ERROR] {e}")
-            else:
-                print(f"[FUZZY WARN] Unexpected match shape: {match}")
-                continue
+    execution_result = execute_generated_code(code_str, required_tables=table_names, facts=facts) # Pass table_names
+    # Output cut / summarized by the bounded capture (output_capture.py)
+    truncated = output_capture.is_truncated(execution_result)
+    return {"result": execution_result, "code": code_str, "table_names": table_names, "truncated": truncated}
 
-        return corrected_code
+def fuzzy_correct_code(code_str, dataframes, value_indexes=None, facts=None, partial=()):
+    """
+    Replaces string literals compared with a text column (==, !=, .isin, .str.contains)
+    by the closest distinct value of that column (token_sort_ratio > 85). The literals
+    come from the code analysis (`facts`), matching uses the per-table ValueIndex
+    (batched per column, memoized per table version); tables without a cached index
+    get a temporary one. `partial` names the frames holding only some rows of their table.
+    """
+    from value_index import ValueIndex
+
+    facts = facts or analyze_generated_code(code_str)
+    if facts.error:
+        print(f"[FUZZY WARN] Code not analyzable, skipping correction: {facts.error}")
+        return code_str
+
+    value_indexes = dict(value_indexes or {})
+    for fname, df in dataframes.items():
+        if value_indexes.get(fname) is None:
+            value_indexes[fname] = ValueIndex(df, partial_rows=fname in (partial or ()))
+
+    print(f"[FUZZY DEBUG] Found {len(facts.filters)} literal filters.")
+
+    # All literals per (tables, column), so each column is matched in one batch.
+    literals_by_col = OrderedDict()
+    for f in facts.filters:
+        literals_by_col.setdefault((tuple(f["tables"]), f["column"]), []).append(f["value"])
+
+    # The column's own table if the analysis resolved it, otherwise the first loaded
+    # table (in load order) that has the column as text and a good match.
+    best = {}
+    for (tables, col), literals in literals_by_col.items():
+        candidates = [value_indexes[t] for t in tables if t in value_indexes] or list(value_indexes.values())
+        for index in candidates:
+            try:
+                for val, hit in index.match(col, literals).items():
+                    best.setdefault((tables, col, val), hit)
+            except Exception as e:
+                print(f"[FUZZY ERROR] {e}")
+
+    replacements = []
+    for f in facts.filters:
+        hit = best.get((tuple(f["tables"]), f["column"], f["value"]))
+        if hit and hit[0] != f["value"]:
+            print(f"[FUZZY FIX - {f['op']}] '{f['value']}' → '{hit[0]}' in column '{f['column']}' (score={hit[1]})")
+            replacements.append((f["span"], repr(hit[0])))
 
+    from code_analysis import replace_spans
+    return replace_spans(code_str, replacements)
+
+def execute_generated_code(code_str, required_tables=None, facts=None):
+    """
+    Loads `required_tables` (only the columns the code reads, when the analysis can
+    prove them) and runs the generated code. `facts` is its CodeFacts, if computed.
+    """
+    import pandas as pd
+    from code_cache import result_key
+    from dtype_layout import has_categories, compat_rewrite, needs_object_columns
+
+    facts = facts or analyze_generated_code(code_str)
 
-    account_url = CONFIG["ACCOUNT_URL"]
-    sas_token = CONFIG["SAS_TOKEN"]
-    container_name = CONFIG["CONTAINER_NAME"]
     target_folder_path = CONFIG["TARGET_FOLDER_PATH"]
 
+    # Same script on the same table versions: answer without loading or running it.
+    result_cache = code_cache.get_result_cache()
+    raw_key = result_key(code_str, {t: get_table_cache().fresh_etag(t) for t in required_tables or []})
+    cached_output = result_cache.get(raw_key)
+    if cached_output is not None:
+        print("[RESULT CACHE] hit, skipping table loading and execution")
+        return cached_output
+
     dataframes = {}
+    value_indexes = {}
+    shared = set()        # names whose frame is the cache's shared copy
+    partial = set()       # names whose frame holds only the rows of the code's date ranges
+    etags = {}            # name -> ETag of the table version its frame was taken from
 
     if required_tables:
         try:
-            blob_service_client = BlobServiceClient(account_url=account_url, credential=sas_token)
-            container_client = blob_service_client.get_container_client(container_name)
+            table_cache = get_table_cache()
 
             for file_name in required_tables:
                 blob_name = os.path.join(target_folder_path, file_name).replace("\\", "/")
 
                 try:
-                    blob_client = container_client.get_blob_client(blob_name)
-                    blob_data = blob_client.download_blob().readall()
-
-                    if file_name.lower().endswith(('.xlsx', '.xls')):
-                        df = pd.read_excel(io.BytesIO(blob_data))
-                        dataframes[file_name] = df
-                    elif file_name.lower().endswith('.csv'):
-                        df = pd.read_csv(io.BytesIO(blob_data))
-                        dataframes[file_name] = df
+                    if file_name.lower().endswith(('.xlsx', '.xls', '.csv')):
+                        columns = facts.columns.get(file_name)
+                        # Code proven to read only some date ranges of the table gets
+                        # just those rows (a new frame), if they can be served that way.
+                        bounds = facts.row_bounds.get(file_name)
+                        rows = table_cache.get_rows(file_name, bounds, columns=columns) if bounds else None
+                        if rows is not None:
+                            dataframes[file_name], etags[file_name] = rows
+                            partial.add(file_name)
+                        else:
+                            # Column subsets are new frames; without pruning this is the
+                            # cache's shared frame (copied before an in-process exec).
+                            dataframes[file_name] = table_cache.get(file_name, columns=columns)
+                            etags[file_name] = table_cache.etag(file_name)
+                            if columns is None:
+                                shared.add(file_name)
+                        value_indexes[file_name] = table_cache.value_index(file_name)
                 except Exception as blob_error:
                     err_msg = f"Error loading required table '{blob_name}': {blob_error}"
                     print(err_msg)
@@ -1065,35 +1725,197 @@ def execute_generated_code(code_str, required_tables=None):
     if not dataframes and ("dataframes.get(" in code_str):
          return "Error: Failed to load required tables before code execution."
 
-    code_modified = code_str.replace("pd.read_excel(", "dataframes.get(")
-    code_modified = code_modified.replace("pd.read_csv(", "dataframes.get(")
-
     # ✅ Add debug print BEFORE correction
     print(f"\n[RAW LLM GENERATED CODE]\n{code_str}")
 
-    code_modified = fuzzy_correct_code(code_modified, dataframes)
+    # Literal spans in `facts` refer to code_str, so correct before any other rewrite.
+    code_modified = fuzzy_correct_code(code_str, dataframes, value_indexes, facts, partial)
 
-    # ✅ Add debug print AFTER correction
-    print(f"\n[CODE AFTER FUZZY FIX]\n{code_modified}")
+    code_modified = code_modified.replace("pd.read_excel(", "dataframes.get(")
+    code_modified = code_modified.replace("pd.read_csv(", "dataframes.get(")
 
-    output_buffer = StringIO()
-    try:
-        with contextlib.redirect_stdout(output_buffer):
-            local_vars = {
-                "dataframes": dataframes,
-                "pd": pd,
-                "datetime": datetime
-            }
-            exec(code_modified, {"pd": pd, "datetime": datetime}, local_vars)
+    # Category columns (dtype_layout.py): observed=True groupbys, or object columns for
+    # code whose output depends on how they order / type the values they list.
+    categorized = any(has_categories(df) for df in dataframes.values())
+    decategorized = categorized and needs_object_columns(code_modified)
+    if categorized and not decategorized:
+        code_modified = compat_rewrite(code_modified)
 
-        output = output_buffer.getvalue().strip()
-        return output if output else "Execution completed with no output."
+    # ✅ Add debug print AFTER correction
+    print(f"\n[CODE AFTER FUZZY FIX]\n{code_modified}")
 
-    except Exception as exec_error:
-        err_msg = f"An error occurred during code execution: {exec_error}"
-        print(err_msg)
-        logging.error(err_msg)
-        return f"{err_msg}\n--- Failing Code ---\n{code_modified}\n--- End Code ---"
+    # Different raw scripts can correct to the same one: check again before running.
+    corrected_key = result_key(code_modified, etags)
+    cached_output = result_cache.get(corrected_key)
+    if cached_output is not None:
+        print("[RESULT CACHE] hit on corrected code, skipping execution")
+        result_cache.put(raw_key, cached_output)
+        return cached_output
+
+    # Code reading the rollup cubes gets those of its tables (same versions as the frames).
+    extras = None
+    if re.search(r"\brollups\s*\[", code_modified):
+        import rollups
+        cubes = [get_rollup_cube(name) for name in dataframes]
+        extras = {"rollups": rollups.cube_namespace([c for c in cubes if c is not None])}
+
+    result = _run_optimized(code_modified, dataframes, shared, facts, extras, partial, decategorized, etags)
+    if result is None:
+        result = run_generated_code(code_modified, dataframes, shared, facts, extras=extras,
+                                    decategorized=decategorized, partial=partial, etags=etags)
+    if not result["ok"] and not (result.get("busy") or result.get("killed")) and categorized and not decategorized:
+        # Code that fails on category columns (new values assigned into them, string
+        # concatenation, ...) gets one re-run with those columns as object; not code the
+        # sandbox stopped at its time / memory limit.
+        logging.info(f"Re-running with category columns as object after: {result['error']}")
+        retry = run_generated_code(code_modified, dataframes, shared, facts, extras=extras, decategorized=True,
+                                   partial=partial, etags=etags)
+        if retry["ok"]:
+            result = retry
+    if result["ok"]:
+        output = result["output"].strip()
+        output = output if output else "Execution completed with no output."
+        result_cache.put(raw_key, output)
+        result_cache.put(corrected_key, output)
+        return output
+    if result.get("busy"):
+        return result["error"]
+
+    err_msg = f"An error occurred during code execution: {result['error']}"
+    print(err_msg)
+    logging.error(err_msg)
+    return f"{err_msg}\n--- Failing Code ---\n{code_modified}\n--- End Code ---"
+
+def _run_optimized(code_modified, dataframes, shared, facts, extras, partial, decategorized=False, etags=None):
+    """
+    Runs `code_modified` with the slow pandas idioms rewritten (code_optimizer.py).
+    Returns the result, or None when nothing was rewritten or the rewritten code failed
+    (the caller then runs the original) without being killed by the sandbox.
+    """
+    import code_optimizer
+
+    optimized, applied = code_optimizer.optimize(code_modified)
+    if not applied:
+        return None
+    print(f"\n[CODE AFTER OPTIMIZER] {applied}\n{optimized}")
+    helpers = dict(extras or {}, **code_optimizer.HELPERS)
+    started = time.perf_counter()
+    result = run_generated_code(optimized, dataframes, shared, facts, extras=helpers, decategorized=decategorized,
+                                partial=partial, etags=etags)
+    seconds_after = time.perf_counter() - started
+    if result.get("busy"):
+        return result
+    if result.get("killed"):
+        # Over the sandbox's limits: the original would only hit them again.
+        code_optimizer.record(applied, seconds_after)
+        return result
+    if not result["ok"]:
+        logging.warning(f"[Optimizer] rewritten code failed ({result['error']}), running the original")
+        code_optimizer.record(applied, seconds_after, fallback=True)
+        return None
+    if not code_optimizer.CODE_OPTIMIZER_COMPARE:
+        code_optimizer.record(applied, seconds_after)
+        return result
+
+    started = time.perf_counter()
+    original = run_generated_code(code_modified, dataframes, shared, facts, extras=extras, decategorized=decategorized,
+                                  partial=partial, etags=etags)
+    seconds_before = time.perf_counter() - started
+    mismatch = original != result
+    code_optimizer.record(applied, seconds_after, seconds_before=seconds_before, mismatch=mismatch)
+    logging.info(f"[Optimizer] {applied}: {seconds_before:.3f}s -> {seconds_after:.3f}s"
+                 f"{' (OUTPUT DIFFERS, keeping the original)' if mismatch else ''}")
+    return original if mismatch else result
+
+SANDBOX_BUSY_MESSAGE = "The analysis service is busy right now, please try again in a moment."
+
+def run_generated_code(code_modified, dataframes, shared=(), facts=None, extras=None, decategorized=False,
+                       partial=(), etags=None):
+    """
+    Executes final generated code, in the sandbox pool (code_sandbox.py) when it is
+    enabled, otherwise in-process. Returns {"ok": True, "output"} or {"ok": False, "error"},
+    with "busy" set when the sandbox had no worker for the job (nothing was run) and
+    "killed" when it stopped the code at its time / memory limit.
+    `shared` names the frames that belong to the table cache and must not be mutated;
+    `extras` are additional names for the code's namespace (e.g. `rollups`);
+    `decategorized` hands the code its frames with category columns as object;
+    `partial` names the frames holding only the rows of facts.row_bounds;
+    `etags` ({name: ETag}) are the table versions the frames were taken from (default:
+    the cache's current ones).
+    """
+    import code_sandbox
+
+    pool = code_sandbox.get_pool()
+    if pool is not None:
+        table_cache = get_table_cache()
+        store = table_cache.store
+        tables = {}
+        for name, df in dataframes.items():
+            etag = etags[name] if etags and name in etags else table_cache.etag(name)
+            if store is not None and etag and store.has(name, etag):
+                # Attached in the sandbox from the shared store, nothing to pickle.
+                columns = None if name in shared or facts is None else facts.columns.get(name)
+                rows = facts.row_bounds.get(name) if name in partial else None
+                tables[name] = {"etag": etag, "columns": columns, "rows": rows, "frame": None}
+            else:
+                tables[name] = {"etag": etag, "columns": None, "frame": df}
+        try:
+            while True:
+                result = pool.run(code_modified, tables, store_root=store.root if store is not None else None,
+                                  extras=extras, decategorized=decategorized)
+                missing = result.get("missing_table")
+                if missing not in tables or tables[missing]["frame"] is not None:
+                    return result
+                # The store version went away before the worker attached it: send our frame.
+                logging.info(f"Sandbox could not attach '{missing}' from the store, sending the frame")
+                tables[missing] = {"etag": tables[missing]["etag"], "columns": None, "frame": dataframes[missing]}
+        except code_sandbox.SandboxError as e:
+            # Never exec in this worker because the sandbox is saturated: that is exactly
+            # when unbounded code would stall every other request.
+            logging.warning(f"Sandbox unavailable, not executing: {e}")
+            return {"ok": False, "error": SANDBOX_BUSY_MESSAGE, "busy": True}
+
+    import pandas as pd
+    from dtype_layout import decategorize
+    from table_index import make_helpers
+    from frame_isolation import FRAME_ISOLATION, isolate, is_read_only_error
+
+    # The generated code may modify its frames in place: it gets copy-on-write views of
+    # them (frame_isolation.py), or private copies once it has written into their arrays.
+    # Frames it does not share with the cache are isolated too, so a re-run (retry,
+    # optimizer fallback) always starts from the frames as loaded.
+    for private in (False, True):
+        if private or not FRAME_ISOLATION:
+            local_frames = {name: (df.copy() if private or name in shared else df) for name, df in dataframes.items()}
+        else:
+            local_frames = {name: isolate(df) for name, df in dataframes.items()}
+        if decategorized:
+            local_frames = {name: decategorize(df) for name, df in local_frames.items()}
+        # rows_between / rows_where over the row indexes of the cached table versions.
+        index_of = {}
+        for name, df in local_frames.items():
+            table_index = get_table_cache().table_index(name) if name not in partial else None
+            if table_index is not None:
+                index_of[id(df)] = (df.index, table_index)
+        # Per-thread capture: parallel Tool-2 jobs never share an output buffer.
+        try:
+            with output_capture.capture() as output_buffer:
+                print_fn = output_capture.make_print(output_buffer)
+                local_vars = {
+                    "dataframes": local_frames,
+                    "pd": pd,
+                    "datetime": datetime,
+                    "print": print_fn
+                }
+                local_vars.update(make_helpers(index_of))
+                local_vars.update(extras or {})
+                exec(code_cache.compile_cached(code_modified),
+                     {"pd": pd, "datetime": datetime, "print": print_fn}, local_vars)
+            return {"ok": True, "output": output_buffer.getvalue()}
+        except Exception as exec_error:
+            if private or not FRAME_ISOLATION or not is_read_only_error(exec_error):
+                return {"ok": False, "error": str(exec_error)}
+            logging.info(f"Re-running on private copies of the tables after: {exec_error}")
 
 
 #######################################################################################
@@ -1127,6 +1949,12 @@ def final_answer_llm(user_question, index_dict, python_dict):
         return
 
     combined_info = f"INDEX_DATA:\n{index_top_k}\n\nPYTHON_DATA:\n{python_result}"
+    if python_dict.get("truncated"):
+        combined_info += (
+            "\n\nNOTE: PYTHON_DATA was too large and is truncated or summarized (see the "
+            "[output truncated ...] / [summary of ...] lines). Do not present it as complete "
+            "and do not invent the missing rows; use the row counts and aggregates given."
+        )
 
     # ########################################################################
     # # JSON RESPONSE FORMAT - REMOVE COMMENTS TO ENABLE
@@ -1572,12 +2400,7 @@ def Log_Interaction(
     current_time = datetime.now().strftime("%H:%M:%S")
 
     # 6) Write to Azure Blob CSV
-    account_url = CONFIG["ACCOUNT_URL"]
-    sas_token = CONFIG["SAS_TOKEN"]
-    container_name = CONFIG["CONTAINER_NAME"]
-
-    blob_service_client = BlobServiceClient(account_url=account_url, credential=sas_token)
-    container_client = blob_service_client.get_container_client(container_name)
+    container_client = get_container_client()
 
     target_folder_path = "UI/2024-11-20_142337_UTC/cxqa_data/logs/"
     date_str = datetime.now().strftime("%Y_%m_%d")
@@ -1647,7 +2470,7 @@ def agent_answer(user_question, user_tier=1, recent_history=None):
         return
     logging.info(f"Cache miss for question: {user_question_stripped}")
 
-    question_needs_tables = references_tabular_data(user_question, TABLES)
+    question_needs_tables = references_tabular_data(user_question, get_tables_text())
 
     index_dict  = {"top_k": "No information", "file_names": []}
     python_dict = {"result": "No information", "code": "", "table_names": []}
@@ -1958,7 +2781,11 @@ def robust_split_question(user_question, use_semantic_parsing=True):
             seen.add(sq)
     return result
 
-_tool2_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+# Generated code output is captured per thread (output_capture.py), so Tool-2 jobs can
+# run side by side; the sandbox pool bounds how many execute at once.
+TOOL2_MAX_WORKERS = int(os.getenv("TOOL2_MAX_WORKERS", "8"))
+_tool2_executor = concurrent.futures.ThreadPoolExecutor(max_workers=TOOL2_MAX_WORKERS,
+                                                        thread_name_prefix="tool2")
 
 def _run_tool2_async(q, user_tier, rhist):
     return _tool2_executor.submit(tool_2_code_run,
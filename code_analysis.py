@@ -0,0 +1,827 @@
+# Code analysis
+# Parses the pandas code generated by Tool-2 once with `ast` and extracts everything the
+# pipeline needs from it, replacing the separate regex scans in reference_table_data,
+# tool_2_code_run and fuzzy_correct_code.
+#
+# analyze_code() returns CodeFacts:
+#   tables        referenced table files, in order of appearance. Covers dataframes.get(..),
+#                 dataframes[..], pd.read_excel / read_csv(..), variables holding a file name
+#                 and any other string literal naming a table file (loops over file lists).
+#   aliases       variable -> tables it holds (frames loaded from / filtered out of a table)
+#   columns       table -> list of the columns the code can read, or None when that cannot be
+#                 proven (whole-frame use such as print(df), df.merge(..), df.iloc[:, 3], ..)
+#   filters       literal comparisons on a column (==, !=, .eq/.ne, .isin, .str.contains),
+#                 with the source span of each literal
+#   date_filters  comparisons of a column with a date literal (<, <=, >, >=, .between,
+#                 .dt.year == ..); date_ranges holds their intersection per (table, column)
+#                 for the ones that restrict rows of a frame through `&` only
+#   unknown_columns  column reads on a table frame (x['col'], x[['a', 'b']], x.loc[.., 'col'])
+#                 naming a column that is in none of its tables' schemas and is not
+#                 created anywhere in the code (assignment, rename, assign, named agg, ..)
+#   row_bounds    table -> {date column: [(lo, lo_inclusive, hi, hi_inclusive), ..]} when it
+#                 is proven that the code reads no row of the table outside the union of
+#                 those ranges: every use of the loaded rows reaches a literal date
+#                 restriction (x[(x['d'] >= '2024-03-01') & ..], rows_between(x, 'd', ..))
+#                 through nothing but copies, elementwise row filters, column writes and
+#                 top-level assignments. Tables without such a proof are left out.
+#
+# The row lookup helpers of the exec namespace (table_index.py) count as row filters:
+# rows_where(x, {'col': 'v'}) as ==/isin filters, rows_between(x, 'col', lo, hi) as a
+# date filter restricting the rows of x.
+#
+# Stdlib only, so it is cheap to import and can run before any table is loaded.
+
+import re
+import ast
+import datetime as _dt
+
+TABLE_EXTENSIONS = (".xlsx", ".xls", ".csv")
+
+_LOADER_MODULES = {"pd", "pandas"}
+_LOADER_FUNCS = {"read_excel", "read_csv"}
+
+# Methods returning a frame with the same columns (row subset / reorder / copy).
+_FRAME_PRESERVING = {
+    "copy", "head", "tail", "sort_values", "sort_index", "reset_index", "set_index",
+    "rename", "query", "nlargest", "nsmallest", "fillna", "astype", "assign", "drop",
+    "dropna", "drop_duplicates", "sample", "round", "abs",
+}
+# ... of which these look at every column of a row unless given `subset`.
+_NEEDS_SUBSET = {"dropna", "drop_duplicates"}
+# Row lookup helpers (table_index.py): helper(frame, ...) -> rows of frame.
+_ROW_HELPERS = {"rows_between", "rows_where"}
+
+# Series methods computing each row from that row only (safe on a subset of the rows).
+_ELEMENTWISE = {
+    "between", "isin", "eq", "ne", "lt", "le", "gt", "ge", "notna", "isna", "notnull", "isnull",
+    "contains", "startswith", "endswith", "match", "fullmatch", "lower", "upper", "strip",
+    "astype", "abs", "round", "normalize", "floor", "ceil", "strftime", "to_period",
+    "to_datetime", "to_numeric",
+}
+
+_ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2})?)?$")
+_WORD_RE = re.compile(r"`([^`]+)`|(\w+)")
+
+
+class CodeFacts:
+    __slots__ = ("tables", "aliases", "columns", "filters", "date_filters", "date_ranges",
+                 "unknown_columns", "row_bounds", "dynamic_loads", "error")
+
+    def __init__(self):
+        self.tables = []
+        self.aliases = {}
+        self.columns = {}
+        self.filters = []
+        self.date_filters = []
+        self.date_ranges = {}
+        self.unknown_columns = []
+        self.row_bounds = {}
+        self.dynamic_loads = False   # a loader call whose table name could not be resolved
+        self.error = None            # SyntaxError message if the code does not parse
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def _is_table_name(value):
+    return isinstance(value, str) and value.lower().endswith(TABLE_EXTENSIONS)
+
+
+def _str_const(node):
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    return None
+
+
+def _row_helper_frame(node):
+    """Frame argument of rows_between(..) / rows_where(..), else None."""
+    if isinstance(node, ast.Call) and getattr(node.func, "id", None) in _ROW_HELPERS and node.args:
+        return node.args[0]
+    return None
+
+
+def _rows_between_range(node):
+    """(column, (lo, True, hi, True)) of rows_between(x, 'col', lo, hi) with a literal bound, else None."""
+    if not (isinstance(node, ast.Call) and getattr(node.func, "id", None) == "rows_between"
+            and len(node.args) >= 2 and _str_const(node.args[1]) is not None):
+        return None
+    bounds = dict(zip(("start", "end"), node.args[2:4]))
+    bounds.update({k.arg: k.value for k in node.keywords if k.arg in ("start", "end")})
+    lo = _date_literal(bounds["start"]) if "start" in bounds else None
+    hi = _date_literal(bounds["end"]) if "end" in bounds else None
+    # A bound that is not a literal (variable, expression) is unknown, not open.
+    for key, value in (("start", lo), ("end", hi)):
+        if key in bounds and value is None and not (isinstance(bounds[key], ast.Constant) and bounds[key].value is None):
+            return None
+    if lo is None and hi is None:
+        return None
+    return node.args[1].value, (lo, lo is not None, hi, hi is not None)
+
+
+def _date_literal(node):
+    """ISO string for pd.Timestamp('..'), pd.to_datetime('..'), datetime(y, m, d) or '2024-01-31'."""
+    text = _str_const(node)
+    if text is None and isinstance(node, ast.Call) and node.args:
+        func = node.func
+        if (func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", None)) in ("Timestamp", "to_datetime"):
+            text = _str_const(node.args[0])
+    if text is not None:
+        if not _ISO_DATE_RE.match(text.strip()):
+            return None
+        try:
+            return _dt.datetime.fromisoformat(text.strip()).isoformat(sep=" ")
+        except ValueError:
+            return None
+    if not isinstance(node, ast.Call) or not node.args:
+        return None
+    func = node.func
+    name = func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", None)
+    if name in ("datetime", "date"):
+        parts = [a.value for a in node.args if isinstance(a, ast.Constant) and isinstance(a.value, int)]
+        if len(parts) == len(node.args) and len(parts) >= 3:
+            try:
+                return _dt.datetime(*parts).isoformat(sep=" ")
+            except ValueError:
+                return None
+    return None
+
+
+class _Analyzer:
+    def __init__(self, tree, schemas):
+        self.tree = tree
+        self.schemas = schemas or {}
+        self.parents = {}
+        for node in ast.walk(tree):
+            for child in ast.iter_child_nodes(node):
+                self.parents[child] = node
+        self.facts = CodeFacts()
+        self.str_vars = {}
+        self.unprovable = set()
+        self.names_pool = set()
+        self.date_filter_nodes = []   # (filter node, column read node, date filter)
+
+    # ---------------------------------------------------------------- helpers --
+    def _resolve_names(self, node):
+        """File names a loader argument can hold: a literal or a variable bound to literals."""
+        text = _str_const(node)
+        if text is not None:
+            return [text]
+        if isinstance(node, ast.Name) and node.id in self.str_vars:
+            return self.str_vars[node.id]
+        return None
+
+    def _loader_arg(self, node):
+        """Argument node if `node` loads a table (dataframes.get / dataframes[..] / pd.read_*)."""
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.args:
+            func = node.func
+            if isinstance(func.value, ast.Name):
+                if func.value.id == "dataframes" and func.attr == "get":
+                    return node.args[0]
+                if func.value.id in _LOADER_MODULES and func.attr in _LOADER_FUNCS:
+                    return node.args[0]
+        if (isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name)
+                and node.value.id == "dataframes" and isinstance(node.ctx, ast.Load)):
+            return node.slice
+        return None
+
+    def _frame_tables(self, node):
+        """Tables whose rows a frame expression holds (alias, load, row filter, ...), or empty."""
+        while True:
+            arg = self._loader_arg(node)
+            if arg is not None:
+                return set(self._resolve_names(arg) or [])
+            if isinstance(node, ast.Name):
+                return set(self.facts.aliases.get(node.id, ()))
+            if isinstance(node, ast.Subscript):
+                node = node.value
+                if isinstance(node, ast.Attribute) and node.attr in ("loc", "iloc", "at", "iat"):
+                    node = node.value
+                continue
+            if isinstance(node, ast.Attribute):
+                node = node.value
+                continue
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+                node = node.func.value
+                continue
+            if _row_helper_frame(node) is not None:
+                node = _row_helper_frame(node)
+                continue
+            return set()
+
+    def _same_columns_tables(self, node):
+        """Like _frame_tables, but only through expressions keeping the table's columns."""
+        while True:
+            arg = self._loader_arg(node)
+            if arg is not None:
+                return set(self._resolve_names(arg) or [])
+            if isinstance(node, ast.Name):
+                return set(self.facts.aliases.get(node.id, ()))
+            if isinstance(node, ast.Subscript) and not self._is_column_selection(node.slice):
+                node = node.value
+                if isinstance(node, ast.Attribute) and node.attr in ("loc", "iloc"):
+                    node = node.value
+                continue
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) \
+                    and node.func.attr in _FRAME_PRESERVING | {"groupby"}:
+                node = node.func.value
+                continue
+            if _row_helper_frame(node) is not None:
+                node = _row_helper_frame(node)
+                continue
+            return set()
+
+    @staticmethod
+    def _is_column_selection(node):
+        if _str_const(node) is not None:
+            return True
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            return True
+        if isinstance(node, (ast.List, ast.Tuple)) and node.elts:
+            return all(_str_const(e) is not None for e in node.elts)
+        return False
+
+    def _column_of(self, node):
+        """(tables, column) if `node` reads one column: x['col'] / x.col / x.loc[.., 'col']."""
+        if isinstance(node, ast.Subscript):
+            col = _str_const(node.slice)
+            if col is not None:
+                return self._frame_tables(node.value), col
+            if isinstance(node.slice, ast.Tuple) and len(node.slice.elts) == 2:
+                col = _str_const(node.slice.elts[1])
+                if col is not None:
+                    return self._frame_tables(node.value), col
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+            tables = self._frame_tables(node.value)
+            if tables and any(node.attr in map(str, self.schemas.get(t, ())) for t in tables):
+                return tables, node.attr
+        return None
+
+    # ----------------------------------------------------------------- passes --
+    def collect_names(self):
+        for node in ast.walk(self.tree):
+            if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+                value = node.value
+                if _str_const(value) is not None:
+                    self.str_vars.setdefault(node.targets[0].id, []).append(value.value)
+                elif isinstance(value, (ast.List, ast.Tuple, ast.Set)):
+                    texts = [_str_const(e) for e in value.elts]
+                    if texts and all(t is not None for t in texts):
+                        self.str_vars.setdefault(node.targets[0].id, []).extend(texts)
+
+            if isinstance(node, ast.Constant):
+                self.names_pool.add(str(node.value))
+                if isinstance(node.value, str):
+                    for quoted, word in _WORD_RE.findall(node.value):
+                        self.names_pool.add(quoted or word)
+            elif isinstance(node, ast.Name):
+                self.names_pool.add(node.id)
+            elif isinstance(node, ast.Attribute):
+                self.names_pool.add(node.attr)
+
+    def collect_tables(self):
+        found = []
+        for node in ast.walk(self.tree):
+            arg = self._loader_arg(node)
+            if arg is not None:
+                names = self._resolve_names(arg)
+                if names is None:
+                    self.facts.dynamic_loads = True
+                else:
+                    found.extend((node.lineno, node.col_offset, n) for n in names)
+            text = _str_const(node)
+            if _is_table_name(text):
+                found.append((node.lineno, node.col_offset, text))
+        for _, _, name in sorted(found, key=lambda t: (t[0], t[1])):
+            if name not in self.facts.tables:
+                self.facts.tables.append(name)
+
+    def collect_aliases(self):
+        assigns = [n for n in ast.walk(self.tree) if isinstance(n, ast.Assign)]
+        for node in sorted(assigns, key=lambda n: (n.lineno, n.col_offset)):
+            if len(node.targets) != 1 or not isinstance(node.targets[0], ast.Name):
+                continue
+            value = node.value
+            if isinstance(value, ast.Subscript) and self._is_column_selection(value.slice) \
+                    and self._loader_arg(value) is None:
+                continue   # x = df['col'] / df[['a', 'b']]: a column subset, not a table alias
+            if isinstance(value, ast.Call) and isinstance(value.func, ast.Attribute) \
+                    and self._loader_arg(value) is None and value.func.attr not in _FRAME_PRESERVING:
+                continue
+            tables = self._frame_tables(value)
+            if tables:
+                self.facts.aliases.setdefault(node.targets[0].id, set()).update(tables)
+
+    def check_uses(self):
+        for node in ast.walk(self.tree):
+            tables = None
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id in self.facts.aliases:
+                tables = self.facts.aliases[node.id]
+            elif self._loader_arg(node) is not None:
+                tables = set(self._resolve_names(self._loader_arg(node)) or [])
+            if tables and not self._use_is_column_bound(node):
+                self.unprovable.update(tables)
+
+    def _use_is_column_bound(self, cur):
+        """True if the frame at `cur` is only used through named columns / row filters."""
+        while True:
+            parent = self.parents.get(cur)
+
+            if isinstance(parent, ast.Subscript) and parent.value is cur:
+                if not isinstance(parent.ctx, ast.Load) or self._is_column_selection(parent.slice):
+                    return True
+                cur = parent                          # row filter: still the whole frame
+                continue
+
+            if isinstance(parent, ast.Attribute) and parent.value is cur:
+                attr, outer = parent.attr, self.parents.get(parent)
+                if attr in ("loc", "at") and isinstance(outer, ast.Subscript):
+                    if not isinstance(outer.ctx, ast.Load):
+                        return True
+                    if isinstance(outer.slice, ast.Tuple) and len(outer.slice.elts) == 2:
+                        return self._is_column_selection(outer.slice.elts[1])
+                    cur = outer
+                    continue
+                if attr == "iloc" and isinstance(outer, ast.Subscript) and isinstance(outer.ctx, ast.Load):
+                    if isinstance(outer.slice, ast.Slice):
+                        cur = outer
+                        continue
+                    return False
+                if attr == "shape":
+                    return isinstance(outer, ast.Subscript) and getattr(outer.slice, "value", None) == 0
+                if attr in ("empty", "index"):
+                    return True
+                if self._column_of(parent) is not None:
+                    return True
+                if isinstance(outer, ast.Call) and outer.func is parent:
+                    return self._method_is_column_bound(attr, outer)
+                return False
+
+            if isinstance(parent, ast.Call) and cur in parent.args and getattr(parent.func, "id", None) == "len":
+                return True
+            if _row_helper_frame(parent) is cur:
+                cur = parent                          # row lookup: still the whole frame
+                continue
+            if isinstance(parent, ast.Assign) and parent.value is cur:
+                return all(isinstance(t, ast.Name) for t in parent.targets)
+            if isinstance(parent, ast.Compare) and all(isinstance(op, (ast.Is, ast.IsNot)) for op in parent.ops):
+                return True
+            return False
+
+    def _method_is_column_bound(self, method, call):
+        kwargs = {k.arg for k in call.keywords}
+        if method in _FRAME_PRESERVING:
+            if method in _NEEDS_SUBSET and "subset" not in kwargs and not call.args:
+                return False
+            return self._use_is_column_bound(call)
+        if method == "groupby":
+            outer = self.parents.get(call)
+            if isinstance(outer, ast.Subscript) and outer.value is call:
+                return self._is_column_selection(outer.slice)
+            if isinstance(outer, ast.Attribute) and outer.value is call:
+                if outer.attr in ("size", "ngroups", "groups", "indices"):
+                    return True
+                agg_call = self.parents.get(outer)
+                if outer.attr in ("agg", "aggregate") and isinstance(agg_call, ast.Call) \
+                        and agg_call.args and isinstance(agg_call.args[0], ast.Dict):
+                    return True
+            return False
+        if method == "pivot_table":
+            return "values" in kwargs
+        return False
+
+    def collect_filters(self):
+        for node in ast.walk(self.tree):
+            if isinstance(node, ast.Compare) and len(node.ops) == 1 and isinstance(node.ops[0], (ast.Eq, ast.NotEq)):
+                op = "==" if isinstance(node.ops[0], ast.Eq) else "!="
+                for col_node, lit_node in ((node.left, node.comparators[0]), (node.comparators[0], node.left)):
+                    self._add_filter(col_node, op, lit_node)
+            elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.args:
+                attr, target = node.func.attr, node.func.value
+                if attr in ("eq", "ne"):
+                    self._add_filter(target, "==" if attr == "eq" else "!=", node.args[0])
+                elif attr == "isin" and isinstance(node.args[0], (ast.List, ast.Tuple, ast.Set)):
+                    for elt in node.args[0].elts:
+                        self._add_filter(target, "isin", elt)
+                elif attr == "contains" and isinstance(target, ast.Attribute) and target.attr == "str":
+                    self._add_filter(target.value, "contains", node.args[0])
+            elif isinstance(node, ast.Call) and getattr(node.func, "id", None) == "rows_where" \
+                    and len(node.args) >= 2 and isinstance(node.args[1], ast.Dict):
+                tables = self._frame_tables(node.args[0])
+                for key, value in zip(node.args[1].keys, node.args[1].values):
+                    column = _str_const(key) if key is not None else None
+                    if not tables or column is None:
+                        continue
+                    if isinstance(value, (ast.List, ast.Tuple, ast.Set)):
+                        for elt in value.elts:
+                            self._record_filter(tables, column, "isin", elt)
+                    else:
+                        self._record_filter(tables, column, "==", value)
+
+    def _add_filter(self, col_node, op, lit_node):
+        found = self._column_of(col_node)
+        if found is not None:
+            self._record_filter(found[0], found[1], op, lit_node)
+
+    def _record_filter(self, tables, column, op, lit_node):
+        value = _str_const(lit_node)
+        if value is None:
+            return
+        self.facts.filters.append({
+            "tables": sorted(tables),
+            "column": column,
+            "op": op,
+            "value": value,
+            "span": (lit_node.lineno, lit_node.col_offset, lit_node.end_lineno, lit_node.end_col_offset),
+        })
+
+    def collect_column_refs(self):
+        if not self.schemas:
+            return
+        reads, read_nodes = [], set()
+        for node in ast.walk(self.tree):
+            frame = _row_helper_frame(node)
+            if frame is not None and len(node.args) >= 2:
+                # rows_between(x, 'col', ..) / rows_where(x, {'col': ..})
+                arg = node.args[1]
+                keys = list(arg.keys) if isinstance(arg, ast.Dict) and node.func.id == "rows_where" else [arg]
+                keys = [k for k in keys if _str_const(k) is not None]
+                tables = self._same_columns_tables(frame)
+                if tables and keys:
+                    reads.extend((k, tables) for k in keys)
+                    read_nodes.update(id(k) for k in keys)
+                continue
+            if not isinstance(node, ast.Subscript) or not isinstance(node.ctx, ast.Load):
+                continue
+            target, key = node.value, node.slice
+            if isinstance(target, ast.Attribute) and target.attr in ("loc", "at") \
+                    and isinstance(key, ast.Tuple) and len(key.elts) == 2:
+                target, key = target.value, key.elts[1]
+            elif self._loader_arg(node) is not None:
+                continue
+            keys = key.elts if isinstance(key, (ast.List, ast.Tuple)) else [key]
+            if not keys or any(_str_const(k) is None for k in keys):
+                continue
+            tables = self._same_columns_tables(target)
+            if tables:
+                reads.extend((k, tables) for k in keys)
+                read_nodes.update(id(k) for k in keys)
+
+        # Names the code itself creates: any other use of the string, or a keyword name.
+        defined = set()
+        for node in ast.walk(self.tree):
+            if isinstance(node, ast.Constant) and isinstance(node.value, str) and id(node) not in read_nodes:
+                defined.add(node.value)
+            elif isinstance(node, ast.keyword) and node.arg:
+                defined.add(node.arg)
+
+        for key, tables in reads:
+            column = key.value
+            schemas = [self.schemas.get(t) for t in tables]
+            if column in defined or any(schema is None for schema in schemas):
+                continue
+            if all(column not in map(str, schema) for schema in schemas):
+                self.facts.unknown_columns.append(
+                    {"tables": sorted(tables), "column": column, "lineno": key.lineno})
+
+    def collect_dates(self):
+        for node in ast.walk(self.tree):
+            if isinstance(node, ast.Compare):
+                operands = [node.left] + list(node.comparators)
+                for left, op, right in zip(operands, node.ops, operands[1:]):
+                    self._add_date_compare(node, left, op, right)
+            elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) \
+                    and node.func.attr == "between" and len(node.args) >= 2:
+                lo, hi = _date_literal(node.args[0]), _date_literal(node.args[1])
+                if lo and hi:
+                    self._add_date_filter(node, node.func.value, lo, True, hi, True)
+            elif _rows_between_range(node) is not None:
+                column, (lo, _, hi, _) = _rows_between_range(node)
+                tables = self._frame_tables(node.args[0])
+                if tables:
+                    self.facts.date_filters.append({
+                        "tables": sorted(tables), "column": column,
+                        "lo": lo, "lo_inclusive": lo is not None, "hi": hi, "hi_inclusive": hi is not None,
+                        "conjunctive": True,
+                    })
+
+    def _add_date_compare(self, node, left, op, right):
+        # df['d'].dt.year == 2024 / >= 2024 ...
+        for col_node, lit_node, flip in ((left, right, False), (right, left, True)):
+            if isinstance(col_node, ast.Attribute) and col_node.attr == "year" \
+                    and isinstance(col_node.value, ast.Attribute) and col_node.value.attr == "dt" \
+                    and isinstance(lit_node, ast.Constant) and isinstance(lit_node.value, int):
+                year = lit_node.value
+                start, end = f"{year:04d}-01-01 00:00:00", f"{year + 1:04d}-01-01 00:00:00"
+                kind = type(op)
+                if flip:
+                    kind = {ast.Lt: ast.Gt, ast.Gt: ast.Lt, ast.LtE: ast.GtE, ast.GtE: ast.LtE}.get(kind, kind)
+                bounds = {
+                    ast.Eq: (start, True, end, False),
+                    ast.GtE: (start, True, None, False),
+                    ast.Gt: (end, True, None, False),
+                    ast.Lt: (None, False, start, False),
+                    ast.LtE: (None, False, end, False),
+                }.get(kind)
+                if bounds:
+                    self._add_date_filter(node, col_node.value.value, *bounds)
+                return
+
+        if not isinstance(op, (ast.Lt, ast.LtE, ast.Gt, ast.GtE)):
+            return
+        for col_node, lit_node, col_on_left in ((left, right, True), (right, left, False)):
+            value = _date_literal(lit_node)
+            if value is None or self._column_of(col_node) is None:
+                continue
+            lower = isinstance(op, (ast.Gt, ast.GtE)) == col_on_left
+            inclusive = isinstance(op, (ast.LtE, ast.GtE))
+            if lower:
+                self._add_date_filter(node, col_node, value, inclusive, None, False)
+            else:
+                self._add_date_filter(node, col_node, None, False, value, inclusive)
+            return
+
+    def _add_date_filter(self, node, col_node, lo, lo_inc, hi, hi_inc):
+        found = self._column_of(col_node)
+        if found is None:
+            return
+        tables, column = found
+        entry = {
+            "tables": sorted(tables), "column": column,
+            "lo": lo, "lo_inclusive": lo_inc, "hi": hi, "hi_inclusive": hi_inc,
+            "conjunctive": self._is_row_mask(node),
+        }
+        self.facts.date_filters.append(entry)
+        self.date_filter_nodes.append((node, col_node, entry))
+
+    def _is_row_mask(self, node):
+        """True if `node` restricts the rows of a frame through `&` only: df[(..) & (..)]."""
+        cur = node
+        while True:
+            parent = self.parents.get(cur)
+            if isinstance(parent, ast.BinOp) and isinstance(parent.op, ast.BitAnd):
+                cur = parent
+                continue
+            if isinstance(parent, ast.Subscript) and parent.slice is cur:
+                return bool(self._frame_tables(parent.value))
+            if isinstance(parent, ast.Tuple) and isinstance(self.parents.get(parent), ast.Subscript) \
+                    and parent.elts and parent.elts[0] is cur:
+                return bool(self._frame_tables(self.parents[parent].value))
+            return False
+
+    # ------------------------------------------------------------- row bounds --
+    def collect_row_bounds(self):
+        """facts.row_bounds (see module header)."""
+        if any(isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Global, ast.Nonlocal))
+               for n in ast.walk(self.tree)):
+            return      # frames could be used at any point in time
+
+        # Names bound only by top-level `name = ...` statements can be followed in order.
+        self.bindings, unsafe = {}, set()
+        for node in ast.walk(self.tree):
+            if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+                parent = self.parents.get(node)
+                if isinstance(parent, ast.Assign) and parent.targets == [node] \
+                        and isinstance(self.parents.get(parent), ast.Module):
+                    self.bindings.setdefault(node.id, []).append(parent)
+                else:
+                    unsafe.add(node.id)
+            elif isinstance(node, ast.arg):
+                unsafe.add(node.arg)
+        for name in unsafe:
+            self.bindings[name] = None
+
+        ranges, failed = {}, set()
+        raw_assigns = {}                                      # Assign -> tables it holds unrestricted
+        pending = []
+        for node in ast.walk(self.tree):
+            arg = self._loader_arg(node)
+            if arg is None:
+                continue
+            if _str_const(arg) is None:
+                failed.update(self._resolve_names(arg) or [])
+                continue
+            pending.append((node, {arg.value}))
+        while pending:
+            use, tables = pending.pop()
+            outcome = self._follow_rows(use)
+            if outcome is None:
+                failed.update(tables)
+            elif isinstance(outcome, ast.Assign):
+                if outcome not in raw_assigns:
+                    raw_assigns[outcome] = set(tables)
+                    name = outcome.targets[0].id
+                    if self.bindings.get(name) is None:
+                        failed.update(tables)
+                        continue
+                    for node in ast.walk(self.tree):
+                        if isinstance(node, ast.Name) and node.id == name and isinstance(node.ctx, ast.Load) \
+                                and self._reaching_assign(node) is outcome:
+                            pending.append((node, tables))
+                else:
+                    raw_assigns[outcome].update(tables)
+            elif isinstance(outcome, dict):
+                for table in tables:
+                    ranges.setdefault(table, []).append(outcome)
+
+        for table, restrictions in ranges.items():
+            if table in failed:
+                continue
+            common = set.intersection(*(set(r) for r in restrictions))
+            if common:
+                self.facts.row_bounds[table] = {
+                    col: sorted({r[col] for r in restrictions}, key=repr) for col in sorted(common)}
+
+    def _reaching_assign(self, name_node):
+        """The top-level assignment whose value `name_node` reads, or None."""
+        assigns = self.bindings.get(name_node.id) or []
+        at = (name_node.lineno, name_node.col_offset)
+        before = [a for a in assigns if (a.end_lineno, a.end_col_offset) <= at]
+        return max(before, key=lambda a: (a.lineno, a.col_offset)) if before else None
+
+    def _follow_rows(self, use):
+        """
+        Follows the unrestricted rows at `use` upwards: {column: range} of the date
+        restriction they reach, True when they end in an elementwise use on the same
+        rows (mask of a row filter, column write), the top-level Assign holding them
+        (to follow its name), or None when anything else may see them.
+        """
+        name = use.id if isinstance(use, ast.Name) else None
+        if name is not None and self._elementwise_use(use, name):
+            return True
+        cur = use
+        while True:
+            parent = self.parents.get(cur)
+            outer = self.parents.get(parent)
+            if isinstance(parent, ast.Attribute) and parent.value is cur and parent.attr == "copy" \
+                    and isinstance(outer, ast.Call) and outer.func is parent and not outer.args:
+                cur = outer
+                continue
+            if isinstance(parent, ast.Assign) and parent.value is cur:
+                target = parent.targets[0] if len(parent.targets) == 1 else None
+                if isinstance(target, ast.Name) and isinstance(self.parents.get(parent), ast.Module):
+                    return parent
+                return None
+            between = _rows_between_range(parent)
+            if between is not None and parent.args[0] is cur:
+                return {between[0]: between[1]}
+            if _row_helper_frame(parent) is cur:
+                cur = parent                          # rows_where / rows_between on other columns
+                continue
+            mask = None
+            if isinstance(parent, ast.Subscript) and parent.value is cur and isinstance(parent.ctx, ast.Load):
+                mask, cur_node = parent.slice, parent
+            elif isinstance(parent, ast.Attribute) and parent.value is cur and parent.attr == "loc" \
+                    and isinstance(outer, ast.Subscript) and outer.value is parent and isinstance(outer.ctx, ast.Load):
+                mask, cur_node = outer.slice, outer
+            if mask is None:
+                return None
+            if isinstance(mask, ast.Tuple) and mask.elts:
+                mask = mask.elts[0]
+            if self._is_column_selection(mask) or isinstance(mask, (ast.Slice, ast.Constant)):
+                return None
+            restriction = self._mask_range(mask, cur) if cur is use and name is not None else None
+            if restriction:
+                return restriction
+            cur = cur_node                            # other row filter: keep following
+
+    def _mask_range(self, mask, frame):
+        """{column: range} of the literal date filters `&`-ed in `mask` on columns of `frame`."""
+        terms, stack = [], [mask]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitAnd):
+                stack.extend((node.left, node.right))
+            else:
+                terms.append(node)
+        found = {}
+        for node, col_node, f in self.date_filter_nodes:
+            if not any(node is t for t in terms):
+                continue
+            owner = col_node.value if isinstance(col_node, (ast.Subscript, ast.Attribute)) else None
+            if not (isinstance(owner, ast.Name) and owner.id == frame.id):
+                continue
+            lo, lo_inc, hi, hi_inc = found.get(f["column"], (None, False, None, False))
+            if f["lo"] is not None and (lo is None or f["lo"] > lo or (f["lo"] == lo and not f["lo_inclusive"])):
+                lo, lo_inc = f["lo"], f["lo_inclusive"]
+            if f["hi"] is not None and (hi is None or f["hi"] < hi or (f["hi"] == hi and not f["hi_inclusive"])):
+                hi, hi_inc = f["hi"], f["hi_inclusive"]
+            found[f["column"]] = (lo, lo_inc, hi, hi_inc)
+        return found
+
+    def _elementwise_use(self, use, name):
+        """
+        True if `use` (a Name) only reads a column that is combined row by row into the
+        mask of a row filter on `name`, or into a column written back to `name`.
+        """
+        parent = self.parents.get(use)
+        if isinstance(parent, ast.Subscript) and parent.value is use and _str_const(parent.slice) is not None:
+            if not isinstance(parent.ctx, ast.Load):
+                return True                           # x['col'] = ...
+            cur = parent
+        elif isinstance(parent, ast.Attribute) and parent.value is use and self._column_of(parent) is not None:
+            cur = parent
+        else:
+            return False
+        while True:
+            parent = self.parents.get(cur)
+            if isinstance(parent, (ast.Compare, ast.BinOp, ast.UnaryOp)):
+                cur = parent
+                continue
+            if isinstance(parent, ast.Attribute) and parent.value is cur:
+                if parent.attr in ("dt", "str") or getattr(cur, "attr", None) in ("dt", "str"):
+                    cur = parent                      # accessor: x['d'].dt.year, x['s'].str.lower()
+                    continue
+                if parent.attr in _ELEMENTWISE and isinstance(self.parents.get(parent), ast.Call):
+                    cur = self.parents[parent]
+                    continue
+                return False
+            if isinstance(parent, ast.Call) and parent.func is cur:
+                cur = parent                          # accessor method call
+                continue
+            if isinstance(parent, ast.Call) and cur in parent.args and isinstance(parent.func, ast.Attribute) \
+                    and parent.func.attr in _ELEMENTWISE:
+                cur = parent
+                continue
+            if isinstance(parent, ast.Tuple) and parent.elts and parent.elts[0] is cur:
+                cur = parent
+                continue
+            if isinstance(parent, ast.Subscript) and parent.slice is cur:
+                frame = parent.value.value if isinstance(parent.value, ast.Attribute) and parent.value.attr == "loc" \
+                    else parent.value
+                return isinstance(frame, ast.Name) and frame.id == name
+            if isinstance(parent, ast.Assign) and parent.value is cur and len(parent.targets) == 1:
+                target = parent.targets[0]
+                return isinstance(target, ast.Subscript) and _str_const(target.slice) is not None \
+                    and isinstance(target.value, ast.Name) and target.value.id == name
+            return False
+
+    def finish(self):
+        facts = self.facts
+        for table in facts.tables:
+            schema = self.schemas.get(table)
+            if table in self.unprovable or schema is None:
+                facts.columns[table] = None
+                continue
+            needed = [c for c in schema if str(c) in self.names_pool]
+            facts.columns[table] = needed or list(schema)[:1]
+
+        for f in facts.date_filters:
+            if not f["conjunctive"] or len(f["tables"]) != 1:
+                continue
+            key = (f["tables"][0], f["column"])
+            lo, lo_inc, hi, hi_inc = facts.date_ranges.get(key, (None, False, None, False))
+            if f["lo"] is not None and (lo is None or f["lo"] > lo or (f["lo"] == lo and not f["lo_inclusive"])):
+                lo, lo_inc = f["lo"], f["lo_inclusive"]
+            if f["hi"] is not None and (hi is None or f["hi"] < hi or (f["hi"] == hi and not f["hi_inclusive"])):
+                hi, hi_inc = f["hi"], f["hi_inclusive"]
+            facts.date_ranges[key] = (lo, lo_inc, hi, hi_inc)
+        return facts
+
+
+def replace_spans(code_str, replacements):
+    """
+    Applies [(span, text)] to `code_str`, span being an ast node's (lineno, col_offset,
+    end_lineno, end_col_offset); ast columns are UTF-8 byte offsets.
+    """
+    lines = code_str.splitlines(keepends=True)
+    starts = [0]
+    for line in lines:
+        starts.append(starts[-1] + len(line))
+
+    def _offset(lineno, col):
+        return starts[lineno - 1] + len(lines[lineno - 1].encode("utf-8")[:col].decode("utf-8", "ignore"))
+
+    edits = sorted(((_offset(a, b), _offset(c, d), text) for (a, b, c, d), text in replacements), reverse=True)
+    for begin, end, text in edits:
+        code_str = code_str[:begin] + text + code_str[end:]
+    return code_str
+
+
+def analyze_code(code_str, schemas=None):
+    """
+    Analyzes generated pandas code. `schemas` ({table: [columns]}, e.g. from the table
+    catalog) is needed for column pruning and for df.col attribute access; without it
+    every table's columns are reported as None.
+    """
+    try:
+        tree = ast.parse(code_str)
+    except SyntaxError as e:
+        facts = CodeFacts()
+        facts.error = f"SyntaxError: {e}"
+        # Still report file names for the RBAC check.
+        for name in re.findall(r"['\"]([^'\"]+)['\"]", code_str):
+            if _is_table_name(name) and name not in facts.tables:
+                facts.tables.append(name)
+        facts.columns = {t: None for t in facts.tables}
+        return facts
+
+    analyzer = _Analyzer(tree, schemas)
+    analyzer.collect_names()
+    analyzer.collect_tables()
+    analyzer.collect_aliases()
+    analyzer.check_uses()
+    analyzer.collect_filters()
+    analyzer.collect_dates()
+    analyzer.collect_column_refs()
+    analyzer.collect_row_bounds()
+    return analyzer.finish()
@@ -0,0 +1,162 @@
+# Code cache
+# Results of Tool-2 code executions, so the same KPI asked by many users (or the same
+# question in a new conversation) does not load tables and run exec again.
+#
+# - Key: hash of the normalized AST of the code (formatting / comments do not matter)
+#   plus the ETags of the tables it reads. A new blob version changes the key, so
+#   entries never need explicit invalidation.
+# - Code reading the clock or randomness (datetime.now(), pd.Timestamp.today(), random,
+#   ...) is never cached.
+# - Only successful runs are stored (their printed output), LRU-bounded by entries and
+#   bytes; the results are part of the warm-start snapshot.
+# - compile_cached() keeps the compiled code objects of recent scripts.
+
+import os
+import ast
+import hashlib
+import threading
+from collections import OrderedDict
+
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "2000"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_MB", "64")) * 1024 * 1024
+COMPILED_CACHE_MAX_ENTRIES = 256
+
+_VOLATILE_CALLS = {"now", "today", "utcnow", "random", "rand", "randint", "choice", "sample",
+                   "shuffle", "uniform", "time", "perf_counter", "getenv"}
+_VOLATILE_MODULES = {"random", "time", "os", "uuid", "secrets"}
+# pd.Timestamp("today"), pd.to_datetime("now"), pd.date_range(end="today"), ...
+_DATE_PARSING_CALLS = {"Timestamp", "to_datetime", "date_range", "bdate_range", "period_range", "Period",
+                       "datetime64"}
+_VOLATILE_DATE_STRINGS = {"now", "today"}
+
+
+def _is_volatile(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            func = node.func
+            name = func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", None)
+            if name in _VOLATILE_CALLS:
+                return True
+            if name in _DATE_PARSING_CALLS and any(
+                    isinstance(arg, ast.Constant) and isinstance(arg.value, str)
+                    and arg.value.strip().lower() in _VOLATILE_DATE_STRINGS
+                    for arg in node.args + [k.value for k in node.keywords]):
+                return True
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            modules = [a.name for a in node.names] if isinstance(node, ast.Import) else [node.module]
+            if any((m or "").split(".")[0] in _VOLATILE_MODULES for m in modules):
+                return True
+    return False
+
+
+def code_hash(code_str):
+    """
+    Hash of the normalized AST of `code_str`, or None if it does not parse or its
+    output can change between runs on the same data.
+    """
+    try:
+        tree = ast.parse(code_str)
+    except SyntaxError:
+        return None
+    if _is_volatile(tree):
+        return None
+    dumped = ast.dump(tree, annotate_fields=False, include_attributes=False)
+    return hashlib.sha1(dumped.encode("utf-8")).hexdigest()
+
+
+def result_key(code_str, etags):
+    """
+    Cache key for running `code_str` against tables {name: etag}. None (do not cache)
+    if the code is volatile / unparsable or a table version is unknown.
+    """
+    digest = code_hash(code_str)
+    if digest is None or any(not etag for etag in etags.values()):
+        return None
+    versions = "|".join(f"{name}={etags[name]}" for name in sorted(etags))
+    return hashlib.sha1(f"{digest}|{versions}".encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """LRU of execution outputs, bounded by entry count and total size."""
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            output = self._entries.get(key)
+            if output is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return output
+
+    def put(self, key, output):
+        if key is None or output is None:
+            return
+        size = len(output.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old.encode("utf-8"))
+            self._entries[key] = output
+            self._bytes += size
+            self._stats["stores"] += 1
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.encode("utf-8"))
+                self._stats["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out["entries"] = len(self._entries)
+            out["bytes"] = self._bytes
+            return out
+
+    # warm-start snapshot
+    def dump(self):
+        with self._lock:
+            return list(self._entries.items()) or None
+
+    def restore(self, payload):
+        for key, output in payload:
+            with self._lock:
+                if key in self._entries:
+                    continue
+            self.put(key, output)
+
+
+_result_cache = ResultCache()
+_compiled = OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+def get_result_cache():
+    return _result_cache
+
+
+def compile_cached(code_str):
+    """compile(code_str, "<generated>", "exec"), reusing the code object for repeated scripts."""
+    key = hashlib.sha1(code_str.encode("utf-8")).hexdigest()
+    with _compiled_lock:
+        code = _compiled.get(key)
+        if code is not None:
+            _compiled.move_to_end(key)
+            return code
+    code = compile(code_str, "<generated>", "exec")
+    with _compiled_lock:
+        _compiled[key] = code
+        while len(_compiled) > COMPILED_CACHE_MAX_ENTRIES:
+            _compiled.popitem(last=False)
+    return code
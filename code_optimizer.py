@@ -0,0 +1,464 @@
+# Code optimizer
+# Rewrites slow pandas idioms of Tool-2 generated code into vectorized equivalents before
+# it runs (ask_func.execute_generated_code, after the fuzzy / compat rewrites):
+#
+#   iterrows_accumulate   for _, row in df.iterrows(): total += row["Col"]   (or += 1)
+#                         -> total = _opt_accumulate(total, df, "Col")  /  total + 1 * len(df)
+#   rowwise_apply         df.apply(lambda r: r["A"] * r["B"] - 1, axis=1)     (+ - * / only)
+#                         -> _opt_apply_rows(df, lambda r: ..., ["A", "B"])  (column arithmetic)
+#   hoist_to_datetime     pd.to_datetime(df["Col"]) inside a loop that never rebinds or
+#                         writes `df` -> computed once before the loop
+#   redundant_conversion  pd.to_datetime / pd.to_numeric of a column that already has
+#                         that type -> returned as is (_opt_to_datetime / _opt_to_numeric)
+#   chained_filters       df[m1][m2] with both masks built from columns of `df`
+#                         -> df[(m1) & (m2)] (one selection, no intermediate frame)
+#
+# Every rewrite keeps the result of the original idiom, including its dtypes: the helpers
+# below reproduce what iterrows / apply(axis=1) do to a row (values upcast to the frame's
+# common dtype, or boxed as Python objects in mixed frames; sums in row order) and fall
+# back to the original idiom where they cannot (empty frames, extension-type rows, rows
+# narrower than 64 bits, where whole-column math would overflow or round differently).
+# The caller still runs the original code if the rewritten one raises.
+#
+# Rules are toggled with CODE_OPTIMIZER_RULES (comma list, default all of RULES) and the
+# optimizer as a whole with CODE_OPTIMIZER. CODE_OPTIMIZER_COMPARE=1 also runs the
+# original code and keeps its output if the two differ (for validating the rules);
+# stats() has per rule the rewrites made and the run times before / after.
+
+import os
+import ast
+import logging
+import threading
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+RULES = ("iterrows_accumulate", "rowwise_apply", "hoist_to_datetime", "redundant_conversion", "chained_filters")
+
+CODE_OPTIMIZER = os.getenv("CODE_OPTIMIZER", "1").lower() in ("1", "true", "yes")
+CODE_OPTIMIZER_RULES = [r.strip() for r in os.getenv("CODE_OPTIMIZER_RULES", ",".join(RULES)).split(",") if r.strip()]
+CODE_OPTIMIZER_COMPARE = os.getenv("CODE_OPTIMIZER_COMPARE", "0").lower() in ("1", "true", "yes")
+
+_MASK_METHODS = {"isin", "between", "isna", "notna", "isnull", "notnull", "contains", "startswith",
+                 "endswith", "eq", "ne", "lt", "le", "gt", "ge", "duplicated"}
+_ELEMENTWISE_METHODS = {"lower", "upper", "strip", "lstrip", "rstrip", "title", "len", "abs", "round",
+                        "fillna", "astype", "normalize"}
+_CONVERSION_KEYWORDS = {"to_datetime": {"errors", "format", "dayfirst", "yearfirst", "infer_datetime_format"},
+                        "to_numeric": {"errors"}}
+
+_stats = defaultdict(lambda: {"rewrites": 0, "runs": 0, "fallbacks": 0, "mismatches": 0,
+                              "seconds_before": 0.0, "seconds_after": 0.0})
+_stats_lock = threading.Lock()
+
+
+#######################################################################################
+#                         Runtime helpers (names in the code's namespace)
+#######################################################################################
+def _row_dtype(frame):
+    """dtype of the rows iterrows / apply(axis=1) build from `frame`, or None if they
+    are not plain numpy rows (empty frame, duplicate columns, extension types)."""
+    from pandas.core.dtypes.cast import find_common_type
+
+    if len(frame) == 0 or not frame.columns.is_unique:
+        return None
+    common = find_common_type(list(frame.dtypes))
+    if not isinstance(common, np.dtype) or common.kind not in "iufbO":
+        return None
+    return common
+
+
+def _row_values(frame, column, common):
+    # What row[column] is on each row: object rows box every value like astype(object).
+    if common == object:
+        return frame[column].astype(object).tolist()
+    return frame[column].to_numpy(dtype=common)
+
+
+def _opt_accumulate(total, frame, column):
+    """`total` plus frame[column] row by row, as the iterrows loop computes it."""
+    common = _row_dtype(frame)
+    if common is None:
+        for _, row in frame.iterrows():
+            total += row[column]
+        return total
+    values = _row_values(frame, column, common)
+    if common.kind in "iuf" and common.itemsize == 8 and isinstance(total, (int, float, np.number)) \
+            and not isinstance(total, bool):
+        first = total + values[0]              # scalar promotion exactly as in the loop
+        if len(values) == 1:
+            return first
+        steps = np.concatenate(([first], values[1:])).astype(np.asarray(first).dtype, copy=False)
+        return np.add.accumulate(steps)[-1]    # sequential, same rounding as the loop
+    for value in values:
+        total += value
+    return total
+
+
+def _opt_apply_rows(frame, func, columns):
+    """frame.apply(func, axis=1) for arithmetic `func` over `columns`, without building rows."""
+    common = _row_dtype(frame)
+    if common is None or common.kind == "b":
+        return frame.apply(func, axis=1)
+    if common != object and common.itemsize != 8:
+        # Vectorized math would stay in the narrow dtype and overflow / round where the
+        # row-wise scalars did not (int16 * 1000).
+        return frame.apply(func, axis=1)
+    if common == object:
+        # Python scalars as in the original rows: same results, errors and inferred dtype.
+        rows = zip(*(_row_values(frame, c, common) for c in columns))
+        return pd.Series([func(dict(zip(columns, row))) for row in rows], index=frame.index)
+    result = func(frame[columns].astype(common))
+    if not isinstance(result, pd.Series):
+        return frame.apply(func, axis=1)
+    return result.rename(None)
+
+
+def _opt_to_datetime(arg, **kwargs):
+    if isinstance(arg, pd.Series) and pd.api.types.is_datetime64_any_dtype(arg.dtype):
+        return arg
+    return pd.to_datetime(arg, **kwargs)
+
+
+def _opt_to_numeric(arg, **kwargs):
+    if isinstance(arg, pd.Series) and pd.api.types.is_numeric_dtype(arg.dtype):
+        return arg
+    return pd.to_numeric(arg, **kwargs)
+
+
+HELPERS = {
+    "_opt_accumulate": _opt_accumulate,
+    "_opt_apply_rows": _opt_apply_rows,
+    "_opt_to_datetime": _opt_to_datetime,
+    "_opt_to_numeric": _opt_to_numeric,
+}
+
+
+#######################################################################################
+#                                     Rewrite rules
+#######################################################################################
+def _names(node):
+    return {n.id for n in ast.walk(node) if isinstance(n, ast.Name)}
+
+
+def _column_key(node, row_name):
+    """'Col' for row_name['Col'], else None."""
+    if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == row_name \
+            and isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str):
+        return node.slice.value
+    return None
+
+
+def _call(name, args):
+    return ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=args, keywords=[])
+
+
+class _Rule(ast.NodeTransformer):
+    name = ""
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.count = 0
+
+
+class _IterrowsAccumulate(_Rule):
+    name = "iterrows_accumulate"
+
+    def _accumulations(self, node):
+        target = node.target
+        if not (isinstance(target, ast.Tuple) and len(target.elts) == 2
+                and all(isinstance(e, ast.Name) for e in target.elts)):
+            return None
+        iterated = node.iter
+        if not (isinstance(iterated, ast.Call) and isinstance(iterated.func, ast.Attribute)
+                and iterated.func.attr == "iterrows" and isinstance(iterated.func.value, ast.Name)
+                and not iterated.args and not iterated.keywords) or node.orelse:
+            return None
+        frame = iterated.func.value.id
+        loop_names = {e.id for e in target.elts}
+        accumulations, totals = [], set()
+        for stmt in node.body:
+            if not (isinstance(stmt, ast.AugAssign) and isinstance(stmt.op, ast.Add)
+                    and isinstance(stmt.target, ast.Name)):
+                return None
+            total = stmt.target.id
+            if total in totals or total in loop_names or total == frame:
+                return None
+            value = stmt.value
+            column = _column_key(value, target.elts[1].id)
+            if column is not None:
+                accumulations.append((total, column, None))
+            elif isinstance(value, ast.Constant) and type(value.value) is int:
+                accumulations.append((total, None, value.value))
+            else:
+                return None
+            totals.add(total)
+        # The loop variables stay bound after a loop: only rewrite when nothing reads them
+        # (other than loops that bind the same names again).
+        rebound = {id(n) for n in ast.walk(node)}
+        for other in ast.walk(self.tree):
+            if isinstance(other, ast.For) and loop_names <= _names(other.target):
+                rebound.update(id(n) for n in ast.walk(other))
+        for other in ast.walk(self.tree):
+            if isinstance(other, ast.Name) and other.id in loop_names and id(other) not in rebound:
+                return None
+        return frame, accumulations
+
+    def visit_For(self, node):
+        self.generic_visit(node)
+        found = self._accumulations(node)
+        if not found:
+            return node
+        frame, accumulations = found
+        statements = []
+        for total, column, step in accumulations:
+            if column is not None:
+                value = _call("_opt_accumulate", [ast.Name(id=total, ctx=ast.Load()),
+                                                  ast.Name(id=frame, ctx=ast.Load()), ast.Constant(column)])
+            else:
+                value = ast.BinOp(left=ast.Name(id=total, ctx=ast.Load()), op=ast.Add(),
+                                  right=ast.BinOp(left=ast.Constant(step), op=ast.Mult(),
+                                                  right=_call("len", [ast.Name(id=frame, ctx=ast.Load())])))
+            statements.append(ast.copy_location(
+                ast.Assign(targets=[ast.Name(id=total, ctx=ast.Store())], value=value), node))
+        self.count += 1
+        return statements
+
+
+class _RowwiseApply(_Rule):
+    name = "rowwise_apply"
+
+    @staticmethod
+    def _columns(node, row_name, columns):
+        """Collects row_name['Col'] keys; False if `node` is not + - * / arithmetic of them."""
+        if isinstance(node, ast.BinOp):
+            return isinstance(node.op, (ast.Add, ast.Sub, ast.Mult, ast.Div)) \
+                and _RowwiseApply._columns(node.left, row_name, columns) \
+                and _RowwiseApply._columns(node.right, row_name, columns)
+        if isinstance(node, ast.UnaryOp):
+            return isinstance(node.op, (ast.USub, ast.UAdd)) and _RowwiseApply._columns(node.operand, row_name, columns)
+        if isinstance(node, ast.Constant):
+            return type(node.value) in (int, float)
+        column = _column_key(node, row_name)
+        if column is None:
+            return False
+        if column not in columns:
+            columns.append(column)
+        return True
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        func = node.func
+        if not (isinstance(func, ast.Attribute) and func.attr == "apply"
+                and len(node.args) == 1 and isinstance(node.args[0], ast.Lambda)):
+            return node
+        if not (len(node.keywords) == 1 and node.keywords[0].arg == "axis"
+                and isinstance(node.keywords[0].value, ast.Constant) and node.keywords[0].value.value in (1, "columns")):
+            return node
+        function = node.args[0]
+        params = function.args
+        if len(params.args) != 1 or params.posonlyargs or params.kwonlyargs or params.vararg or params.kwarg:
+            return node
+        columns = []
+        if not self._columns(function.body, params.args[0].arg, columns) or not columns:
+            return node
+        self.count += 1
+        return ast.copy_location(ast.Call(
+            func=ast.Name(id="_opt_apply_rows", ctx=ast.Load()),
+            args=[func.value, function, ast.List(elts=[ast.Constant(c) for c in columns], ctx=ast.Load())],
+            keywords=[]), node)
+
+
+def _is_pandas_call(node, names):
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) \
+        and isinstance(node.func.value, ast.Name) and node.func.value.id in ("pd", "pandas") \
+        and node.func.attr in names
+
+
+class _HoistToDatetime(_Rule):
+    name = "hoist_to_datetime"
+
+    @staticmethod
+    def _invariant_frame(loop, frame):
+        """True if the loop only reads columns of `frame` (never rebinds or writes it)."""
+        parents = {}
+        for parent in ast.walk(loop):
+            for child in ast.iter_child_nodes(parent):
+                parents[id(child)] = parent
+        for node in ast.walk(loop):
+            if isinstance(node, ast.arg) and node.arg == frame:
+                return False
+            if not (isinstance(node, ast.Name) and node.id == frame):
+                continue
+            if not isinstance(node.ctx, ast.Load):
+                return False
+            parent = parents.get(id(node))
+            if not (isinstance(parent, ast.Subscript) and parent.value is node and isinstance(parent.ctx, ast.Load)):
+                return False
+        return True
+
+    def visit_For(self, node):
+        self.generic_visit(node)
+        parents = {}
+        for parent in ast.walk(node):
+            for child in ast.iter_child_nodes(parent):
+                parents[id(child)] = parent
+        hoisted = {}      # ast.dump of the call -> temporary name
+        replaced = []
+        for call in ast.walk(node):
+            if call is node.iter or not _is_pandas_call(call, ("to_datetime",)) or len(call.args) != 1:
+                continue
+            arg = call.args[0]
+            if not (isinstance(arg, ast.Subscript) and isinstance(arg.value, ast.Name)
+                    and isinstance(arg.slice, ast.Constant) and isinstance(arg.slice.value, str)):
+                continue
+            if not all(isinstance(k.value, ast.Constant) and k.arg for k in call.keywords):
+                continue
+            # A result bound to a name could be modified in place on one iteration.
+            parent = parents.get(id(call))
+            if isinstance(parent, (ast.Assign, ast.AnnAssign, ast.NamedExpr)) and \
+                    not all(isinstance(t, ast.Subscript) for t in getattr(parent, "targets", [None])):
+                continue
+            if not self._invariant_frame(node, arg.value.id):
+                continue
+            key = ast.dump(call)
+            if key not in hoisted:
+                hoisted[key] = (f"_opt_dates_{self.count + len(hoisted)}", call)
+            replaced.append((call, hoisted[key][0]))
+        if not replaced:
+            return node
+        targets = {id(call): name for call, name in replaced}
+
+        class _Replace(ast.NodeTransformer):
+            def visit_Call(self, call):
+                if id(call) in targets:
+                    return ast.copy_location(ast.Name(id=targets[id(call)], ctx=ast.Load()), call)
+                self.generic_visit(call)
+                return call
+
+        node.body = [_Replace().visit(stmt) for stmt in node.body]
+        self.count += len(hoisted)
+        assigns = [ast.copy_location(ast.Assign(targets=[ast.Name(id=name, ctx=ast.Store())], value=call), node)
+                   for name, call in hoisted.values()]
+        return assigns + [node]
+
+
+class _RedundantConversion(_Rule):
+    name = "redundant_conversion"
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if not _is_pandas_call(node, _CONVERSION_KEYWORDS) or len(node.args) != 1:
+            return node
+        allowed = _CONVERSION_KEYWORDS[node.func.attr]
+        if not all(k.arg in allowed for k in node.keywords):
+            return node
+        self.count += 1
+        return ast.copy_location(ast.Call(func=ast.Name(id=f"_opt_{node.func.attr}", ctx=ast.Load()),
+                                          args=node.args, keywords=node.keywords), node)
+
+
+class _ChainedFilters(_Rule):
+    name = "chained_filters"
+
+    @staticmethod
+    def _over_frame(node, frame):
+        """True if `node` is `frame`, a column of it, or elementwise methods of one."""
+        while True:
+            if isinstance(node, ast.Name):
+                return node.id == frame
+            if isinstance(node, ast.Subscript):
+                if not (isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str)):
+                    return False
+                node = node.value
+            elif isinstance(node, ast.Attribute):
+                node = node.value
+            elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) \
+                    and node.func.attr in _ELEMENTWISE_METHODS:
+                node = node.func.value
+            else:
+                return False
+
+    @staticmethod
+    def _mask_over(node, frame):
+        """True if `node` is a boolean mask with the index of `frame` (same alignment)."""
+        if isinstance(node, ast.BinOp):
+            return isinstance(node.op, (ast.BitAnd, ast.BitOr)) \
+                and _ChainedFilters._mask_over(node.left, frame) and _ChainedFilters._mask_over(node.right, frame)
+        if isinstance(node, ast.UnaryOp):
+            return isinstance(node.op, ast.Invert) and _ChainedFilters._mask_over(node.operand, frame)
+        if isinstance(node, ast.Compare):
+            return len(node.ops) == 1 and isinstance(node.ops[0], (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)) \
+                and _ChainedFilters._over_frame(node.left, frame)
+        if isinstance(node, ast.Call):
+            return isinstance(node.func, ast.Attribute) and node.func.attr in _MASK_METHODS \
+                and _ChainedFilters._over_frame(node.func.value, frame)
+        return False
+
+    def visit_Subscript(self, node):
+        self.generic_visit(node)
+        inner = node.value
+        if not (isinstance(node.ctx, ast.Load) and isinstance(inner, ast.Subscript)
+                and isinstance(inner.ctx, ast.Load) and isinstance(inner.value, ast.Name)):
+            return node
+        frame = inner.value.id
+        if not (self._mask_over(inner.slice, frame) and self._mask_over(node.slice, frame)):
+            return node
+        self.count += 1
+        combined = ast.BinOp(left=inner.slice, op=ast.BitAnd(), right=node.slice)
+        return ast.copy_location(ast.Subscript(value=inner.value, slice=combined, ctx=ast.Load()), node)
+
+
+_RULE_CLASSES = [_IterrowsAccumulate, _RowwiseApply, _HoistToDatetime, _RedundantConversion, _ChainedFilters]
+
+
+def optimize(code_str, rules=None):
+    """
+    (code, applied): `code_str` with the enabled rules applied, and {rule: rewrites} of
+    those that changed something. Unparsable code, or nothing to rewrite, is returned
+    unchanged with applied == {}.
+    """
+    enabled = set(CODE_OPTIMIZER_RULES if rules is None else rules)
+    if not CODE_OPTIMIZER or not enabled:
+        return code_str, {}
+    try:
+        tree = ast.parse(code_str)
+    except SyntaxError:
+        return code_str, {}
+    # Code using names of the optimizer's own (helpers, hoisted values) is left alone.
+    if any(name.startswith("_opt_") for name in _names(tree)):
+        return code_str, {}
+    applied = {}
+    for rule_class in _RULE_CLASSES:
+        if rule_class.name not in enabled:
+            continue
+        rule = rule_class(tree)
+        tree = rule.visit(tree)
+        if rule.count:
+            applied[rule.name] = rule.count
+    if not applied:
+        return code_str, {}
+    with _stats_lock:
+        for name, count in applied.items():
+            _stats[name]["rewrites"] += count
+    logging.info(f"[Optimizer] rewrites: {applied}")
+    return ast.unparse(ast.fix_missing_locations(tree)), applied
+
+
+def record(applied, seconds_after, seconds_before=None, fallback=False, mismatch=False):
+    """Counts one run of optimized code (times in seconds; before only in compare mode)."""
+    with _stats_lock:
+        for name in applied:
+            entry = _stats[name]
+            entry["runs"] += 1
+            entry["fallbacks"] += int(fallback)
+            entry["mismatches"] += int(mismatch)
+            entry["seconds_after"] += seconds_after
+            if seconds_before is not None:
+                entry["seconds_before"] += seconds_before
+
+
+def stats():
+    """{rule: {"rewrites", "runs", "fallbacks", "mismatches", "seconds_before", "seconds_after"}}."""
+    with _stats_lock:
+        return {name: dict(entry) for name, entry in _stats.items()}
@@ -0,0 +1,290 @@
+# Code reuse
+# Global store of (question, code) pairs whose code ran successfully, so a question
+# close to a past one can skip the Tool-2 code generation call.
+#
+# - Entries are scoped to a schema version (hash of table names, columns and dtypes):
+#   code written for another schema is never offered.
+# - Lookup: exact match on the normalized question, else rapidfuzz similarity over the
+#   stored questions of the same schema version.
+# - A similar question is only reused when it differs from the stored one in dates or
+#   in values the code filters on ("... in Jeddah in March 2024" vs "... in Riyadh in
+#   April 2024"). The code is then adapted: filter literals are swapped, date literals
+#   shifted by the same number of years / months / days. Any other difference is no match.
+# - Candidates are returned in order; the caller runs them and only a successful run
+#   counts as a reuse.
+
+import os
+import re
+import ast
+import calendar
+import threading
+import datetime as _dt
+from collections import OrderedDict
+from difflib import SequenceMatcher
+
+CODE_REUSE_MIN_SCORE = int(os.getenv("CODE_REUSE_MIN_SCORE", "85"))
+CODE_REUSE_MAX_ENTRIES = int(os.getenv("CODE_REUSE_MAX_ENTRIES", "5000"))
+CODE_REUSE_CANDIDATES = 3
+
+_TOKEN_RE = re.compile(r"\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}|[^\W_]+", re.UNICODE)
+_ISO_RE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})(.*)$")
+_MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+_MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+
+# Words that make a question depend on the conversation ("what about Riyadh?").
+_FOLLOW_UP_WORDS = {"it", "its", "that", "those", "these", "this", "them", "they", "same",
+                    "previous", "above", "there", "also", "else", "again"}
+
+
+def normalize_question(question):
+    return " ".join(t.lower() for t in _TOKEN_RE.findall(question or ""))
+
+
+def is_standalone(question):
+    """Heuristic: long enough and no reference to earlier turns."""
+    tokens = normalize_question(question).split()
+    if len(tokens) < 4:
+        return False
+    if " ".join(tokens[:2]) in ("what about", "how about", "and for", "and in"):
+        return False
+    return not _FOLLOW_UP_WORDS.intersection(tokens)
+
+
+# ------------------------------------------------------------- date mentions --
+def _date_mention(text):
+    """('year', y, None) | ('month', y or None, m) | ('day', date, None) | None."""
+    words = text.split()
+    if len(words) == 1 and re.fullmatch(r"(19|20)\d{2}", words[0]):
+        return ("year", int(words[0]), None)
+    if len(words) == 1:
+        for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y/%m/%d"):
+            try:
+                return ("day", _dt.datetime.strptime(words[0], fmt).date(), None)
+            except ValueError:
+                pass
+    if words and words[0] in _MONTHS:
+        if len(words) == 1:
+            return ("month", None, _MONTHS[words[0]])
+        if len(words) == 2 and re.fullmatch(r"(19|20)\d{2}", words[1]):
+            return ("month", int(words[1]), _MONTHS[words[0]])
+    if len(words) == 3 and words[0].isdigit() and words[1] in _MONTHS and words[2].isdigit():
+        try:
+            return ("day", _dt.date(int(words[2]), _MONTHS[words[1]], int(words[0])), None)
+        except ValueError:
+            return None
+    return None
+
+
+def _add_months(date, months):
+    index = date.year * 12 + date.month - 1 + months
+    year, month = divmod(index, 12)
+    last_day = calendar.monthrange(year, month + 1)[1]
+    # A month-end bound ('2024-04-30', '2024-02-29') stays the end of the new month.
+    if date.day == calendar.monthrange(date.year, date.month)[1]:
+        day = last_day
+    else:
+        day = min(date.day, last_day)
+    return date.replace(year=year, month=month + 1, day=day)
+
+
+class _DateShift:
+    def __init__(self, old, new):
+        self.kind = old[0]
+        self.months = 0
+        self.days = 0
+        self.year_map = {}
+        self.month_map = {}
+        if self.kind == "year":
+            self.months = (new[1] - old[1]) * 12
+            self.year_map = {old[1]: new[1], old[1] + 1: new[1] + 1}
+        elif self.kind == "month":
+            if (old[1] is None) != (new[1] is None):
+                raise ValueError("month mentions differ in precision")
+            years = (new[1] - old[1]) if old[1] is not None else 0
+            self.months = years * 12 + new[2] - old[2]
+            if old[1] is not None:
+                self.year_map = {old[1]: new[1]}
+            self.month_map = {old[2]: new[2]}
+        else:
+            self.days = (new[1] - old[1]).days
+
+    def shift_iso(self, text):
+        m = _ISO_RE.match(text)
+        if not m:
+            return text
+        try:
+            date = _dt.date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        except ValueError:
+            return text
+        date = _add_months(date, self.months) + _dt.timedelta(days=self.days)
+        return date.isoformat() + m.group(4)
+
+
+def _date_edits(tree, shift):
+    """[(span, new source)] for the date literals / year & month constants in `tree`."""
+    parents = {}
+    for node in ast.walk(tree):
+        for child in ast.iter_child_nodes(node):
+            parents[child] = node
+
+    def _compared_attr(node):
+        parent = parents.get(node)
+        if isinstance(parent, ast.Compare):
+            for side in [parent.left] + list(parent.comparators):
+                if isinstance(side, ast.Attribute) and side.attr in ("year", "month"):
+                    return side.attr
+        return None
+
+    edits = []
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Constant):
+            continue
+        span = (node.lineno, node.col_offset, node.end_lineno, node.end_col_offset)
+        if isinstance(node.value, str) and _ISO_RE.match(node.value):
+            shifted = shift.shift_iso(node.value)
+            if shifted != node.value:
+                edits.append((span, repr(shifted)))
+        elif isinstance(node.value, int) and not isinstance(node.value, bool):
+            attr = _compared_attr(node)
+            mapping = shift.month_map if attr == "month" else shift.year_map if attr == "year" else {}
+            if node.value in mapping and mapping[node.value] != node.value:
+                edits.append((span, repr(mapping[node.value])))
+    return edits
+
+
+# ----------------------------------------------------------------- adaptation --
+def adapt_code(old_question, new_question, code_str):
+    """
+    Adapts `code_str` (written for old_question) to new_question. Returns
+    (code, changes) or None when the questions differ in anything but dates and
+    filter values used by the code.
+    """
+    from rapidfuzz import fuzz
+    from code_analysis import analyze_code, replace_spans
+
+    old_tokens = normalize_question(old_question).split()
+    new_raw = _TOKEN_RE.findall(new_question or "")
+    new_tokens = [t.lower() for t in new_raw]
+    if old_tokens == new_tokens:
+        return code_str, []
+
+    try:
+        tree = ast.parse(code_str)
+    except SyntaxError:
+        return None
+    facts = analyze_code(code_str)
+
+    edits, changes = [], []
+    for op, i1, i2, j1, j2 in SequenceMatcher(None, old_tokens, new_tokens, autojunk=False).get_opcodes():
+        if op == "equal":
+            continue
+        if op != "replace":
+            return None
+        old_text = " ".join(old_tokens[i1:i2])
+        new_text = " ".join(new_raw[j1:j2])
+
+        old_date, new_date = _date_mention(old_text), _date_mention(new_text.lower())
+        if old_date or new_date:
+            if not (old_date and new_date) or old_date[0] != new_date[0]:
+                return None
+            try:
+                date_edits = _date_edits(tree, _DateShift(old_date, new_date))
+            except ValueError:
+                return None
+            if not date_edits:
+                return None
+            edits.extend(date_edits)
+            changes.append((old_text, new_text))
+            continue
+
+        literal_edits = [
+            (f["span"], repr(new_text)) for f in facts.filters
+            if f["value"].strip().lower() == old_text or fuzz.ratio(f["value"].lower(), old_text) >= 90
+        ]
+        if not literal_edits:
+            return None
+        edits.extend(literal_edits)
+        changes.append((old_text, new_text))
+
+    # Two different edits of the same literal would contradict each other.
+    by_span = {}
+    for span, text in edits:
+        if by_span.setdefault(span, text) != text:
+            return None
+    return replace_spans(code_str, list(by_span.items())), changes
+
+
+# ---------------------------------------------------------------------- store --
+class CodeReuseStore:
+    """Successful (question, code) pairs per schema version, LRU-bounded."""
+
+    def __init__(self, max_entries=CODE_REUSE_MAX_ENTRIES, min_score=CODE_REUSE_MIN_SCORE):
+        self.max_entries = max_entries
+        self.min_score = min_score
+        self._entries = OrderedDict()     # (schema_version, normalized question) -> entry
+        self._lock = threading.Lock()
+        self._stats = {"exact": 0, "adapted": 0, "misses": 0, "stored": 0}
+
+    def add(self, question, code_str, schema_version):
+        key = (schema_version, normalize_question(question))
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = {"question": question, "code": code_str}
+            self._stats["stored"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def candidates(self, question, schema_version, limit=CODE_REUSE_CANDIDATES):
+        """
+        [(code, changes)] to try for `question`, best first. `changes` lists the
+        (old, new) substitutions made; empty for an exact match.
+        """
+        from rapidfuzz import process, fuzz
+
+        normalized = normalize_question(question)
+        with self._lock:
+            exact = self._entries.get((schema_version, normalized))
+            if exact is not None:
+                self._entries.move_to_end((schema_version, normalized))
+                self._stats["exact"] += 1
+                return [(exact["code"], [])]
+            pool = {key[1]: entry for key, entry in self._entries.items() if key[0] == schema_version}
+
+        out = []
+        matches = process.extract(normalized, list(pool), scorer=fuzz.ratio,
+                                  score_cutoff=self.min_score, limit=limit * 3)
+        for text, _, _ in matches:
+            entry = pool[text]
+            adapted = adapt_code(entry["question"], question, entry["code"])
+            if adapted is not None:
+                out.append(adapted)
+            if len(out) >= limit:
+                break
+        with self._lock:
+            self._stats["adapted" if out else "misses"] += 1
+        return out
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out["entries"] = len(self._entries)
+            return out
+
+    # warm-start snapshot
+    def dump(self):
+        with self._lock:
+            return list(self._entries.items()) or None
+
+    def restore(self, payload):
+        with self._lock:
+            for key, entry in payload:
+                if key not in self._entries and len(self._entries) < self.max_entries:
+                    self._entries[key] = entry
+                    self._entries.move_to_end(key, last=False)
+
+
+_store = CodeReuseStore()
+
+
+def get_code_reuse_store():
+    return _store
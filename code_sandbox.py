@@ -0,0 +1,368 @@
+# Code sandbox
+# Runs the Tool-2 generated code in a pool of pre-forked worker processes instead of
+# exec() inside the gunicorn worker, so one runaway script (iterrows over a big table,
+# cartesian merge, ...) cannot stall the worker for every other user.
+#
+# - Workers come from a multiprocessing forkserver that already imported pandas / numpy,
+#   so starting or replacing one does not pay the import again.
+# - Tables are attached in the worker from the shared columnar store (table_store.py,
+#   zero-copy memory maps); a table version not materialized yet, or deleted before the
+#   worker attached it, is sent over the pipe.
+#   Code proven to read only some date ranges of a table (CodeFacts.row_bounds) gets
+#   just the overlapping date partitions of the store copy.
+# - Limits per execution: wall-clock (SANDBOX_TIMEOUT_SECONDS) and private memory
+#   (SANDBOX_MEMORY_MB): RLIMIT_DATA inside the worker plus an RSS watchdog in the
+#   parent. A worker that breaches a limit is killed and replaced.
+# - Results (printed output or error) come back over the worker's pipe.
+# - Whole tables are handed to the code as copy-on-write views of the maps
+#   (frame_isolation.py); code writing into them is re-run once on private copies.
+# - Each worker keeps the row indexes (table_index.py) of the table versions it attached,
+#   so rows_between / rows_where do not rebuild them for every job.
+#
+# USE_SANDBOX_EXECUTOR=0 (or a platform without forkserver) keeps the in-process exec.
+
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+
+USE_SANDBOX_EXECUTOR = os.getenv("USE_SANDBOX_EXECUTOR", "1").lower() in ("1", "true", "yes")
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", "2"))
+SANDBOX_TIMEOUT_SECONDS = float(os.getenv("SANDBOX_TIMEOUT_SECONDS", "60"))
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "1536"))
+SANDBOX_MAX_JOBS_PER_WORKER = int(os.getenv("SANDBOX_MAX_JOBS_PER_WORKER", "200"))
+# Longest wait for a free worker; then run() raises SandboxError (the question is answered
+# with a "busy" message, the code is never exec'd in-process instead).
+SANDBOX_WAIT_SECONDS = float(os.getenv("SANDBOX_WAIT_SECONDS", "30"))
+WATCHDOG_INTERVAL_SECONDS = 0.1
+
+_PRELOAD = ["numpy", "pandas", "table_store", "table_cache", "code_cache", "code_sandbox", "rollups",
+            "output_capture", "dtype_layout", "table_index", "code_optimizer", "frame_isolation"]
+TABLE_INDEXES_PER_WORKER = 32
+
+
+class SandboxError(Exception):
+    """The sandbox pool could not run the job (not the generated code failing)."""
+
+
+class TableMissing(SandboxError):
+    """A table version to attach from the store is not (or no longer) on disk."""
+
+    def __init__(self, table, etag):
+        super().__init__(f"table '{table}' (version {etag}) is not in the store")
+        self.table = table
+
+
+# ---------------------------------------------------------------- worker side --
+def _limit_memory(limit_bytes):
+    # RLIMIT_DATA counts private allocations, not the shared read-only table maps.
+    try:
+        import resource
+        resource.setrlimit(resource.RLIMIT_DATA, (limit_bytes, limit_bytes))
+    except (ImportError, ValueError, OSError) as e:
+        logging.warning(f"[Sandbox] could not set memory limit: {e}")
+
+
+def _attach_tables(tables, store, private=False):
+    from table_cache import _select_columns
+    from frame_isolation import FRAME_ISOLATION, isolate
+
+    dataframes = {}
+    for name, spec in tables.items():
+        if spec.get("frame") is not None:
+            # Unpickled, private to this job; still isolated, so a re-run starts from it unchanged.
+            frame = spec["frame"]
+            dataframes[name] = frame.copy() if private else (isolate(frame) if FRAME_ISOLATION else frame)
+            continue
+        if spec.get("rows") and store is not None:
+            # Only the date partitions the code reads (private rows, no copy needed).
+            df = store.load_partitions(name, spec["etag"], spec["rows"], spec.get("columns"))
+            if df is not None:
+                dataframes[name] = df
+                continue
+        df = store.load(name, spec["etag"]) if store is not None else None
+        if df is None:
+            raise TableMissing(name, spec["etag"])
+        if spec.get("columns") is None:
+            # Attached columns are read-only maps: copy-on-write views of them for the
+            # code (frame_isolation.py), private copies for a re-run after it wrote into them.
+            dataframes[name] = df.copy() if private or not FRAME_ISOLATION else isolate(df)
+        else:
+            dataframes[name] = _select_columns(df, spec["columns"])
+    return dataframes
+
+
+def _index_helpers(tables, dataframes, indexes):
+    from table_index import TableIndex, make_helpers
+
+    index_of = {}
+    for name, df in dataframes.items():
+        etag = tables[name].get("etag")
+        if not etag or tables[name].get("rows"):
+            continue            # row positions of a partial frame are not the table's
+        key = (name, etag)
+        if key not in indexes:
+            if len(indexes) >= TABLE_INDEXES_PER_WORKER:
+                indexes.popitem(last=False)
+            indexes[key] = TableIndex()
+        index_of[id(df)] = (df.index, indexes[key])
+    return make_helpers(index_of)
+
+
+def _run_job(job, stores, indexes):
+    from datetime import datetime
+    import pandas as pd
+    from table_store import TableStore
+    from code_cache import compile_cached
+    from output_capture import capture, make_print
+
+    root = job.get("store_root")
+    if root and root not in stores:
+        stores[root] = TableStore(root)
+
+    from frame_isolation import is_read_only_error
+
+    for private in (False, True):
+        try:
+            dataframes = _attach_tables(job["tables"], stores.get(root), private=private)
+            if job.get("decategorized"):
+                from dtype_layout import decategorize
+                dataframes = {name: decategorize(df) for name, df in dataframes.items()}
+        except TableMissing as e:
+            # Not the code's fault: the parent sends that table over the pipe instead.
+            return {"ok": False, "error": str(e), "missing_table": e.table, "recycle": False}
+        except Exception as e:
+            return {"ok": False, "error": f"Error attaching tables: {e}", "recycle": False}
+
+        try:
+            with capture() as output_buffer:
+                print_fn = make_print(output_buffer)
+                local_vars = {"dataframes": dataframes, "pd": pd, "datetime": datetime, "print": print_fn}
+                local_vars.update(_index_helpers(job["tables"], dataframes, indexes))
+                local_vars.update(job.get("extras") or {})
+                exec(compile_cached(job["code"]), {"pd": pd, "datetime": datetime, "print": print_fn}, local_vars)
+            return {"ok": True, "output": output_buffer.getvalue()}
+        except MemoryError:
+            return {"ok": False, "error": "memory limit exceeded", "recycle": True}
+        except Exception as e:
+            if private or not is_read_only_error(e):
+                return {"ok": False, "error": str(e), "recycle": False}
+
+
+def _worker_main(conn, memory_limit_bytes):
+    _limit_memory(memory_limit_bytes)
+    stores = {}
+    indexes = OrderedDict()     # (table, etag) -> TableIndex
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:
+            return
+        conn.send(_run_job(job, stores, indexes))
+
+
+# ---------------------------------------------------------------- parent side --
+def _private_rss(pid):
+    """Resident memory of `pid` not backed by shared pages (bytes), or None."""
+    try:
+        with open(f"/proc/{pid}/statm") as fh:
+            fields = fh.read().split()
+        return (int(fields[1]) - int(fields[2])) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _Worker:
+    __slots__ = ("proc", "conn", "jobs")
+
+    def __init__(self, proc, conn):
+        self.proc = proc
+        self.conn = conn
+        self.jobs = 0
+
+    def kill(self):
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+        if self.proc.is_alive():
+            self.proc.kill()
+        self.proc.join(timeout=1)
+
+
+class SandboxPool:
+    """
+    Fixed-size pool of sandbox worker processes. run() waits up to SANDBOX_WAIT_SECONDS
+    for a free worker. A worker that cannot be replaced leaves its slot "lost"; every
+    run() first tries to start the lost ones again.
+    """
+
+    def __init__(self, size=SANDBOX_WORKERS, timeout=SANDBOX_TIMEOUT_SECONDS,
+                 memory_mb=SANDBOX_MEMORY_MB, max_jobs=SANDBOX_MAX_JOBS_PER_WORKER,
+                 wait=SANDBOX_WAIT_SECONDS):
+        import multiprocessing
+
+        self.size = size
+        self.wait = wait
+        self.timeout = timeout
+        self.memory_limit = memory_mb * 1024 * 1024
+        self.max_jobs = max_jobs
+        self._ctx = multiprocessing.get_context("forkserver")
+        self._ctx.set_forkserver_preload(_PRELOAD)
+        self._idle = queue.Queue()
+        self._closed = False
+        self._lost = 0            # slots whose worker could not be replaced
+        self._stats = {"runs": 0, "timeouts": 0, "memory_kills": 0, "crashes": 0, "recycled": 0,
+                       "spawn_failures": 0, "wait_timeouts": 0}
+        self._stats_lock = threading.Lock()
+        for _ in range(size):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        proc = self._ctx.Process(
+            target=_worker_main, args=(child_conn, self.memory_limit),
+            name="tool2-sandbox", daemon=True,
+        )
+        proc.start()
+        child_conn.close()
+        return _Worker(proc, parent_conn)
+
+    def _respawn(self):
+        """Adds a new worker to the pool; False (slot counted as lost) if it cannot start."""
+        try:
+            self._idle.put(self._spawn())
+            return True
+        except Exception as e:
+            with self._stats_lock:
+                self._lost += 1
+                self._stats["spawn_failures"] += 1
+            logging.error(f"[Sandbox] could not start a worker: {e}")
+            return False
+
+    def _restore_lost(self):
+        with self._stats_lock:
+            lost, self._lost = self._lost, 0
+        for attempted in range(1, lost + 1):
+            if not self._respawn():
+                with self._stats_lock:
+                    self._lost += lost - attempted
+                break
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def run(self, code, tables, store_root=None, timeout=None, extras=None, decategorized=False):
+        """
+        Executes `code` with `dataframes` built from `tables`
+        ({name: {"etag", "columns", "frame" (None = attach from store)}}) and the
+        picklable `extras` added to its namespace. `decategorized` turns category
+        columns back into object first.
+        Returns {"ok": True, "output": str} or {"ok": False, "error": str}; a table that
+        could not be attached from the store is named in "missing_table", and "killed" is
+        set when the worker was killed (time / memory limit) or crashed.
+        """
+        if self._closed:
+            raise SandboxError("sandbox pool is shut down")
+        timeout = timeout or self.timeout
+        self._restore_lost()
+        if self._lost >= self.size:
+            raise SandboxError("no sandbox worker could be started")
+        try:
+            worker = self._idle.get(timeout=self.wait)
+        except queue.Empty:
+            self._count("wait_timeouts")
+            raise SandboxError(f"no sandbox worker free after {self.wait:.0f}s")
+        healthy = False
+        job = {"code": code, "tables": tables, "store_root": store_root, "extras": extras,
+               "decategorized": decategorized}
+        try:
+            result = self._execute(worker, job, timeout)
+            healthy = not result.pop("recycle", False)
+            if not healthy:
+                result["killed"] = True     # over a limit or crashed: not worth re-running
+            return result
+        finally:
+            worker.jobs += 1
+            if healthy and worker.jobs < self.max_jobs and not self._closed:
+                self._idle.put(worker)
+            else:
+                worker.kill()
+                self._count("recycled")
+                if not self._closed:
+                    self._respawn()
+
+    def _execute(self, worker, job, timeout):
+        self._count("runs")
+        try:
+            worker.conn.send(job)
+        except (OSError, ValueError) as e:
+            self._count("crashes")
+            return {"ok": False, "error": f"sandbox worker unavailable: {e}", "recycle": True}
+
+        deadline = time.monotonic() + timeout
+        while True:
+            if worker.conn.poll(WATCHDOG_INTERVAL_SECONDS):
+                try:
+                    return worker.conn.recv()
+                except (EOFError, OSError):
+                    self._count("crashes")
+                    return {"ok": False, "error": "sandbox worker crashed", "recycle": True}
+            if time.monotonic() > deadline:
+                self._count("timeouts")
+                return {"ok": False, "error": f"execution timed out after {timeout:.0f}s", "recycle": True}
+            rss = _private_rss(worker.proc.pid)
+            if rss is not None and rss > self.memory_limit:
+                self._count("memory_kills")
+                return {"ok": False, "error": f"memory limit exceeded ({rss / 1e6:.0f} MB)", "recycle": True}
+            if not worker.proc.is_alive():
+                self._count("crashes")
+                return {"ok": False, "error": "sandbox worker crashed", "recycle": True}
+
+    def shutdown(self):
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+            worker.kill()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_failed = False
+
+
+def get_pool():
+    """
+    Process-wide SandboxPool, started on first use. Returns None when the sandbox is
+    disabled or cannot start here (callers then exec in-process).
+    """
+    global _pool, _pool_failed
+    if not USE_SANDBOX_EXECUTOR or _pool_failed:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None and not _pool_failed:
+                try:
+                    _pool = SandboxPool()
+                    atexit.register(_pool.shutdown)
+                except Exception as e:
+                    _pool_failed = True
+                    logging.warning(f"[Sandbox] pool unavailable, executing in-process: {e}")
+    return _pool
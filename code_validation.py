@@ -0,0 +1,97 @@
+# Code validation
+# Static checks of Tool-2 generated code against the table catalog, run before any table
+# is downloaded, so broken code is regenerated with the exact problem instead of failing
+# in exec() after the blob I/O and parsing were paid for.
+#
+# validate_code() returns a list of problems (empty = looks runnable):
+#   - syntax errors
+#   - no print() of the answer
+#   - tables not in the catalog, columns not in their table's schema (with the closest
+#     existing names as hints)
+#   - imports outside the analysis libraries and calls the executor does not support
+#     (file / network / process access, plotting, writing files, input())
+#
+# Problems are phrased for the model: they are sent back verbatim in the repair prompt.
+
+import ast
+import difflib
+
+ALLOWED_IMPORTS = {
+    "pandas", "numpy", "datetime", "math", "re", "calendar", "collections", "itertools",
+    "statistics", "dateutil", "decimal", "functools", "operator", "string",
+}
+_UNSUPPORTED_CALLS = {
+    "open": "open() (no file access)",
+    "exec": "exec()",
+    "eval": "eval()",
+    "__import__": "__import__()",
+    "input": "input() (no user interaction)",
+    "display": "display() (use print())",
+    "read_sql": "pd.read_sql (use the provided dataframes)",
+    "read_parquet": "pd.read_parquet (use the provided dataframes)",
+    "read_json": "pd.read_json (use the provided dataframes)",
+    "read_html": "pd.read_html (use the provided dataframes)",
+    "to_excel": "writing files (to_excel)",
+    "to_csv": "writing files (to_csv) - print the result instead",
+    "to_parquet": "writing files (to_parquet)",
+    "plot": "plotting (no display) - print the numbers instead",
+    "show": "plotting (no display) - print the numbers instead",
+    "savefig": "plotting (no display) - print the numbers instead",
+}
+MAX_HINTS = 3
+
+
+def _closest(name, candidates):
+    return difflib.get_close_matches(name, [str(c) for c in candidates], n=MAX_HINTS, cutoff=0.5)
+
+
+def _hint(name, candidates):
+    close = _closest(name, candidates)
+    return f" (did you mean {', '.join(repr(c) for c in close)}?)" if close else ""
+
+
+def validate_code(code_str, facts, catalog=None):
+    """
+    Problems found in `code_str`. `facts` is its CodeFacts (code_analysis.py), `catalog`
+    {file name: [columns]} or None to skip the table / column checks.
+    """
+    if facts.error:
+        return [f"The code does not parse: {facts.error}"]
+    tree = ast.parse(code_str)
+    problems = []
+
+    if not any(isinstance(n, ast.Call) and getattr(n.func, "id", None) == "print" for n in ast.walk(tree)):
+        problems.append("The code never calls print(); it must print the final answer.")
+
+    unsupported = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            modules = [a.name for a in node.names] if isinstance(node, ast.Import) else [node.module or ""]
+            for module in modules:
+                if module.split(".")[0] not in ALLOWED_IMPORTS:
+                    unsupported.add(f"import of '{module}'")
+        elif isinstance(node, ast.Call):
+            func = node.func
+            name = func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", None)
+            if name in _UNSUPPORTED_CALLS:
+                unsupported.add(_UNSUPPORTED_CALLS[name])
+    for item in sorted(unsupported):
+        problems.append(f"Unsupported in this environment: {item}.")
+
+    if catalog is not None:
+        for table in facts.tables:
+            if table not in catalog:
+                problems.append(f"Table '{table}' does not exist{_hint(table, catalog)}.")
+        seen = set()
+        for ref in facts.unknown_columns:
+            key = (tuple(ref["tables"]), ref["column"])
+            if key in seen:
+                continue
+            seen.add(key)
+            columns = [c for t in ref["tables"] for c in catalog.get(t, ())]
+            tables = ", ".join(f"'{t}'" for t in ref["tables"])
+            problems.append(f"Column '{ref['column']}' (line {ref['lineno']}) is not in {tables}"
+                            f"{_hint(ref['column'], columns)}.")
+    if not facts.tables and not facts.dynamic_loads:
+        problems.append("The code does not load any table from `dataframes`.")
+    return problems
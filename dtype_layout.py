@@ -0,0 +1,142 @@
+# Dtype layout
+# Memory-efficient dtypes for the cached Tool-2 tables, chosen once per data version at
+# ingestion (table_ingest.normalize_table), plus what keeps the generated pandas 1.5 code
+# working on them.
+#
+# optimize_layout():
+#   - text columns with few distinct values (<= CATEGORY_MAX_UNIQUE_SHARE of the rows)
+#     become an ordered `category` with the categories sorted, so sorting, min / max,
+#     comparisons with an existing value and sorted groupbys order like the strings
+#   - numeric columns stay int64 / float64: narrower types change sums (float32) and
+#     overflow silently in the code's own arithmetic (df["Visitors"] * 1000 in int16)
+#   - dates are already datetime64 (table_ingest); nothing else is touched
+#   The chosen layout and the bytes saved are logged and kept in df.attrs["layout"].
+#
+# Compatibility with code written for object columns:
+#   - compat_rewrite() adds observed=True to groupby / pivot_table calls (no empty
+#     category combinations; with ordered categories the groups stay sorted)
+#   - needs_object_columns(): code whose output depends on the order or type of the
+#     values it lists (value_counts ties, unique(), mode(), describe(), groupby with
+#     sort=False) runs on object columns from the start
+#   - decategorize() turns category columns back into object, for that and for a re-run
+#     of code that failed on them (new values assigned / filled into a category column,
+#     comparison with a value that is not a category, string concatenation, ...)
+
+import os
+import ast
+import logging
+
+import pandas as pd
+
+OPTIMIZE_TABLE_DTYPES = os.getenv("OPTIMIZE_TABLE_DTYPES", "1").lower() in ("1", "true", "yes")
+CATEGORY_MAX_UNIQUE_SHARE = float(os.getenv("CATEGORY_MAX_UNIQUE_SHARE", "0.5"))
+CATEGORY_MIN_ROWS = 50
+
+
+def _category(series):
+    values = series.dropna()
+    if len(series) < CATEGORY_MIN_ROWS or values.empty:
+        return None
+    if not values.map(lambda v: isinstance(v, str)).all():
+        return None
+    if values.nunique() > CATEGORY_MAX_UNIQUE_SHARE * len(series):
+        return None
+    return series.astype(pd.CategoricalDtype(sorted(values.unique()), ordered=True))
+
+
+def optimize_layout(df, name=""):
+    """
+    Converts `df` (in place, positionally) to the layout described in the module header.
+    Returns the report {"category": [...], "bytes_before", "bytes_after"}.
+    """
+    report = {"category": [], "bytes_before": 0, "bytes_after": 0}
+    if not OPTIMIZE_TABLE_DTYPES:
+        return report
+    report["bytes_before"] = int(df.memory_usage(deep=True).sum())
+
+    for i, col in enumerate(df.columns):
+        series = df.iloc[:, i]
+        if series.dtype == object:
+            converted = _category(series)
+            if converted is not None:
+                report["category"].append(col)
+                df.isetitem(i, converted)
+
+    report["bytes_after"] = int(df.memory_usage(deep=True).sum())
+    if report["category"]:
+        saved = report["bytes_before"] - report["bytes_after"]
+        logging.info(
+            f"[Layout] '{name}': {report['bytes_before'] / 1e6:.1f} MB -> {report['bytes_after'] / 1e6:.1f} MB "
+            f"(saved {saved / 1e6:.1f} MB); category={report['category']}"
+        )
+    return report
+
+
+def has_categories(df):
+    return any(isinstance(dtype, pd.CategoricalDtype) for dtype in df.dtypes)
+
+
+def decategorize(df):
+    """New frame with the category columns of `df` as object (other columns shared)."""
+    positions = [i for i, dtype in enumerate(df.dtypes) if isinstance(dtype, pd.CategoricalDtype)]
+    if not positions:
+        return df
+    out = df.copy(deep=False)
+    for i in positions:
+        out.isetitem(i, df.iloc[:, i].astype(object))
+    return out
+
+
+# Calls whose output lists values in an order (or as a type) that differs for category
+# columns: value_counts ties / sort=False (category order instead of first appearance),
+# unique() (a Categorical), mode() and describe() (category dtype / summary).
+_ORDER_SENSITIVE_METHODS = {"value_counts", "unique", "mode", "describe"}
+
+
+def needs_object_columns(code_str):
+    """True if `code_str` should run with category columns as object (see module header)."""
+    try:
+        tree = ast.parse(code_str)
+    except SyntaxError:
+        return False
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)):
+            continue
+        method = node.func.attr
+        if method in _ORDER_SENSITIVE_METHODS:
+            return True
+        if method in ("groupby", "pivot_table") and any(
+                k.arg == "sort" and not (isinstance(k.value, ast.Constant) and k.value.value is True)
+                for k in node.keywords):
+            return True
+    return False
+
+
+class _CompatRewriter(ast.NodeTransformer):
+    def __init__(self):
+        self.changed = False
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.func, ast.Attribute):
+            return node
+        method, owner = node.func.attr, getattr(node.func.value, "id", None)
+        if method in ("groupby", "pivot_table") and owner != "itertools" \
+                and not any(k.arg == "observed" for k in node.keywords):
+            node.keywords.append(ast.keyword(arg="observed", value=ast.Constant(True)))
+            self.changed = True
+        return node
+
+
+def compat_rewrite(code_str):
+    """`code_str` made safe for category columns (see module header); unchanged if it
+    does not parse or has nothing to rewrite."""
+    try:
+        tree = ast.parse(code_str)
+    except SyntaxError:
+        return code_str
+    rewriter = _CompatRewriter()
+    tree = rewriter.visit(tree)
+    if not rewriter.changed:
+        return code_str
+    return ast.unparse(ast.fix_missing_locations(tree))
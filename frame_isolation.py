@@ -0,0 +1,68 @@
+# Frame isolation
+# Copy-on-write handling of the cached Tool-2 frames for generated code, instead of a
+# full copy() of every table per execution.
+#
+# - protect(): marks the arrays behind every column of a frame read-only. The table
+#   cache protects the frames it shares; the columnar store's memory maps already are.
+# - isolate(): a shallow copy of a protected frame for one execution (new frame, same
+#   column arrays, no data copied; only columns that cannot be protected are copied).
+#   Whole-column writes (df["c"] = ..., df.loc[:, "c"] = ..., new columns, drop / sort /
+#   reset_index with inplace=True) replace the column in that frame only, so just the
+#   columns the code rewrites are ever duplicated.
+# - Writes into the shared arrays (df.loc[mask, "c"] = v, df.at[...], replace(...,
+#   inplace=True), a Series taken from the frame modified in place, ...) raise
+#   "assignment destination is read-only" instead of corrupting the cache; the executor
+#   then re-runs the code once on private deep copies (is_read_only_error).
+#
+# FRAME_ISOLATION=0 goes back to a deep copy of every shared frame (checked by the
+# executors, ask_func.run_generated_code and code_sandbox).
+
+import os
+
+import numpy as np
+
+FRAME_ISOLATION = os.getenv("FRAME_ISOLATION", "1").lower() in ("1", "true", "yes")
+
+# Backing arrays of the datetime / categorical extension arrays. Masked (nullable Int64,
+# boolean, ...) columns are not protected: pandas' hash tables need their buffers writable.
+_BACKING_ATTRIBUTES = ("_ndarray", "_codes")
+
+
+def _backing_arrays(values):
+    if isinstance(values, np.ndarray):
+        return [values]
+    arrays = []
+    for attr in _BACKING_ATTRIBUTES:
+        array = getattr(values, attr, None)
+        if isinstance(array, np.ndarray):
+            arrays.append(array)
+    return arrays
+
+
+def protect(df):
+    """
+    Marks the column arrays of `df` read-only (in place). Returns the positions of the
+    columns that cannot be protected (see _BACKING_ATTRIBUTES).
+    """
+    unprotected = []
+    for block in df._mgr.blocks:
+        arrays = _backing_arrays(block.values)
+        if not arrays:
+            unprotected.extend(block.mgr_locs.as_array.tolist())
+        for array in arrays:
+            array.flags.writeable = False
+    return sorted(unprotected)
+
+
+def isolate(df):
+    """A new frame over the protected columns of `df` (private copies of the others)."""
+    unprotected = protect(df)
+    out = df.copy(deep=False)
+    for i in unprotected:
+        out.isetitem(i, df.iloc[:, i].copy())
+    return out
+
+
+def is_read_only_error(error):
+    """True if `error` (exception or message) is a write into a protected array."""
+    return "read-only" in str(error)
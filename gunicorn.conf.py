@@ -0,0 +1,15 @@
+# Gunicorn worker lifecycle hooks.
+# Gunicorn loads ./gunicorn.conf.py automatically; the Dockerfile also passes it explicitly.
+# Bind address and worker count stay on the command line in the Dockerfile.
+
+
+def post_worker_init(worker):
+    # The app module is already imported in the worker at this point.
+    import app
+    app.start_background_services()
+
+
+def worker_exit(server, worker):
+    # Graceful shutdown (SIGTERM on scale-in / redeploy): persist the warm caches.
+    import warm_start
+    warm_start.shutdown()
@@ -0,0 +1,92 @@
+# Import-time report
+# Runs `python -X importtime -c "import <module>"` in a fresh interpreter and prints a
+# per-module / per-package breakdown of where the import time goes.
+#
+# Usage:
+#   python import_time_report.py                      # report for `import app`
+#   python import_time_report.py --module ask_func --top 30
+#   python import_time_report.py --budget 2.5         # exit code 1 if over budget (for CI)
+
+import os
+import re
+import sys
+import argparse
+import subprocess
+from collections import defaultdict
+
+# Budget (seconds, cumulative) for `import app`. New replicas cannot serve traffic
+# before this import finishes, so keep heavy libraries out of the import path.
+DEFAULT_BUDGET_SECONDS = 2.0
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def measure_import(module="app", python=sys.executable, cwd=None):
+    """
+    Imports `module` in a clean interpreter with -X importtime.
+    Returns a list of (module_name, self_us, cumulative_us, depth) in import order.
+    """
+    cwd = cwd or os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"`import {module}` failed:\n{proc.stderr[-4000:]}")
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _LINE_RE.match(line)
+        if not m:
+            continue
+        self_us, cum_us, indent, name = int(m.group(1)), int(m.group(2)), m.group(3), m.group(4)
+        rows.append((name, self_us, cum_us, len(indent) // 2))
+    return rows
+
+
+def summarize(rows, top=25):
+    """
+    Builds the text report: total, slowest modules by cumulative time and
+    self time aggregated per top-level package.
+    """
+    by_package = defaultdict(int)
+    for name, self_us, _, _ in rows:
+        by_package[name.split(".")[0]] += self_us
+
+    # The requested module is the last (outermost) entry printed by -X importtime.
+    total_us = rows[-1][2] if rows else 0
+
+    lines = [f"Total import time: {total_us / 1e6:.3f}s ({len(rows)} modules)", ""]
+    lines.append(f"Top {top} packages by self time:")
+    for pkg, us in sorted(by_package.items(), key=lambda kv: kv[1], reverse=True)[:top]:
+        lines.append(f"   {us / 1e3:9.1f} ms  {pkg}")
+    lines.append("")
+    lines.append(f"Top {top} modules by cumulative time:")
+    for name, _, cum_us, _ in sorted(rows, key=lambda r: r[2], reverse=True)[:top]:
+        lines.append(f"   {cum_us / 1e3:9.1f} ms  {name}")
+    return total_us / 1e6, "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-module import time breakdown.")
+    parser.add_argument("--module", default="app", help="module to import (default: app)")
+    parser.add_argument("--top", type=int, default=25, help="rows per section")
+    parser.add_argument("--budget", type=float, default=None,
+                        help=f"fail if the import takes longer (seconds), e.g. {DEFAULT_BUDGET_SECONDS}")
+    args = parser.parse_args(argv)
+
+    rows = measure_import(args.module)
+    total_s, report = summarize(rows, top=args.top)
+    print(report)
+
+    if args.budget is not None and total_s > args.budget:
+        print(f"\nFAIL: `import {args.module}` took {total_s:.3f}s, budget is {args.budget:.3f}s")
+        return 1
+    if args.budget is not None:
+        print(f"\nOK: `import {args.module}` took {total_s:.3f}s, budget is {args.budget:.3f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+# Join views
+# Materialized joins of Tool-2 tables for recurring cross-table questions ("incidents on
+# the day of max footfall at site X"), so the generated code scans one table instead of
+# writing its own merge every time.
+#
+# Views are configured as JSON (JOIN_VIEWS, or the file JOIN_VIEWS_FILE), a list of:
+#
+#   {"name": "Footfall and Incidents (view).csv",
+#    "left": "Al-Bujairy Terrace Footfalls.xlsx", "right": "Incidents.xlsx",
+#    "on": [["Date", "Incident Date"], ["Site", "Site Name"]],     # [left column, right column]
+#    "how": "left",                                                 # pandas merge `how`
+#    "aggregate_right": true,                                       # see below
+#    "description": "daily footfall per site with that day's incidents"}
+#
+# - Date keys are joined by calendar day (both sides normalized to midnight), text keys
+#   as trimmed strings.
+# - aggregate_right (default true): the right table is first reduced to one row per key:
+#   "<right> rows" (its row count) and the sum of each numeric column, so joining never
+#   repeats left rows (no double-counted sums). false keeps every right row (left rows
+#   repeat per match). Fixed per view, so its columns do not depend on the data.
+# - The name must end in a table extension: views are tables for the rest of the
+#   pipeline (catalog, prompt, table cache, store, code analysis). The table cache
+#   serves them under a composite ETag of the source ETags (TableCache.register_view),
+#   so a view is rebuilt exactly when one of its sources changes.
+# - Access: a view requires the highest tier of its sources (get_file_tier).
+
+import os
+import json
+import logging
+import threading
+
+JOIN_VIEWS = os.getenv("JOIN_VIEWS", "")
+JOIN_VIEWS_FILE = os.getenv("JOIN_VIEWS_FILE", "join_views.json")
+
+_TABLE_EXTENSIONS = (".xlsx", ".xls", ".csv")
+
+_views = None
+_views_lock = threading.Lock()
+
+
+def _stem(file_name):
+    return os.path.splitext(os.path.basename(file_name))[0]
+
+
+class JoinView:
+    """One configured view: `build(frames)` joins the source frames."""
+
+    def __init__(self, name, left, right, on, how="left", aggregate_right=True, description=""):
+        self.name = name
+        self.left = left
+        self.right = right
+        self.on = [(str(l), str(r)) for l, r in on]
+        self.how = how
+        self.aggregate_right = aggregate_right
+        self.description = description
+
+    @property
+    def sources(self):
+        return [self.left, self.right]
+
+    def describe(self):
+        keys = ", ".join(l if l == r else f"{l} = {r}" for l, r in self.on)
+        text = f"{self.how} join of '{self.left}' with '{self.right}' on {keys}"
+        return f"{text} ({self.description})" if self.description else text
+
+    @staticmethod
+    def _key(series):
+        import pandas as pd
+
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return series.dt.normalize()
+        if pd.api.types.is_numeric_dtype(series):
+            return series
+        return series.astype(object).map(lambda v: None if pd.isna(v) else str(v).strip())
+
+    def build(self, frames):
+        """Joined frame of `frames` ({source name: DataFrame}, not modified)."""
+        import pandas as pd
+
+        left_keys = [l for l, _ in self.on]
+        right_keys = [r for _, r in self.on]
+        # New key columns on new frames: the sources are the cache's shared frames.
+        left, right = frames[self.left], frames[self.right]
+        left = left.assign(**{l: self._key(left[l]) for l in left_keys})
+        right = right.assign(**{r: self._key(right[r]) for r in right_keys})
+
+        aggregate = self.aggregate_right
+        if aggregate:
+            measures = [c for c in right.columns
+                        if c not in right_keys and pd.api.types.is_numeric_dtype(right[c])
+                        and not pd.api.types.is_bool_dtype(right[c])]
+            grouped = right.groupby(right_keys, dropna=False, observed=True, sort=False)
+            reduced = grouped[measures].sum(min_count=1) if measures else None
+            counts = grouped.size().rename(f"{_stem(self.right)} rows")
+            right = (counts.to_frame() if reduced is None else reduced.join(counts)).reset_index()
+
+        joined = left.merge(right, how=self.how, left_on=left_keys, right_on=right_keys,
+                            suffixes=("", f" ({_stem(self.right)})"))
+        # Right keys equal to their left counterpart are redundant after the join.
+        redundant = [r for l, r in self.on if r != l and r in joined.columns]
+        joined = joined.drop(columns=redundant).reset_index(drop=True)
+        if aggregate:
+            count_col = f"{_stem(self.right)} rows"
+            joined[count_col] = joined[count_col].fillna(0).astype("int64")
+        return joined
+
+
+def _parse(config):
+    views = []
+    for item in config:
+        name = str(item["name"])
+        if not name.lower().endswith(_TABLE_EXTENSIONS):
+            name += ".csv"
+        views.append(JoinView(
+            name, item["left"], item["right"], item["on"], how=item.get("how", "left"),
+            aggregate_right=bool(item.get("aggregate_right", True)), description=item.get("description", ""),
+        ))
+    return views
+
+
+def get_views():
+    """Configured JoinViews (parsed once; an invalid configuration means no views)."""
+    global _views
+    if _views is None:
+        with _views_lock:
+            if _views is None:
+                try:
+                    if JOIN_VIEWS.strip():
+                        config = json.loads(JOIN_VIEWS)
+                    elif os.path.exists(JOIN_VIEWS_FILE):
+                        with open(JOIN_VIEWS_FILE, encoding="utf-8") as fh:
+                            config = json.load(fh)
+                    else:
+                        config = []
+                    _views = _parse(config)
+                except (ValueError, KeyError, TypeError, OSError) as e:
+                    logging.error(f"[JoinViews] invalid view configuration, no views: {e}")
+                    _views = []
+                if _views:
+                    logging.info(f"[JoinViews] {len(_views)} view(s): {[v.name for v in _views]}")
+    return _views
+
+
+def get_view(name):
+    """The JoinView called `name`, or None."""
+    for view in get_views():
+        if view.name == name:
+            return view
+    return None
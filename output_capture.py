@@ -0,0 +1,193 @@
+# Output capture
+# Per-execution output channel for the Tool-2 generated code.
+#
+# contextlib.redirect_stdout swaps the process-wide sys.stdout, so with several Tool-2
+# jobs running in parallel threads one job's answer could land in another job's buffer
+# (or in the console), and the debug print()s of the request threads in either.
+#
+# - capture() routes everything the *current thread* writes to sys.stdout into its own
+#   buffer, through a thread-local proxy installed once as sys.stdout; other threads
+#   keep writing to the real stdout.
+# - The exec namespace also gets a print() bound to that buffer (make_print), so the
+#   answer does not depend on sys.stdout at all.
+# - The buffer is a BoundedWriter: it keeps at most OUTPUT_MAX_BYTES / OUTPUT_MAX_LINES
+#   and only counts the rest, and the injected print() replaces DataFrames / Series longer
+#   than OUTPUT_MAX_TABLE_ROWS by a summary (shape, head / tail, column aggregates).
+#   Either case leaves a marker in the output (is_truncated) so the final answer step
+#   knows it did not see everything.
+
+import io
+import os
+import sys
+import builtins
+import threading
+import contextlib
+
+OUTPUT_MAX_BYTES = int(os.getenv("OUTPUT_MAX_BYTES", "16000"))
+OUTPUT_MAX_LINES = int(os.getenv("OUTPUT_MAX_LINES", "300"))
+OUTPUT_MAX_TABLE_ROWS = int(os.getenv("OUTPUT_MAX_TABLE_ROWS", "40"))
+SUMMARY_HEAD_ROWS = 10
+SUMMARY_TAIL_ROWS = 5
+
+TRUNCATED_MARKER = "[output truncated:"
+SUMMARIZED_MARKER = "[summary of"
+
+_local = threading.local()
+_install_lock = threading.Lock()
+
+
+class BoundedWriter(io.TextIOBase):
+    """Text buffer keeping the first max_bytes / max_lines written, counting the rest."""
+
+    def __init__(self, max_bytes=OUTPUT_MAX_BYTES, max_lines=OUTPUT_MAX_LINES):
+        self.max_bytes = max_bytes
+        self.max_lines = max_lines
+        self._parts = []
+        self._bytes = 0
+        self._lines = 0
+        self.dropped_bytes = 0
+        self.dropped_lines = 0
+
+    @property
+    def truncated(self):
+        return self.dropped_bytes > 0
+
+    def write(self, text):
+        if not text:
+            return 0
+        if self.dropped_bytes:
+            self._drop(text)
+            return len(text)
+        kept = []
+        for line in text.splitlines(keepends=True):
+            size = len(line.encode("utf-8"))
+            if self._lines >= self.max_lines or self._bytes + size > self.max_bytes:
+                self._drop(text[sum(len(k) for k in kept):])
+                break
+            kept.append(line)
+            self._bytes += size
+            self._lines += line.endswith("\n")
+        self._parts.append("".join(kept))
+        return len(text)
+
+    def _drop(self, text):
+        self.dropped_bytes += len(text.encode("utf-8"))
+        self.dropped_lines += text.count("\n")
+
+    def writable(self):
+        return True
+
+    def getvalue(self):
+        text = "".join(self._parts)
+        if self.truncated:
+            text = text.rstrip("\n") + (
+                f"\n{TRUNCATED_MARKER} {self.dropped_lines} more lines / "
+                f"{self.dropped_bytes} more bytes not shown]\n"
+            )
+        return text
+
+
+def is_truncated(output):
+    """True if an execution output was cut or summarized by the bounded capture."""
+    text = str(output or "")
+    return TRUNCATED_MARKER in text or SUMMARIZED_MARKER in text
+
+
+def summarize(obj, max_rows=OUTPUT_MAX_TABLE_ROWS):
+    """
+    Short text for a DataFrame / Series longer than `max_rows` (row count, head / tail,
+    aggregates of the numeric columns), or None to print it as is.
+    """
+    import pandas as pd
+
+    if not isinstance(obj, (pd.DataFrame, pd.Series)) or len(obj) <= max_rows:
+        return None
+    kind = "DataFrame" if isinstance(obj, pd.DataFrame) else "Series"
+    shape = f"{len(obj)} rows x {obj.shape[1]} columns" if kind == "DataFrame" else f"{len(obj)} rows"
+    head, tail = obj.head(SUMMARY_HEAD_ROWS), obj.tail(SUMMARY_TAIL_ROWS)
+    lines = [f"{SUMMARIZED_MARKER} {kind} with {shape}; first {len(head)} and last {len(tail)} rows]",
+             head.to_string(), "...", tail.to_string()]
+    numeric = obj.select_dtypes("number") if kind == "DataFrame" else (
+        obj if pd.api.types.is_numeric_dtype(obj) else None)
+    if numeric is not None and numeric.size:
+        stats = numeric.agg(["sum", "mean", "min", "max"])
+        lines.append("Aggregates over all rows:")
+        lines.append(stats.to_string())
+    return "\n".join(lines)
+
+
+class _ThreadLocalStdout(io.TextIOBase):
+    """sys.stdout replacement writing to the calling thread's capture buffer, if any."""
+
+    def __init__(self, fallback):
+        self._fallback = fallback
+
+    def _target(self):
+        stack = getattr(_local, "stack", None)
+        return stack[-1] if stack else self._fallback
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        target = self._target()
+        if hasattr(target, "flush"):
+            target.flush()
+
+    def writable(self):
+        return True
+
+    @property
+    def encoding(self):
+        return getattr(self._fallback, "encoding", "utf-8")
+
+    def isatty(self):
+        return False
+
+    def fileno(self):
+        return self._fallback.fileno()
+
+
+def _install():
+    if not isinstance(sys.stdout, _ThreadLocalStdout):
+        with _install_lock:
+            if not isinstance(sys.stdout, _ThreadLocalStdout):
+                sys.stdout = _ThreadLocalStdout(sys.stdout)
+
+
+@contextlib.contextmanager
+def capture(buffer=None):
+    """
+    Captures this thread's stdout into `buffer` (a new BoundedWriter by default) for
+    the duration of the block and yields it. Nested captures stack.
+    """
+    _install()
+    buffer = buffer if buffer is not None else BoundedWriter()
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(buffer)
+    try:
+        yield buffer
+    finally:
+        stack.pop()
+
+
+def make_print(buffer):
+    """
+    print() for the exec namespace, writing to `buffer` unless file= is given. Long
+    DataFrames / Series are printed as a summary.
+    """
+    def _print(*args, **kwargs):
+        if kwargs.get("file") is None:
+            kwargs["file"] = buffer
+        shown = []
+        for arg in args:
+            summary = summarize(arg)
+            shown.append(arg if summary is None else summary)
+        builtins.print(*shown, **kwargs)
+    return _print
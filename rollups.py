@@ -0,0 +1,425 @@
+# Rollups
+# Pre-aggregated cubes of the Tool-2 tables, so the common "sum / count / average of X
+# by day, week or month (for site Y)" questions are answered without code generation
+# and without touching the raw table.
+#
+# Per table version (file name + ETag) a Cube holds, for each grain (day, week, month)
+# and for "no dimension" plus every low-cardinality text column, one frame:
+#
+#   period | <dimension> | rows | <measure> | <measure>__n
+#
+# with <measure> the sum and <measure>__n the non-null count of every numeric column
+# over the rows of that period (and dimension value). Date / measure / dimension
+# columns come from the dtypes in the table catalog (_metadata).
+#
+# match_intent() maps a question onto a cube query conservatively: every content word
+# of the question must be explained (measure, table, dimension value or name, date,
+# grain, aggregation); anything else means "not a rollup question" and Tool-2 runs.
+# The cube frames are also available to generated code as `rollups[(file, grain, dim)]`.
+#
+# USE_ROLLUPS=0 disables both the direct answers and the prompt section.
+
+import os
+import re
+import calendar
+import logging
+import threading
+import datetime as _dt
+
+USE_ROLLUPS = os.getenv("USE_ROLLUPS", "1").lower() in ("1", "true", "yes")
+ROLLUP_GRAINS = ("day", "week", "month")
+ROLLUP_MAX_DIM_CARDINALITY = int(os.getenv("ROLLUP_MAX_DIM_CARDINALITY", "200"))
+ROLLUP_MAX_ROWS = int(os.getenv("ROLLUP_MAX_ROWS", "250000"))    # per cube frame; larger ones are skipped
+ROLLUP_MAX_RESULT_ROWS = 100
+
+_TOKEN_RE = re.compile(r"\d{4}-\d{2}-\d{2}|[^\W_]+", re.UNICODE)
+_ID_LIKE_RE = re.compile(r"(^|[\W_])(id|code|no|number|phone|zip|year|month|day|week)($|[\W_])", re.I)
+_MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+_MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+
+_STOPWORDS = {
+    "what", "was", "is", "were", "are", "the", "a", "an", "of", "in", "on", "for", "at",
+    "during", "to", "from", "and", "with", "me", "show", "give", "tell", "list", "please",
+    "did", "do", "does", "we", "our", "there", "have", "had", "get", "got", "find", "total",
+    "overall", "all", "value", "values", "s", "table", "data", "file", "sheet",
+}
+_COUNT_WORDS = {"how", "many", "number", "count"}
+_SUM_WORDS = {"sum", "much"}
+_AVG_WORDS = {"average", "avg", "mean"}
+_GRAIN_WORDS = {"daily": "day", "weekly": "week", "monthly": "month",
+                "day": "day", "days": "day", "week": "week", "weeks": "week",
+                "month": "month", "months": "month"}
+_BREAKDOWN_WORDS = {"by", "per", "each", "every", "breakdown"}
+
+
+def _tokens(text):
+    return [t.lower() for t in _TOKEN_RE.findall(str(text))]
+
+
+def _singular(token):
+    return token[:-1] if len(token) > 3 and token.endswith("s") else token
+
+
+def _period_key(dates, grain):
+    if grain == "day":
+        return dates.dt.normalize()
+    if grain == "week":
+        return dates.dt.to_period("W-SUN").dt.start_time
+    return dates.dt.to_period("M").dt.start_time
+
+
+class Cube:
+    """Rollups of one table version."""
+
+    def __init__(self, name, date_column, measures, dimensions, frames, dim_values):
+        self.name = name
+        self.date_column = date_column
+        self.measures = measures
+        self.dimensions = dimensions
+        self.frames = frames            # (grain, dimension or None) -> DataFrame
+        self.dim_values = dim_values    # dimension -> {lower-cased value: value}
+
+    def frame(self, grain, dimension=None):
+        return self.frames.get((grain, dimension))
+
+    def describe(self):
+        dims = ", ".join(f"'{d}'" for d in self.dimensions) or "none"
+        measures = ", ".join(f"'{m}'" for m in self.measures)
+        grains = sorted({g for g, _ in self.frames}, key=ROLLUP_GRAINS.index)
+        return (f'"{self.name}": date column \'{self.date_column}\', grains {grains}, '
+                f"dimensions [{dims}], measures [{measures}]")
+
+
+def build_cube(name, df, schema):
+    """
+    Builds the Cube of table `name` from its cached frame, or None when the table has
+    no datetime column or no numeric measure. `schema` is {column: dtype string}.
+    """
+    started = _dt.datetime.now()
+    columns = [c for c in df.columns if isinstance(c, str)]
+    if len(set(columns)) != len(columns):
+        return None
+
+    dates = [c for c in columns if str(schema.get(c, "")).startswith("datetime64")]
+    if not dates:
+        return None
+    date_column = dates[0]
+    measures = [
+        c for c in columns
+        if str(schema.get(c, "")).startswith(("int", "float", "Int", "Float"))
+        and not _ID_LIKE_RE.search(c)
+    ]
+    if not measures:
+        return None
+    dimensions, dim_values = [], {}
+    for c in columns:
+        if str(schema.get(c, "")) not in ("object", "category", "string"):
+            continue
+        distinct = df[c].dropna().unique()
+        if 2 <= len(distinct) <= ROLLUP_MAX_DIM_CARDINALITY and all(isinstance(v, str) for v in distinct):
+            dimensions.append(c)
+            dim_values[c] = {v.strip().lower(): v for v in distinct}
+
+    base = df[[date_column] + measures + dimensions].dropna(subset=[date_column])
+    frames = {}
+    for grain in ROLLUP_GRAINS:
+        period = _period_key(base[date_column], grain).rename("period")
+        for dim in [None] + dimensions:
+            keys = [period] if dim is None else [period, base[dim]]
+            grouped = base.groupby(keys, sort=True, observed=True)
+            cube = grouped[measures].agg(["sum", "count"])
+            cube.columns = [m if stat == "sum" else f"{m}__n" for m, stat in cube.columns]
+            cube.insert(0, "rows", grouped.size())
+            if len(cube) > ROLLUP_MAX_ROWS:
+                continue
+            frames[(grain, dim)] = cube.reset_index()
+
+    elapsed = (_dt.datetime.now() - started).total_seconds()
+    logging.info(f"[Rollups] '{name}': {len(frames)} cube frames in {elapsed:.2f}s")
+    return Cube(name, date_column, measures, dimensions, frames, dim_values)
+
+
+_cubes = {}            # name -> (etag, Cube or None)
+_cubes_lock = threading.Lock()
+_build_locks = {}
+
+
+def get_cube(name, etag, df, schema):
+    """Cube of version `etag` of table `name`, built on first use."""
+    with _cubes_lock:
+        cached = _cubes.get(name)
+        if cached is not None and cached[0] == etag:
+            return cached[1]
+        lock = _build_locks.setdefault(name, threading.Lock())
+    with lock:
+        with _cubes_lock:
+            cached = _cubes.get(name)
+            if cached is not None and cached[0] == etag:
+                return cached[1]
+        try:
+            cube = build_cube(name, df, schema)
+        except Exception as e:
+            logging.warning(f"[Rollups] could not build cube for '{name}': {e}")
+            cube = None
+        with _cubes_lock:
+            _cubes[name] = (etag, cube)
+        return cube
+
+
+def current_cubes():
+    """Cubes built so far (latest version of each table), without revalidating them."""
+    with _cubes_lock:
+        return [cube for _, cube in _cubes.values() if cube is not None]
+
+
+def cube_namespace(cubes):
+    """{(file, grain, dimension or None): frame} for the generated code's `rollups`."""
+    return {(cube.name, grain, dim): frame for cube in cubes for (grain, dim), frame in cube.frames.items()}
+
+
+def describe_cubes(cubes):
+    """Prompt text listing the cubes, or "" when there are none."""
+    if not cubes:
+        return ""
+    lines = [cube.describe() for cube in cubes]
+    return "\n".join(lines)
+
+
+# ---------------------------------------------------------------------- intent --
+class Intent:
+    __slots__ = ("cube", "measure", "agg", "lo", "hi", "period_label", "filter", "grain", "by")
+
+    def __init__(self, cube, measure, agg, lo=None, hi=None, period_label="",
+                 filter=None, grain=None, by=None):
+        self.cube = cube
+        self.measure = measure          # None = row count
+        self.agg = agg                  # "sum" | "count" | "avg"
+        self.lo, self.hi = lo, hi       # [lo, hi) as datetime.date, or None
+        self.period_label = period_label
+        self.filter = filter            # (dimension, value) or None
+        self.grain = grain              # breakdown by period grain, or None
+        self.by = by                    # breakdown by dimension, or None
+
+    def to_code(self):
+        """Equivalent pandas code on the raw table (shown as the answer's source)."""
+        date_col, lines = self.cube.date_column, [f"df = dataframes.get({self.cube.name!r})"]
+        conditions = []
+        if self.lo is not None:
+            conditions.append(f"(df[{date_col!r}] >= {self.lo.isoformat()!r})")
+            conditions.append(f"(df[{date_col!r}] < {self.hi.isoformat()!r})")
+        if self.filter is not None:
+            conditions.append(f"(df[{self.filter[0]!r}] == {self.filter[1]!r})")
+        lines.append(f"rows = df[{' & '.join(conditions)}]" if conditions else "rows = df")
+        target = "rows" if self.measure is None else f"rows[{self.measure!r}]"
+        stat = {"sum": "sum()", "avg": "mean()", "count": "size" if self.measure is None else "sum()"}[self.agg]
+        keys = []
+        if self.grain is not None:
+            freq = {"day": "D", "week": "W-SUN", "month": "M"}[self.grain]
+            keys.append(f"rows[{date_col!r}].dt.to_period({freq!r})")
+        if self.by is not None:
+            keys.append(f"rows[{self.by!r}]")
+        if keys:
+            group = f"rows.groupby([{', '.join(keys)}])"
+            group += "" if self.measure is None else f"[{self.measure!r}]"
+            lines.append(f"print({group}.{'size()' if self.measure is None else stat})")
+        else:
+            lines.append("print(len(rows))" if self.measure is None else f"print({target}.{stat})")
+        return "\n".join(lines)
+
+
+def _find_period(tokens):
+    """(lo, hi, label, used token positions) for one date mention, or None / 'ambiguous'."""
+    found = []
+    i = 0
+    while i < len(tokens):
+        t = tokens[i]
+        nxt = tokens[i + 1] if i + 1 < len(tokens) else ""
+        nxt2 = tokens[i + 2] if i + 2 < len(tokens) else ""
+        if re.fullmatch(r"\d{4}-\d{2}-\d{2}", t):
+            try:
+                day = _dt.date.fromisoformat(t)
+            except ValueError:
+                return "ambiguous"
+            found.append((day, day + _dt.timedelta(days=1), t, {i}))
+            i += 1
+        elif t.isdigit() and 1 <= int(t) <= 31 and nxt in _MONTHS and re.fullmatch(r"(19|20)\d{2}", nxt2):
+            try:
+                day = _dt.date(int(nxt2), _MONTHS[nxt], int(t))
+            except ValueError:
+                return "ambiguous"
+            found.append((day, day + _dt.timedelta(days=1), day.isoformat(), {i, i + 1, i + 2}))
+            i += 3
+        elif t in _MONTHS and re.fullmatch(r"(19|20)\d{2}", nxt):
+            year, month = int(nxt), _MONTHS[t]
+            lo = _dt.date(year, month, 1)
+            hi = _dt.date(year + month // 12, month % 12 + 1, 1)
+            found.append((lo, hi, f"{calendar.month_name[month]} {year}", {i, i + 1}))
+            i += 2
+        elif re.fullmatch(r"(19|20)\d{2}", t):
+            year = int(t)
+            found.append((_dt.date(year, 1, 1), _dt.date(year + 1, 1, 1), str(year), {i}))
+            i += 1
+        elif t in _MONTHS and t not in ("may", "mar"):
+            return "ambiguous"           # a month without a year
+        else:
+            i += 1
+    if len(found) > 1:
+        return "ambiguous"
+    return found[0] if found else None
+
+
+def _find_phrase(tokens, phrase_tokens, used):
+    n = len(phrase_tokens)
+    for i in range(len(tokens) - n + 1):
+        if [_singular(t) for t in tokens[i:i + n]] == [_singular(p) for p in phrase_tokens]:
+            if not used.intersection(range(i, i + n)):
+                return set(range(i, i + n))
+    return None
+
+
+def match_intent(question, cubes):
+    """Intent answering `question` from one of `cubes`, or None (let Tool-2 handle it)."""
+    tokens = _tokens(question)
+    if not tokens:
+        return None
+
+    period = _find_period(tokens)
+    if period == "ambiguous":
+        return None
+    used = set(period[3]) if period else set()
+
+    # Measure (and table): the measure name must appear; the table name settles ties.
+    candidates = []
+    for cube in cubes:
+        table_pos = _find_phrase(tokens, _tokens(re.sub(r"\.\w+$", "", cube.name)), used)
+        for measure in cube.measures:
+            pos = _find_phrase(tokens, _tokens(measure), used)
+            if pos:
+                candidates.append((cube, measure, pos, table_pos))
+        if table_pos:
+            candidates.append((cube, None, set(), table_pos))
+    with_measure = [c for c in candidates if c[1] is not None]
+    pool = with_measure or candidates
+    if len(pool) > 1:
+        pool = [c for c in pool if c[3]]
+    if len(pool) != 1:
+        return None
+    cube, measure, measure_pos, table_pos = pool[0]
+    used |= measure_pos | (table_pos or set())
+
+    words = set(tokens)
+    if words & _AVG_WORDS:
+        if measure is None:
+            return None
+        agg = "avg"
+    elif measure is None:
+        if not words & _COUNT_WORDS:
+            return None
+        agg = "count"
+    else:
+        agg = "sum"
+    used |= {i for i, t in enumerate(tokens) if t in _AVG_WORDS | _COUNT_WORDS | _SUM_WORDS}
+
+    # Breakdown: "by month", "monthly", "per site", ...
+    grain, by = None, None
+    for i, t in enumerate(tokens):
+        if t in ("daily", "weekly", "monthly"):
+            grain = _GRAIN_WORDS[t]
+            used.add(i)
+        elif t in _BREAKDOWN_WORDS and i + 1 < len(tokens):
+            if tokens[i + 1] in _GRAIN_WORDS:
+                if agg == "avg" and t == "per":
+                    return None          # "average X per day": mean of daily totals, not a breakdown
+                grain = _GRAIN_WORDS[tokens[i + 1]]
+                used |= {i, i + 1}
+                continue
+            for dim in cube.dimensions:
+                pos = _find_phrase(tokens[i + 1:], _tokens(dim), set())
+                if pos and min(pos) == 0:
+                    by = dim
+                    used |= {i} | {i + 1 + p for p in pos}
+                    break
+
+    # At most one dimension value filter (cube frames are per single dimension).
+    filters = []
+    for dim, values in cube.dim_values.items():
+        for lowered, value in values.items():
+            pos = _find_phrase(tokens, _tokens(lowered), used)
+            if pos:
+                filters.append((dim, value, pos))
+                break
+    if len(filters) > 1 or (filters and by is not None and filters[0][0] != by):
+        return None
+    flt = None
+    if filters:
+        flt = filters[0][:2]
+        used |= filters[0][2]
+
+    leftover = [t for i, t in enumerate(tokens) if i not in used and t not in _STOPWORDS
+                and t not in _BREAKDOWN_WORDS]
+    if leftover:
+        return None
+
+    lo, hi, label = (period[0], period[1], period[2]) if period else (None, None, "")
+    return Intent(cube, measure, agg, lo, hi, label, flt, grain, by)
+
+
+def answer(intent):
+    """Printed answer (same shape as a Tool-2 run) for `intent`."""
+    import pandas as pd
+
+    cube = intent.cube
+    grain = intent.grain or "day"
+    dim = intent.by or (intent.filter[0] if intent.filter else None)
+    frame = cube.frame(grain, dim)
+    if frame is None:
+        return None
+    if intent.lo is not None:
+        if grain != "day" and (cube.frame("day", dim) is not None):
+            # Period bounds inside a coarser bucket need the day cube.
+            day = cube.frame("day", dim)
+            rows = day[(day["period"] >= pd.Timestamp(intent.lo)) & (day["period"] < pd.Timestamp(intent.hi))]
+            rows = rows.assign(period=_period_key(rows["period"], grain))
+        else:
+            rows = frame[(frame["period"] >= pd.Timestamp(intent.lo)) & (frame["period"] < pd.Timestamp(intent.hi))]
+    else:
+        rows = frame
+    if intent.filter is not None:
+        rows = rows[rows[intent.filter[0]] == intent.filter[1]]
+    if rows.empty or rows["rows"].sum() == 0:
+        return "No data available for the specified criteria."
+
+    value_cols = ["rows"] if intent.measure is None else [intent.measure, f"{intent.measure}__n"]
+    keys = (["period"] if intent.grain else []) + ([intent.by] if intent.by else [])
+
+    def _value(part):
+        if intent.measure is None:
+            return part["rows"].sum()
+        if intent.agg == "avg":
+            n = part[f"{intent.measure}__n"].sum()
+            return part[intent.measure].sum() / n if n else float("nan")
+        return part[intent.measure].sum()
+
+    label = {"sum": "Total", "avg": "Average", "count": "Number of rows"}[intent.agg]
+    subject = f"{label} {intent.measure}" if intent.measure else label
+    scope = [f"in {cube.name}"]
+    if intent.filter:
+        scope.append(f"where {intent.filter[0]} = {intent.filter[1]}")
+    if intent.period_label:
+        scope.append(f"for {intent.period_label}")
+    title = f"{subject} {' '.join(scope)}"
+
+    if not keys:
+        return f"{title}: {_value(rows)}"
+
+    grouped = rows[keys + value_cols].groupby(keys, sort=True)
+    result = grouped.apply(_value).rename(intent.measure or "rows").reset_index()
+    if intent.grain:
+        fmt = {"day": "%Y-%m-%d", "week": "week of %Y-%m-%d", "month": "%Y-%m"}[intent.grain]
+        result["period"] = result["period"].dt.strftime(fmt)
+    by_text = ([intent.grain] if intent.grain else []) + ([intent.by] if intent.by else [])
+    lines = [f"{title}, by {', '.join(by_text)}:"]
+    lines.append(result.head(ROLLUP_MAX_RESULT_ROWS).to_string(index=False))
+    if len(result) > ROLLUP_MAX_RESULT_ROWS:
+        lines.append(f"... {len(result) - ROLLUP_MAX_RESULT_ROWS} more rows")
+    return "\n".join(lines)
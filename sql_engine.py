@@ -0,0 +1,225 @@
+# SQL engine
+# Alternative Tool-2 backend: the LLM writes one SQL query over the cached tables
+# instead of free-form pandas, and an embedded engine runs it in-process.
+#
+# - TOOL2_ENGINE selects the backend per deployment: "pandas" (default, generated
+#   Python), "duckdb", "sqlite", or "sql" (DuckDB when installed, else SQLite).
+# - Every table is exposed under the file name without extension, quoted:
+#   "Al-Bujairy Terrace Footfalls.xlsx" -> "Al-Bujairy Terrace Footfalls".
+# - Only a single SELECT / WITH statement is accepted; anything touching files,
+#   extensions, settings or writes is rejected before it reaches the engine; DuckDB
+#   additionally runs with external access disabled, SQLite under a read-only authorizer.
+# - Limits: result rows (SQL_MAX_ROWS, passed as a bound LIMIT parameter) and
+#   wall-clock time (SQL_TIMEOUT_SECONDS, the query is interrupted).
+# - The referenced tables and columns come from the query text, so only those columns
+#   are loaded; results go through the shared result cache (code_cache.py).
+
+import os
+import re
+import hashlib
+import logging
+import threading
+
+TOOL2_ENGINE = os.getenv("TOOL2_ENGINE", "pandas").strip().lower()
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "200"))
+SQL_TIMEOUT_SECONDS = float(os.getenv("SQL_TIMEOUT_SECONDS", "30"))
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", "2"))
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_QUOTED_RE = re.compile(r'"((?:[^"]|"")+)"')
+_WORD_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_FILE_TABLE_RE = re.compile(r"\b(?:from|join)\s*\(?\s*''", re.I)     # FROM '/path/file.csv'
+_FORBIDDEN = {
+    "insert", "update", "delete", "drop", "create", "alter", "attach", "detach", "copy",
+    "pragma", "install", "export", "vacuum", "truncate", "grant", "checkpoint",
+    "read_csv", "read_csv_auto", "read_parquet", "parquet_scan", "read_json", "read_json_auto",
+    "glob", "read_text", "read_blob", "sqlite_scan", "sqlite_attach", "postgres_scan",
+    "load_extension", "writefile", "readfile",
+}
+_VOLATILE = {"now", "current_date", "current_time", "current_timestamp", "today",
+             "random", "uuid", "gen_random_uuid", "localtime", "localtimestamp"}
+# String literals naming the current time: date('now', '-7 day'), 'today'::DATE, ...
+_VOLATILE_STRINGS = {"now", "today", "yesterday", "tomorrow", "localtime"}
+
+
+class SqlError(Exception):
+    """The query was rejected or failed in the engine."""
+
+
+def resolve_engine(name=TOOL2_ENGINE):
+    """'duckdb' | 'sqlite' for a SQL deployment, None for the pandas engine."""
+    if name in ("duckdb", "sqlite"):
+        if name == "duckdb" and not _duckdb_available():
+            logging.warning("[SQL] duckdb is not installed, using sqlite")
+            return "sqlite"
+        return name
+    if name == "sql":
+        return "duckdb" if _duckdb_available() else "sqlite"
+    return None
+
+
+def _duckdb_available():
+    try:
+        import duckdb  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def table_identifier(file_name):
+    return os.path.splitext(file_name)[0]
+
+
+def quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+# ----------------------------------------------------------------- validation --
+class SqlFacts:
+    __slots__ = ("sql", "tables", "columns", "volatile")
+
+    def __init__(self, sql, tables, columns, volatile):
+        self.sql = sql
+        self.tables = tables          # file names, in order of appearance
+        self.columns = columns        # file name -> [column] or None (all columns)
+        self.volatile = volatile
+
+
+def _strip_fences(sql):
+    sql = sql.strip()
+    if sql.startswith("```"):
+        sql = re.sub(r"^```\w*\s*|\s*```$", "", sql)
+    return sql.strip().rstrip(";").strip()
+
+
+def validate_sql(sql, schemas):
+    """
+    Checks that `sql` is one read-only query over the known tables and returns its
+    SqlFacts. `schemas` is {file name: [column]}. Raises SqlError otherwise.
+    """
+    sql = _strip_fences(sql)
+    if not sql:
+        raise SqlError("empty query")
+    # Checked before the literals are blanked out below.
+    literals = {m[1:-1].replace("''", "'").strip().lower() for m in _STRING_RE.findall(sql)}
+    bare = _COMMENT_RE.sub(" ", _STRING_RE.sub("''", sql))
+    if ";" in bare:
+        raise SqlError("only one statement is allowed")
+    words = [w.lower() for w in _WORD_RE.findall(_QUOTED_RE.sub(" ", bare))]
+    if not words or words[0] not in ("select", "with"):
+        raise SqlError("only SELECT queries are allowed")
+    forbidden = _FORBIDDEN.intersection(words)
+    if forbidden:
+        raise SqlError(f"forbidden keyword(s): {', '.join(sorted(forbidden))}")
+    if _FILE_TABLE_RE.search(bare):
+        raise SqlError("string literals cannot be used as tables")
+
+    quoted = [q.replace('""', '"') for q in _QUOTED_RE.findall(bare)]
+    identifiers = {table_identifier(fn).lower(): fn for fn in schemas}
+    tables = []
+    for name in quoted:
+        fn = identifiers.get(name.lower())
+        if fn is not None and fn not in tables:
+            tables.append(fn)
+    if not tables:
+        raise SqlError("the query does not reference any known table")
+
+    # Column pruning: every column whose name appears in the query (a superset of what
+    # it reads). "*" loads everything.
+    mentioned = {q.lower() for q in quoted} | set(words)
+    columns = {}
+    for fn in tables:
+        if re.search(r"(^|[\s,(.])\*", bare):
+            columns[fn] = None
+            continue
+        used = [c for c in schemas[fn] if isinstance(c, str) and c.lower() in mentioned]
+        columns[fn] = used or None
+    volatile = bool(_VOLATILE.intersection(words) or _VOLATILE_STRINGS.intersection(literals))
+    return SqlFacts(sql, tables, columns, volatile)
+
+
+def sql_result_key(facts, etags):
+    """Result cache key for `facts` on tables {name: etag}, None if not cacheable."""
+    if facts.volatile or any(not etag for etag in etags.values()):
+        return None
+    normalized = " ".join(_COMMENT_RE.sub(" ", facts.sql).split())
+    versions = "|".join(f"{name}={etags[name]}" for name in sorted(etags))
+    return hashlib.sha1(f"sql|{normalized}|{versions}".encode("utf-8")).hexdigest()
+
+
+# ------------------------------------------------------------------ execution --
+def _run_duckdb(sql, dataframes, max_rows, timeout):
+    import duckdb
+
+    # No file / network access (read_csv, '/path' as a table, ATTACH, extensions): set at
+    # connect, DuckDB rejects changing it on a running database. Never run without it.
+    try:
+        con = duckdb.connect(":memory:", config={"threads": DUCKDB_THREADS, "enable_external_access": False})
+    except Exception as e:
+        raise SqlError(f"cannot disable external access in DuckDB, refusing to run: {e}") from e
+    try:
+        for name, df in dataframes.items():
+            con.register(table_identifier(name), df)      # scans the frame, no copy
+        timer = threading.Timer(timeout, con.interrupt)
+        timer.start()
+        try:
+            return con.execute(f"SELECT * FROM ({sql}) AS q LIMIT ?", [max_rows + 1]).fetchdf()
+        except Exception as e:
+            raise SqlError(str(e)) from e
+        finally:
+            timer.cancel()
+    finally:
+        con.close()
+
+
+def _run_sqlite(sql, dataframes, max_rows, timeout):
+    import sqlite3
+    import time
+    import pandas as pd
+
+    con = sqlite3.connect(":memory:", check_same_thread=False)
+    try:
+        for name, df in dataframes.items():
+            df.to_sql(table_identifier(name), con, index=False)
+
+        def _read_only(action, *args):
+            return sqlite3.SQLITE_OK if action in (sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ,
+                                                  sqlite3.SQLITE_FUNCTION) else sqlite3.SQLITE_DENY
+        con.set_authorizer(_read_only)
+        deadline = time.monotonic() + timeout
+        con.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, 10000)
+        try:
+            return pd.read_sql_query(f"SELECT * FROM ({sql}) AS q LIMIT ?", con, params=(max_rows + 1,))
+        except Exception as e:
+            raise SqlError(str(e)) from e
+    finally:
+        con.close()
+
+
+def run_sql(sql, dataframes, engine, max_rows=SQL_MAX_ROWS, timeout=SQL_TIMEOUT_SECONDS):
+    """Runs a validated query; returns its rows as text (at most max_rows)."""
+    runner = _run_duckdb if engine == "duckdb" else _run_sqlite
+    result = runner(sql, dataframes, max_rows, timeout)
+    if result.empty:
+        return "No data available for the specified criteria."
+    truncated = len(result) > max_rows
+    result = result.head(max_rows)
+    if result.shape == (1, 1):
+        return f"{result.columns[0]}: {result.iat[0, 0]}"
+    text = result.to_string(index=False)
+    if truncated:
+        from output_capture import TRUNCATED_MARKER
+        text += f"\n{TRUNCATED_MARKER} only the first {max_rows} rows are shown]"
+    return text
+
+
+def describe_tables(meta, engine):
+    """Prompt text: one line per table with its SQL name and typed columns."""
+    lines = []
+    for fn, info in meta.items():
+        cols = ", ".join(f"{quote(c)} {dt}" for c, dt in info["schema"].items())
+        lines.append(f"{quote(table_identifier(fn))} (file \"{fn}\"): {cols}")
+    if engine == "sqlite":
+        lines.append("Dates are stored as text 'YYYY-MM-DD HH:MM:SS'; compare them with date strings.")
+    return "\n".join(lines)
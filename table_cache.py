@@ -0,0 +1,424 @@
+# Table cache
+# Process-wide cache of the parsed Tool-2 tables (xlsx / csv from the tabular blob folder).
+#
+# - Keyed by file name; every entry remembers the blob ETag it was parsed from.
+# - Entries are re-validated at most every ETAG_POLL_SECONDS with a HEAD request
+#   (blob properties): an unchanged blob never costs a download or a re-parse.
+# - With a TableStore attached, a table not in memory is attached from the shared
+#   columnar copy for its current ETag; only if that is missing does one worker (store
+#   lock) download and parse the blob, the others wait and attach to its copy.
+# - LRU eviction against a memory budget measured with memory_usage(deep=True).
+# - Hit / miss / byte counters are available through stats().
+# - Each entry also carries the distinct-value index of its text columns (value_index.py),
+#   built on first use and dropped together with the table version it was built from;
+#   likewise its secondary row indexes (table_index.py: sorted dates, key positions).
+#
+# - get(name, columns=[...]) returns only those columns. On a cold miss (table neither in
+#   memory nor in the store) only those columns are parsed for the caller, and the full
+#   table is parsed from the same downloaded bytes in the background.
+#
+# - get_rows(name, bounds) returns only the rows of the date ranges the code analysis
+#   proved the code reads (CodeFacts.row_bounds): taken through the row index when the
+#   table is in memory, otherwise assembled from the overlapping date partitions of the
+#   store copy without loading the whole table. None means: load it whole with get().
+#
+# - Views (join_views.py) are registered with register_view(): they are served like
+#   tables, under a composite ETag of their sources' ETags, built from the sources'
+#   cached frames and materialized in the store like a parsed table.
+#
+# Frames returned by get() without `columns` are shared between requests: their column
+# arrays are read-only (frame_isolation.protect), code that modifies them works on
+# frame_isolation.isolate() views.
+
+import io
+import os
+import time
+import hashlib
+import logging
+import threading
+import concurrent.futures
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from frame_isolation import protect
+from table_ingest import normalize_table
+
+TABLE_CACHE_MAX_BYTES = int(os.getenv("TABLE_CACHE_MAX_MB", "1024")) * 1024 * 1024
+ETAG_POLL_SECONDS = int(os.getenv("TABLE_ETAG_POLL_SECONDS", "60"))
+
+
+def parse_table(file_name, data, usecols=None):
+    """
+    Parses raw blob bytes into a DataFrame based on the file extension, then runs the
+    one-time ingestion clean-up (placeholders → NA, numeric / date coercion).
+    `usecols` restricts parsing to those column names.
+    """
+    if usecols is not None:
+        wanted = set(map(str, usecols))
+        usecols = lambda col: str(col) in wanted
+    if file_name.lower().endswith((".xlsx", ".xls")):
+        df = pd.read_excel(io.BytesIO(data), usecols=usecols)
+    elif file_name.lower().endswith(".csv"):
+        df = pd.read_csv(io.BytesIO(data), usecols=usecols)
+    else:
+        raise ValueError(f"Unsupported table type: {file_name}")
+    df, _ = normalize_table(df, name=file_name)
+    return df
+
+
+def _select_columns(df, columns):
+    """`df` itself, or a new frame with the `columns` it has (at least one column is kept)."""
+    if columns is None:
+        return df
+    wanted = set(map(str, columns))
+    positions = [i for i, col in enumerate(df.columns) if str(col) in wanted] or list(range(min(1, df.shape[1])))
+    return df.take(positions, axis=1)
+
+
+class _Entry:
+    __slots__ = ("etag", "df", "nbytes", "checked_at", "value_index", "table_index")
+
+    def __init__(self, etag, df, checked_at):
+        self.etag = etag
+        self.df = df
+        protect(df)
+        self.nbytes = int(df.memory_usage(deep=True).sum())
+        self.checked_at = checked_at
+        self.value_index = None
+        self.table_index = None
+
+
+class TableCache:
+    """
+    LRU cache of parsed tables, validated against blob ETags.
+
+    container_getter: callable returning an azure ContainerClient (shared client).
+    folder:           blob prefix of the tabular folder.
+    store:            optional table_store.TableStore (local columnar copies).
+    """
+
+    def __init__(self, container_getter, folder, max_bytes=TABLE_CACHE_MAX_BYTES,
+                 poll_seconds=ETAG_POLL_SECONDS, store=None):
+        self._container_getter = container_getter
+        self._folder = folder
+        self._store = store
+        self.max_bytes = max_bytes
+        self.poll_seconds = poll_seconds
+
+        self._entries = OrderedDict()
+        self._views = {}          # view name -> (source names, build(frames) -> DataFrame)
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._bytes = 0
+        self._background = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="table-cache")
+        self._stats = {
+            "hits": 0,            # served from memory without any network call
+            "revalidated": 0,     # ETag checked, unchanged
+            "store_loads": 0,     # loaded from the local columnar store
+            "misses": 0,          # downloaded + parsed
+            "pruned_loads": 0,    # cold miss served by parsing only the requested columns
+            "partial_loads": 0,   # date-bounded rows served from the store partitions
+            "reloads": 0,         # cached but the ETag changed
+            "evictions": 0,
+            "downloaded_bytes": 0,
+        }
+
+    # ------------------------------------------------------------------ public --
+    def get(self, file_name, columns=None):
+        """
+        Returns the parsed DataFrame for `file_name` (shared, column arrays read-only).
+        With `columns`, returns a new frame holding only those columns (the caller owns it).
+        Raises the underlying azure / pandas error if the table cannot be loaded.
+        """
+        entry = self._lookup(file_name)
+        if entry is not None and time.time() - entry.checked_at < self.poll_seconds:
+            self._count("hits")
+            return _select_columns(entry.df, columns)
+
+        # One loader per table: concurrent requests for the same table wait for it.
+        with self._load_lock(file_name):
+            entry = self._lookup(file_name)
+            if entry is not None and time.time() - entry.checked_at < self.poll_seconds:
+                self._count("hits")
+                return _select_columns(entry.df, columns)
+            return self._load(file_name, entry, columns)
+
+    def get_rows(self, file_name, bounds, columns=None):
+        """
+        (frame, etag): a new frame with the rows of `file_name` that can fall in `bounds`
+        ({date column: [(lo, lo_inclusive, hi, hi_inclusive), ..]}, a superset is fine),
+        in table order and with the table's index, restricted to `columns` if given, and
+        the ETag of the table version it was taken from (which can be newer than etag()
+        when served from the store). None if they cannot be served without loading the
+        whole table.
+        """
+        entry = self._lookup(file_name)
+        if entry is None or time.time() - entry.checked_at >= self.poll_seconds:
+            if entry is None and self._store is None:
+                return None
+            etag = self._remote_etag(file_name)
+            if entry is None or entry.etag != etag:
+                if self._store is None:
+                    return None
+                started = time.perf_counter()
+                df = self._store.load_partitions(file_name, etag, bounds, columns)
+                if df is None:
+                    return None
+                self._count("partial_loads")
+                logging.info(
+                    f"[TableCache] {len(df)} row(s) of '{file_name}' from store partitions in "
+                    f"{(time.perf_counter() - started) * 1000:.0f} ms"
+                )
+                return df, etag
+            entry.checked_at = time.time()
+            self._count("revalidated")
+        else:
+            self._count("hits")
+
+        index = self.table_index(file_name)
+        df = entry.df
+        names = list(map(str, df.columns))
+        for column, ranges in bounds.items():
+            if names.count(column) != 1:
+                continue
+            series = df.iloc[:, names.index(column)]
+            chunks = []
+            for lo, _, hi, _ in ranges:
+                positions = index.between(series, column, lo, hi) if index is not None else None
+                if positions is None:
+                    break
+                chunks.append(np.arange(positions.start, positions.stop) if isinstance(positions, slice) else positions)
+            else:
+                positions = np.unique(np.concatenate(chunks)) if chunks else np.empty(0, dtype=np.int64)
+                return _select_columns(df.take(positions), columns), entry.etag
+        return None
+
+    def register_view(self, name, sources, build):
+        """Serves `name` as the result of build({source: frame}) over the tables `sources`."""
+        with self._lock:
+            self._views[name] = (list(sources), build)
+
+    def is_view(self, file_name):
+        return file_name in self._views
+
+    @property
+    def store(self):
+        """The attached table_store.TableStore, or None."""
+        return self._store
+
+    def etag(self, file_name):
+        """ETag of the cached copy, or None if the table is not cached."""
+        with self._lock:
+            entry = self._entries.get(file_name)
+            return entry.etag if entry else None
+
+    def fresh_etag(self, file_name):
+        """
+        ETag of the cached copy if it was validated within poll_seconds, else None.
+        No network call: for cache keys that must not outlive the table version.
+        """
+        with self._lock:
+            entry = self._entries.get(file_name)
+            if entry is None or time.time() - entry.checked_at >= self.poll_seconds:
+                return None
+            return entry.etag
+
+    def value_index(self, file_name):
+        """
+        ValueIndex of the cached version of `file_name` (created on first call),
+        or None if the table is not cached.
+        """
+        from value_index import ValueIndex
+
+        with self._lock:
+            entry = self._entries.get(file_name)
+            if entry is None:
+                return None
+            if entry.value_index is None:
+                entry.value_index = ValueIndex(entry.df)
+            return entry.value_index
+
+    def table_index(self, file_name):
+        """
+        TableIndex (row lookups) of the cached version of `file_name` (created on first
+        call), or None if the table is not cached.
+        """
+        from table_index import TableIndex
+
+        with self._lock:
+            entry = self._entries.get(file_name)
+            if entry is None:
+                return None
+            if entry.table_index is None:
+                entry.table_index = TableIndex()
+            return entry.table_index
+
+    def layouts(self):
+        """{file name: dtype layout report (dtype_layout.py)} of the cached tables."""
+        with self._lock:
+            return {name: entry.df.attrs.get("layout") for name, entry in self._entries.items()}
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out["tables"] = len(self._entries)
+            out["bytes"] = self._bytes
+            out["max_bytes"] = self.max_bytes
+            return out
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    # ----------------------------------------------------------------- helpers --
+    def _count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _lookup(self, file_name):
+        with self._lock:
+            entry = self._entries.get(file_name)
+            if entry is not None:
+                self._entries.move_to_end(file_name)
+            return entry
+
+    def _load_lock(self, file_name):
+        with self._lock:
+            return self._load_locks.setdefault(file_name, threading.Lock())
+
+    def _blob_client(self, file_name):
+        blob_name = os.path.join(self._folder, file_name).replace("\\", "/")
+        return self._container_getter().get_blob_client(blob_name)
+
+    def _remote_etag(self, file_name):
+        """Current ETag of a table blob, or the composite ETag of a view's sources."""
+        view = self._views.get(file_name)
+        if view is None:
+            return self._blob_client(file_name).get_blob_properties().etag
+        parts = [f"{source}={self.fresh_etag(source) or self._remote_etag(source)}" for source in view[0]]
+        return "view-" + hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:20]
+
+    def _load_view(self, file_name, entry, columns=None):
+        sources, build = self._views[file_name]
+        etag = self._remote_etag(file_name)
+        if entry is not None:
+            if entry.etag == etag:
+                entry.checked_at = time.time()
+                self._count("revalidated")
+                return _select_columns(entry.df, columns)
+            self._count("reloads")
+
+        def _build():
+            frames = {source: self.get(source) for source in sources}
+            if self._remote_etag(file_name) != etag:
+                raise RuntimeError(f"a source of view '{file_name}' changed while it was being built")
+            started = time.perf_counter()
+            df = build(frames)
+            logging.info(f"[TableCache] built view '{file_name}' ({len(df)} rows) in "
+                         f"{time.perf_counter() - started:.2f}s")
+            return df
+
+        if self._store is None:
+            df = _build()
+        else:
+            df, built = self._store.load_or_build(file_name, etag, _build)
+            if not built:
+                self._count("store_loads")
+        self._put(file_name, _Entry(etag, df, checked_at=time.time()))
+        return _select_columns(df, columns)
+
+    def _load(self, file_name, entry, columns=None):
+        from azure.core import MatchConditions
+
+        if file_name in self._views:
+            return self._load_view(file_name, entry, columns)
+
+        blob_client = self._blob_client(file_name)
+        etag = blob_client.get_blob_properties().etag
+
+        if entry is not None:
+            if entry.etag == etag:
+                entry.checked_at = time.time()
+                self._count("revalidated")
+                return _select_columns(entry.df, columns)
+            self._count("reloads")
+
+        def _download():
+            downloader = blob_client.download_blob(etag=etag, match_condition=MatchConditions.IfNotModified)
+            data = downloader.readall()
+            self._count("misses")
+            self._count("downloaded_bytes", len(data))
+            return data
+
+        def _parse(data):
+            started = time.perf_counter()
+            parsed = parse_table(file_name, data)
+            logging.info(f"[TableCache] parsed '{file_name}' in {time.perf_counter() - started:.2f}s")
+            return parsed
+
+        if columns is not None and (self._store is None or not self._store.has(file_name, etag)):
+            # Cold miss for a column subset: parse just those columns now, the full
+            # table from the same bytes in the background.
+            data = _download()
+            started = time.perf_counter()
+            df = parse_table(file_name, data, usecols=columns)
+            self._count("pruned_loads")
+            logging.info(
+                f"[TableCache] parsed {df.shape[1]} column(s) of '{file_name}' in "
+                f"{time.perf_counter() - started:.2f}s, full table loading in background"
+            )
+            self._background.submit(self._load_full, file_name, etag, lambda: _parse(data))
+            return df
+
+        def _download_and_parse():
+            return _parse(_download())
+
+        if self._store is None:
+            df = _download_and_parse()
+        else:
+            started = time.perf_counter()
+            df, built = self._store.load_or_build(file_name, etag, _download_and_parse)
+            if not built:
+                self._count("store_loads")
+                logging.info(
+                    f"[TableCache] '{file_name}' attached from local store in "
+                    f"{(time.perf_counter() - started) * 1000:.0f} ms"
+                )
+
+        self._put(file_name, _Entry(etag, df, checked_at=time.time()))
+        return _select_columns(df, columns)
+
+    def _load_full(self, file_name, etag, build):
+        try:
+            with self._load_lock(file_name):
+                entry = self._lookup(file_name)
+                if entry is not None and entry.etag == etag:
+                    return
+                if self._store is None:
+                    df = build()
+                else:
+                    df, _ = self._store.load_or_build(file_name, etag, build)
+                self._put(file_name, _Entry(etag, df, checked_at=time.time()))
+        except Exception as e:
+            logging.warning(f"[TableCache] background load of '{file_name}' failed: {e}")
+
+    def _put(self, file_name, entry):
+        with self._lock:
+            old = self._entries.pop(file_name, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            if entry.nbytes > self.max_bytes:
+                logging.warning(
+                    f"[TableCache] '{file_name}' ({entry.nbytes / 1e6:.1f} MB) exceeds the "
+                    f"cache budget, serving it uncached"
+                )
+                return
+            self._entries[file_name] = entry
+            self._bytes += entry.nbytes
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self._stats["evictions"] += 1
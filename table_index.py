@@ -0,0 +1,145 @@
+# Table index
+# Secondary indexes of a cached table version, so the date-range and key filters of the
+# generated code do not scan every row:
+#
+#   - date columns: the row order sorted by the column (argsort, NaT left out); a range
+#     is two binary searches (O(log n)) and a contiguous slice when the column is
+#     already in order
+#   - key columns (text / category with few distinct values): row positions per value
+#
+# Indexes are built lazily per column on first use and belong to one table version
+# (TableCache entry, or the sandbox worker's per-version cache); they hold row
+# positions only, so they serve any copy / column subset of that version.
+#
+# The generated code reaches them through two helpers in its namespace:
+#   rows_between(df, "Date", "2024-03-01", "2024-03-31")        inclusive bounds, None = open
+#   rows_where(df, {"City": "Jeddah", "Category": ["A", "B"]})  equality / membership
+# Both return the matching rows in their original order. For a frame that is not an
+# indexed table (filtered, merged, modified in place) they fall back to a boolean mask,
+# so the answer never depends on the index.
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+KEY_INDEX_MAX_UNIQUE_SHARE = 0.5
+_FINGERPRINT_POINTS = 32
+
+
+def _fingerprint(series):
+    n = len(series)
+    if n == 0:
+        return ()
+    positions = np.unique(np.linspace(0, n - 1, _FINGERPRINT_POINTS).astype(np.int64))
+    return tuple("<NA>" if pd.isna(v) else v for v in series.iloc[positions].tolist())
+
+
+class TableIndex:
+    """Lazily built indexes of one table version (row positions only)."""
+
+    def __init__(self):
+        self._dates = {}     # column -> (order, sorted values, monotonic, fingerprint) or None
+        self._keys = {}      # column -> ({value: positions}, fingerprint) or None
+        self._lock = threading.Lock()
+
+    def _date_index(self, col, series):
+        with self._lock:
+            if col in self._dates:
+                return self._dates[col]
+        entry = None
+        if pd.api.types.is_datetime64_dtype(series.dtype):
+            values = series.to_numpy()
+            valid = np.flatnonzero(~np.isnat(values))
+            order = valid[np.argsort(values[valid], kind="stable")]
+            monotonic = len(order) == len(values) and bool(np.all(np.diff(order) == 1))
+            entry = (order, values[order], monotonic, _fingerprint(series))
+        with self._lock:
+            self._dates[col] = entry
+        return entry
+
+    def _key_index(self, col, series):
+        with self._lock:
+            if col in self._keys:
+                return self._keys[col]
+        entry = None
+        if (series.dtype == object or isinstance(series.dtype, pd.CategoricalDtype)) \
+                and series.nunique() <= KEY_INDEX_MAX_UNIQUE_SHARE * max(len(series), 1):
+            groups = series.groupby(series, sort=False, observed=True).indices
+            entry = ({key: np.asarray(pos) for key, pos in groups.items()}, _fingerprint(series))
+        with self._lock:
+            self._keys[col] = entry
+        return entry
+
+    def between(self, series, col, start, end):
+        """Row positions (a slice when in order) with start <= series <= end, or None if not indexed."""
+        entry = self._date_index(col, series)
+        if entry is None or _fingerprint(series) != entry[3]:
+            return None
+        order, sorted_values, monotonic, _ = entry
+        lo = 0 if start is None else np.searchsorted(sorted_values, np.datetime64(pd.Timestamp(start)), side="left")
+        hi = len(order) if end is None else np.searchsorted(sorted_values, np.datetime64(pd.Timestamp(end)), side="right")
+        hi = max(hi, lo)
+        if monotonic:
+            return slice(int(lo), int(hi))
+        return np.sort(order[lo:hi])
+
+    def equal(self, series, col, values):
+        """Sorted positions where series is in `values`, or None if not indexed."""
+        entry = self._key_index(col, series)
+        if entry is None or _fingerprint(series) != entry[1]:
+            return None
+        groups = entry[0]
+        parts = [groups[v] for v in values if v in groups]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts))
+
+
+def _column(df, col):
+    # Positional lookup: duplicated column names would return a DataFrame.
+    return df.iloc[:, list(df.columns).index(col)]
+
+
+def make_helpers(indexes):
+    """
+    rows_between / rows_where for one execution. `indexes` maps id(frame) of the frames
+    handed to the code to (frame.index, TableIndex) for their table version.
+    """
+    def _index_for(df):
+        found = indexes.get(id(df))
+        if found is None or found[0] is not df.index:
+            return None          # not a table frame as handed over (or re-indexed in place)
+        return found[1]
+
+    def rows_between(df, column, start=None, end=None):
+        """Rows of `df` with start <= df[column] <= end (dates; None = open bound)."""
+        series = _column(df, column)
+        index = _index_for(df)
+        positions = index.between(series, column, start, end) if index is not None else None
+        if positions is None:
+            mask = pd.Series(True, index=df.index)
+            if start is not None:
+                mask &= series >= pd.Timestamp(start)
+            if end is not None:
+                mask &= series <= pd.Timestamp(end)
+            return df[mask]
+        return df.iloc[positions]
+
+    def rows_where(df, conditions=None, **equals):
+        """Rows of `df` whose columns equal the given values (a list means any of them)."""
+        conditions = dict(conditions or {}, **equals)
+        index = _index_for(df)
+        selected = None
+        for column, wanted in conditions.items():
+            values = list(wanted) if isinstance(wanted, (list, tuple, set)) else [wanted]
+            series = _column(df, column)
+            positions = index.equal(series, column, values) if index is not None else None
+            if positions is None:
+                positions = np.flatnonzero(series.isin(values).to_numpy())
+            selected = positions if selected is None else np.intersect1d(selected, positions, assume_unique=True)
+        if selected is None:
+            return df
+        return df.iloc[selected]
+
+    return {"rows_between": rows_between, "rows_where": rows_where}
@@ -0,0 +1,153 @@
+# Table ingestion
+# One-time clean-up of a freshly parsed table, applied before it enters the table cache
+# and the local columnar store (so once per data version, not once per question):
+#
+#   1) placeholder strings ('-', 'N/A', blanks, ...) become NA
+#   2) object columns that are (almost) all numbers become numeric
+#   3) object columns that are (almost) all dates become datetime64, parsed with the
+#      format profiled from the column's own values
+#   4) memory layout: low-cardinality text -> ordered category (dtype_layout.py)
+#
+# The generated Tool-2 code then sees clean dtypes (advertised in SCHEMA_TEXT) and no
+# longer needs its own replace / to_numeric / to_datetime boilerplate.
+
+import re
+import logging
+import datetime as _dt
+
+import pandas as pd
+
+from dtype_layout import optimize_layout
+
+PLACEHOLDER_VALUES = {"", "-", "--", "—", "n/a", "#n/a", "na", "null", "none", "nan"}
+
+# Share of non-null values that must convert for a column to be converted.
+MIN_CONVERTIBLE_SHARE = 0.95
+PROFILE_SAMPLE_SIZE = 500
+
+DATE_FORMATS = [
+    "%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y/%m/%d",
+    "%d/%m/%Y", "%d/%m/%Y %H:%M", "%d/%m/%Y %H:%M:%S",
+    "%m/%d/%Y", "%m/%d/%Y %H:%M", "%m/%d/%Y %H:%M:%S",
+    "%d-%m-%Y", "%d.%m.%Y", "%d-%b-%Y", "%d %b %Y", "%d %B %Y",
+    "%b %Y", "%B %Y", "%b-%Y", "%Y-%m",
+]
+
+_NUMERIC_RE = re.compile(r"^[+-]?(\d{1,3}(,\d{3})+|\d+)(\.\d+)?$|^[+-]?\.\d+$")
+_DATE_HINT_RE = re.compile(r"\d{1,4}[-/.]\d{1,2}|[A-Za-z]{3,9}[ -]\d{2,4}|\d{1,2}[ -][A-Za-z]{3,9}")
+
+
+def _is_placeholder(value):
+    return isinstance(value, str) and value.strip().lower() in PLACEHOLDER_VALUES
+
+
+def _as_numeric(series):
+    """
+    Returns the numeric version of an object column, or None if it does not look numeric.
+    Thousands separators are accepted; values with leading zeros ('00123') are treated
+    as identifiers and keep the column textual.
+    """
+    values = series.dropna()
+    if values.empty:
+        return None
+    text = values.astype(str).str.strip()
+    if text.str.match(r"^0\d").any():
+        return None
+    share = text.str.match(_NUMERIC_RE).mean()
+    if share < MIN_CONVERTIBLE_SHARE:
+        return None
+    cleaned = series.map(lambda v: v.replace(",", "").strip() if isinstance(v, str) else v)
+    return pd.to_numeric(cleaned, errors="coerce")
+
+
+def profile_date_format(values):
+    """
+    Picks the strptime format that parses the largest share of `values` (strings).
+    Returns (format, share) or (None, 0.0). Ties prefer day-first formats.
+    """
+    sample = [v.strip() for v in values[:PROFILE_SAMPLE_SIZE]]
+    if not sample:
+        return None, 0.0
+    best_fmt, best_share = None, 0.0
+    for fmt in DATE_FORMATS:
+        ok = 0
+        for v in sample:
+            try:
+                _dt.datetime.strptime(v, fmt)
+                ok += 1
+            except ValueError:
+                pass
+        share = ok / len(sample)
+        if share > best_share:
+            best_fmt, best_share = fmt, share
+    return best_fmt, best_share
+
+
+def _as_datetime(series):
+    """
+    Returns (datetime64 series, format) for a date-like object column, or (None, None).
+    Cells that are already date/datetime objects (common from Excel) count as dates.
+    """
+    values = series.dropna()
+    if values.empty:
+        return None, None
+
+    is_dt = values.map(lambda v: isinstance(v, (_dt.datetime, _dt.date, pd.Timestamp)))
+    strings = values[~is_dt]
+    if is_dt.all():
+        return pd.to_datetime(series, errors="coerce"), None
+    if not strings.map(lambda v: isinstance(v, str)).all():
+        return None, None
+    if strings.str.contains(_DATE_HINT_RE).mean() < MIN_CONVERTIBLE_SHARE:
+        return None, None
+
+    fmt, share = profile_date_format(strings.tolist())
+    if fmt is None or share < MIN_CONVERTIBLE_SHARE:
+        return None, None
+
+    text_mask = series.map(lambda v: isinstance(v, str))
+    parsed = pd.to_datetime(series.where(~text_mask), errors="coerce")
+    parsed[text_mask] = pd.to_datetime(series[text_mask].str.strip(), format=fmt, errors="coerce")
+    return parsed, fmt
+
+
+def normalize_table(df, name=""):
+    """
+    Cleans a parsed table in one pass (see module header). Returns (df, report) where
+    report = {"placeholders": [...], "numeric": [...], "dates": {col: format},
+    "layout": {...}}. The date formats are also kept in df.attrs["date_formats"], the
+    layout report in df.attrs["layout"].
+    """
+    df = df.copy()
+    report = {"placeholders": [], "numeric": [], "dates": {}}
+
+    # Positional access, so duplicated column names (common in Excel exports) are safe.
+    for i, col in enumerate(df.columns):
+        series = df.iloc[:, i]
+        if series.dtype != object:
+            continue
+
+        mask = series.map(_is_placeholder)
+        if mask.any():
+            series = series.mask(mask)
+            report["placeholders"].append(col)
+
+        numeric = _as_numeric(series)
+        if numeric is not None:
+            df.isetitem(i, numeric)
+            report["numeric"].append(col)
+            continue
+
+        parsed, fmt = _as_datetime(series)
+        if parsed is not None:
+            df.isetitem(i, parsed)
+            report["dates"][col] = fmt or "native"
+            continue
+
+        df.isetitem(i, series)
+
+    df.attrs["date_formats"] = dict(report["dates"])
+    report["layout"] = df.attrs["layout"] = optimize_layout(df, name=name)
+    if report["placeholders"] or report["numeric"] or report["dates"]:
+        logging.info(f"[Ingest] '{name}' normalized: {report}")
+    return df, report
@@ -0,0 +1,132 @@
+# Table resolver
+# Maps the table file names written in generated code onto the canonical names of the
+# table catalog before anything is downloaded, so "Al Bujairy Terrace Footfall.xlsx" for
+# "Al-Bujairy Terrace Footfalls.xlsx" is a rewrite instead of a failed blob download.
+#
+# - Exact name, then the normalized key (case, extension, spaces / punctuation ignored),
+#   then rapidfuzz similarity of the normalized keys (TABLE_RESOLVE_MIN_SCORE).
+# - A fuzzy match is refused when the numbers in the names differ ("Sales 2023" is not
+#   "Sales 2024") or when the runner-up is nearly as close (ambiguous).
+# - rewrite_code() replaces the literals in the code (loader arguments and any other
+#   string naming a table file) and returns the corrections made; every correction is
+#   also counted (stats()) to see which names the model keeps getting wrong.
+
+import os
+import re
+import ast
+import logging
+import threading
+from collections import Counter
+
+TABLE_RESOLVE_MIN_SCORE = float(os.getenv("TABLE_RESOLVE_MIN_SCORE", "88"))
+TABLE_RESOLVE_MIN_MARGIN = 4.0
+MEMO_MAX_ENTRIES = 10000
+
+_TABLE_EXTENSIONS = (".xlsx", ".xls", ".csv")
+_DIGITS_RE = re.compile(r"\d+")
+
+
+def normalize_table_name(name):
+    stem = str(name).strip().lower()
+    for ext in _TABLE_EXTENSIONS:
+        if stem.endswith(ext):
+            stem = stem[: -len(ext)]
+            break
+    return re.sub(r"[\W_]+", "", stem)
+
+
+class TableResolver:
+    """Resolves table names against a fixed list of catalog file names."""
+
+    def __init__(self, names):
+        self.names = list(names)
+        self._exact = set(self.names)
+        self._by_key = {}
+        for name in self.names:
+            self._by_key.setdefault(normalize_table_name(name), []).append(name)
+        self._keys = list(self._by_key)
+        self._memo = {}
+        self._corrections = Counter()
+        self._lock = threading.Lock()
+
+    def resolve(self, name):
+        """Canonical catalog name for `name`, or None if there is no safe match."""
+        if name in self._exact:
+            return name
+        if name in self._memo:
+            return self._memo[name]
+        resolved = self._resolve(name)
+        with self._lock:
+            if len(self._memo) >= MEMO_MAX_ENTRIES:
+                self._memo.clear()
+            self._memo[name] = resolved
+        return resolved
+
+    def stats(self):
+        """{"written -> canonical": count} of the corrections made so far."""
+        with self._lock:
+            return {f"{w} -> {c}": n for (w, c), n in self._corrections.most_common()}
+
+    def _resolve(self, name):
+        from rapidfuzz import process, fuzz
+
+        key = normalize_table_name(name)
+        if not key:
+            return None
+        same = self._by_key.get(key)
+        if same:
+            return same[0] if len(same) == 1 else None
+        matches = process.extract(key, self._keys, scorer=fuzz.ratio, limit=2)
+        if not matches or matches[0][1] < TABLE_RESOLVE_MIN_SCORE:
+            return None
+        best_key, best_score = matches[0][0], matches[0][1]
+        if len(matches) > 1 and best_score - matches[1][1] < TABLE_RESOLVE_MIN_MARGIN:
+            return None
+        if _DIGITS_RE.findall(best_key) != _DIGITS_RE.findall(key):
+            return None
+        candidates = self._by_key[best_key]
+        return candidates[0] if len(candidates) == 1 else None
+
+    def rewrite_code(self, code_str):
+        """
+        (code, corrections) with every resolvable table name in `code_str` replaced by
+        its catalog name; corrections is [(written, canonical)]. Unparsable code is
+        returned unchanged.
+        """
+        from code_analysis import replace_spans
+
+        try:
+            tree = ast.parse(code_str)
+        except SyntaxError:
+            return code_str, []
+
+        loader_args = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.args:
+                owner = getattr(node.func.value, "id", None)
+                if (owner == "dataframes" and node.func.attr == "get") or \
+                        (owner in ("pd", "pandas") and node.func.attr in ("read_excel", "read_csv")):
+                    loader_args.add(id(node.args[0]))
+            elif isinstance(node, ast.Subscript) and getattr(node.value, "id", None) == "dataframes":
+                loader_args.add(id(node.slice))
+
+        edits, corrections = [], []
+        for node in ast.walk(tree):
+            if not (isinstance(node, ast.Constant) and isinstance(node.value, str)):
+                continue
+            written = node.value
+            if id(node) not in loader_args and not written.lower().endswith(_TABLE_EXTENSIONS):
+                continue
+            canonical = self.resolve(written)
+            if canonical is None or canonical == written:
+                continue
+            edits.append(((node.lineno, node.col_offset, node.end_lineno, node.end_col_offset), repr(canonical)))
+            if (written, canonical) not in corrections:
+                corrections.append((written, canonical))
+        if not edits:
+            return code_str, []
+        with self._lock:
+            self._corrections.update(corrections)
+        for written, canonical in corrections:
+            logging.info(f"[TableResolver] '{written}' -> '{canonical}'")
+        return replace_spans(code_str, edits), corrections
@@ -0,0 +1,407 @@
+# Table store
+# Local columnar copy of the Tool-2 tables, so a new worker / replica does not re-parse
+# the same Excel workbooks. Each (table, ETag) is materialized once into a directory:
+#
+#   <TABLE_STORE_DIR>/<table key>/<etag key>/
+#       meta.pkl        column names, dtypes, storage kind per column, index, row count
+#       c0000.npy ...   one NumPy file per column with a plain numpy dtype (memory-mapped on load)
+#       c0001.pkl ...   pickled values for object / extension columns
+#       c0002.npy ...   category columns: the codes (memory-mapped), categories in meta.pkl
+#       p0000.rows.npy  date partitions (tables >= PARTITION_MIN_ROWS rows): the row
+#       p0000_c0001.pkl positions of one month / year of the partition column and the
+#                       pickled values of its object / extension columns
+#
+# Partitions: the first datetime column with the most values splits the rows by month
+# (by year beyond PARTITION_MAX_PARTS months; rows without a date belong to none).
+# load_partitions() assembles only the partitions overlapping the date ranges the code
+# analysis proved the code reads (CodeFacts.row_bounds), in the table's row order and
+# with its index: memory-mapped columns are gathered at those positions, object columns
+# are unpickled for those partitions only.
+#
+# Materialization runs on a background thread; a table is written to a temp dir and
+# renamed into place, so readers never see a half-written version.
+#
+# Shared across gunicorn workers (and replicas' workers on the same host):
+#   - one loader: a cross-process file lock per table makes sure only one worker
+#     downloads + parses a new version; the others wait and attach to the result
+#   - zero-copy attach: load() builds the DataFrame with one block per column directly
+#     on the read-only memory-mapped arrays, so every worker maps the same page-cache
+#     pages instead of holding its own copy (point TABLE_STORE_DIR at /dev/shm to keep
+#     them in RAM-backed shared memory)
+#   - versioned swap: a new ETag is published as a new version dir plus an atomic
+#     CURRENT pointer; the previous version is only removed VERSION_GRACE_SECONDS after
+#     it was superseded, and already-mapped arrays stay valid even after their files
+#     are unlinked
+
+import os
+import re
+import time
+import shutil
+import pickle
+import hashlib
+import logging
+import threading
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:   # not POSIX: fall back to in-process locking only
+    fcntl = None
+
+# 2: tables are stored after table_ingest normalization (attrs kept).
+# 3: dtype layout (category / downcast columns), category codes memory-mapped.
+# 4: date partitions.
+# 5: ordered categories, numeric columns no longer downcast.
+STORE_FORMAT_VERSION = 5
+TABLE_STORE_DIR = os.getenv("TABLE_STORE_DIR", "/tmp/cxqa_table_store")
+VERSION_GRACE_SECONDS = int(os.getenv("TABLE_STORE_GRACE_SECONDS", "300"))
+PARTITION_MIN_ROWS = int(os.getenv("TABLE_PARTITION_MIN_ROWS", "100000"))
+PARTITION_MAX_PARTS = 120
+
+
+def _safe_key(text):
+    # Readable prefix + hash, so odd characters in file names / ETags are harmless.
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", str(text))[:60]
+    return f"{slug}-{hashlib.sha1(str(text).encode('utf-8')).hexdigest()[:12]}"
+
+
+def frame_from_arrays(arrays, columns, index):
+    """
+    Builds a DataFrame with one block per column on top of `arrays` without copying
+    them (pd.DataFrame(dict) would consolidate same-dtype columns into a new 2-D block).
+    """
+    from pandas.core.internals import BlockManager
+    from pandas.core.internals.api import make_block
+
+    blocks = []
+    for i, values in enumerate(arrays):
+        if isinstance(values, np.ndarray):
+            values = values.reshape(1, -1)
+        blocks.append(make_block(values, placement=[i], ndim=2))
+    mgr = BlockManager(blocks, [columns, index])
+    if hasattr(pd.DataFrame, "_from_mgr"):          # pandas >= 2.1
+        return pd.DataFrame._from_mgr(mgr, axes=mgr.axes)
+    return pd.DataFrame(mgr)
+
+
+def _partition_plan(df):
+    """
+    (column position, grain, [(start, end, sorted row positions)]) of the date partitions
+    of `df`, or None if it is too small or has no datetime column.
+    """
+    if len(df) < PARTITION_MIN_ROWS:
+        return None
+    candidates = [(int(df.iloc[:, i].notna().sum()), -i) for i, dtype in enumerate(df.dtypes)
+                  if isinstance(dtype, np.dtype) and np.issubdtype(dtype, np.datetime64)]
+    if not candidates:
+        return None
+    position = -max(candidates)[1]
+    values = df.iloc[:, position].to_numpy()
+    valid = np.flatnonzero(~np.isnat(values))
+    if not len(valid):
+        return None
+    for grain, unit in (("month", "M"), ("year", "Y")):
+        keys = values[valid].astype(f"datetime64[{unit}]")
+        distinct = np.unique(keys)
+        if len(distinct) <= PARTITION_MAX_PARTS or grain == "year":
+            break
+    # Stable sort: positions stay in row order within each partition.
+    order = np.argsort(keys, kind="stable")
+    bounds = np.searchsorted(keys[order], distinct, side="left").tolist() + [len(order)]
+    parts = []
+    for j, key in enumerate(distinct):
+        start = pd.Timestamp(key.astype("datetime64[ns]"))
+        end = pd.Timestamp((key + 1).astype("datetime64[ns]"))
+        parts.append((start, end, valid[order[bounds[j]:bounds[j + 1]]]))
+    return position, grain, parts
+
+
+def _overlaps(part, ranges):
+    # Partitions are [start, end); the code filters the exact rows itself.
+    for lo, _, hi, hi_inclusive in ranges:
+        if hi is not None and (part["start"] > pd.Timestamp(hi) or (part["start"] == pd.Timestamp(hi)
+                                                                   and not hi_inclusive)):
+            continue
+        if lo is None or part["end"] > pd.Timestamp(lo):
+            return True
+    return False
+
+
+class _ProcessLock:
+    """Exclusive flock on a file, shared by all processes using the same store."""
+
+    def __init__(self, path):
+        self._fh = open(path, "a+")
+
+    def acquire(self):
+        if fcntl is not None:
+            fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def release(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._fh.close()
+
+
+class TableStore:
+    """
+    On-disk columnar store of parsed tables, keyed by (file name, ETag).
+    """
+
+    def __init__(self, root=TABLE_STORE_DIR):
+        self.root = root
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="table-store")
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------ paths --
+    def _table_dir(self, name):
+        return os.path.join(self.root, _safe_key(name))
+
+    def _version_dir(self, name, etag):
+        return os.path.join(self._table_dir(name), _safe_key(etag))
+
+    def has(self, name, etag):
+        return os.path.exists(os.path.join(self._version_dir(name, etag), "meta.pkl"))
+
+    def current_etag(self, name):
+        """ETag of the version the CURRENT pointer designates, or None."""
+        try:
+            with open(os.path.join(self._table_dir(name), "CURRENT"), "rb") as fh:
+                return pickle.load(fh)["etag"]
+        except (OSError, EOFError, pickle.UnpicklingError, KeyError):
+            return None
+
+    # ------------------------------------------------------------------ write --
+    def load_or_build(self, name, etag, build):
+        """
+        Returns (df, built). Attaches to version `etag` if some process already
+        materialized it; otherwise exactly one process (cross-process lock) calls
+        `build()` -> DataFrame, gets that frame back immediately, and materializes it
+        on the background thread while still holding the lock, so the other workers
+        wait for the published version instead of parsing the workbook themselves.
+        """
+        df = self.load(name, etag)
+        if df is not None:
+            return df, False
+
+        os.makedirs(self._table_dir(name), exist_ok=True)
+        lock = _ProcessLock(os.path.join(self._table_dir(name), ".lock")).acquire()
+        try:
+            df = self.load(name, etag)
+            if df is not None:
+                lock.release()
+                return df, False
+            built = build()
+        except BaseException:
+            lock.release()
+            raise
+
+        with self._lock:
+            self._pending.add((name, etag))
+        self._executor.submit(self._materialize_job, name, etag, built, lock)
+        return built, True
+
+    def _materialize_job(self, name, etag, df, lock):
+        try:
+            self.materialize(name, etag, df)
+        except Exception as e:
+            logging.warning(f"[TableStore] could not materialize '{name}': {e}")
+        finally:
+            lock.release()
+            with self._lock:
+                self._pending.discard((name, etag))
+
+    def materialize(self, name, etag, df):
+        """
+        Writes `df` as version `etag` of table `name` (atomic rename into place),
+        points CURRENT at it and garbage-collects expired older versions.
+        """
+        started = time.perf_counter()
+        final_dir = self._version_dir(name, etag)
+        if os.path.exists(os.path.join(final_dir, "meta.pkl")):
+            return final_dir
+        os.makedirs(self._table_dir(name), exist_ok=True)
+        tmp_dir = f"{final_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        columns = []
+        for i, col in enumerate(df.columns):
+            values = df.iloc[:, i]
+            if isinstance(values.dtype, np.dtype) and values.dtype != object:
+                file_name = f"c{i:04d}.npy"
+                np.save(os.path.join(tmp_dir, file_name), values.to_numpy(), allow_pickle=False)
+                columns.append({"name": col, "file": file_name, "kind": "npy"})
+            elif isinstance(values.dtype, pd.CategoricalDtype):
+                file_name = f"c{i:04d}.npy"
+                np.save(os.path.join(tmp_dir, file_name), values.cat.codes.to_numpy(), allow_pickle=False)
+                columns.append({"name": col, "file": file_name, "kind": "cat", "dtype": values.dtype})
+            else:
+                file_name = f"c{i:04d}.pkl"
+                with open(os.path.join(tmp_dir, file_name), "wb") as fh:
+                    pickle.dump(values.array, fh, protocol=pickle.HIGHEST_PROTOCOL)
+                columns.append({"name": col, "file": file_name, "kind": "pkl"})
+
+        partitions = None
+        plan = _partition_plan(df)
+        if plan is not None:
+            position, grain, parts = plan
+            partitions = {"column": df.columns[position], "grain": grain, "parts": []}
+            for j, (start, end, rows) in enumerate(parts):
+                part = {"start": start, "end": end, "rows": f"p{j:04d}.rows.npy", "files": {}}
+                np.save(os.path.join(tmp_dir, part["rows"]), rows, allow_pickle=False)
+                for i, col in enumerate(columns):
+                    if col["kind"] == "pkl":
+                        part["files"][i] = f"p{j:04d}_c{i:04d}.pkl"
+                        with open(os.path.join(tmp_dir, part["files"][i]), "wb") as fh:
+                            pickle.dump(df.iloc[:, i].array.take(rows), fh, protocol=pickle.HIGHEST_PROTOCOL)
+                partitions["parts"].append(part)
+
+        meta = {
+            "format": STORE_FORMAT_VERSION,
+            "name": name,
+            "etag": etag,
+            "rows": len(df),
+            "columns": columns,
+            "columns_index": df.columns,
+            "index": df.index,
+            "attrs": dict(df.attrs),
+            "partitions": partitions,
+        }
+        with open(os.path.join(tmp_dir, "meta.pkl"), "wb") as fh:
+            pickle.dump(meta, fh, protocol=pickle.HIGHEST_PROTOCOL)
+
+        try:
+            os.rename(tmp_dir, final_dir)
+        except OSError:
+            # Another worker published the same version first.
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return final_dir
+
+        self._publish(name, etag, final_dir)
+        logging.info(f"[TableStore] materialized '{name}' in {time.perf_counter() - started:.2f}s")
+        return final_dir
+
+    def _publish(self, name, etag, version_dir):
+        table_dir = self._table_dir(name)
+        try:
+            with open(os.path.join(table_dir, "CURRENT"), "rb") as fh:
+                previous = pickle.load(fh).get("dir")
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+            previous = None
+        pointer_tmp = os.path.join(table_dir, f"CURRENT.tmp-{os.getpid()}-{threading.get_ident()}")
+        with open(pointer_tmp, "wb") as fh:
+            pickle.dump({"etag": etag, "dir": os.path.basename(version_dir), "published": time.time()}, fh)
+        os.replace(pointer_tmp, os.path.join(table_dir, "CURRENT"))
+
+        # The mtime of a version dir marks when it was superseded, not when it was built.
+        if previous and previous != os.path.basename(version_dir):
+            try:
+                os.utime(os.path.join(table_dir, previous))
+            except OSError:
+                pass
+
+        # Older versions stay for a grace period after they were superseded: other
+        # workers may still hold their ETag, or have read their meta.pkl but not yet
+        # mapped the column files.
+        now = time.time()
+        for entry in os.listdir(table_dir):
+            path = os.path.join(table_dir, entry)
+            if path == version_dir or not os.path.isdir(path) or ".tmp-" in entry:
+                continue
+            if now - os.path.getmtime(path) > VERSION_GRACE_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+
+    # ------------------------------------------------------------------- read --
+    def load(self, name, etag):
+        """
+        Loads version `etag` of table `name`, or returns None if it is not on disk
+        (or was written by another store format). Numeric / datetime columns are
+        memory-mapped read-only and used in place (zero-copy); writing into them
+        raises "assignment destination is read-only" instead of corrupting the store.
+        """
+        version_dir = self._version_dir(name, etag)
+        try:
+            with open(os.path.join(version_dir, "meta.pkl"), "rb") as fh:
+                meta = pickle.load(fh)
+            if meta.get("format") != STORE_FORMAT_VERSION:
+                return None
+
+            arrays = []
+            for col in meta["columns"]:
+                path = os.path.join(version_dir, col["file"])
+                if col["kind"] == "npy":
+                    arrays.append(np.load(path, mmap_mode="r"))
+                elif col["kind"] == "cat":
+                    codes = np.load(path, mmap_mode="r")
+                    arrays.append(pd.Categorical.from_codes(codes, dtype=col["dtype"]))
+                else:
+                    with open(path, "rb") as fh:
+                        arrays.append(pickle.load(fh))
+        except FileNotFoundError:
+            # Not materialized yet, or replaced by a newer version while reading.
+            return None
+
+        df = frame_from_arrays(arrays, meta["columns_index"], meta["index"])
+        df.attrs.update(meta.get("attrs", {}))
+        return df
+
+    def load_partitions(self, name, etag, bounds, columns=None):
+        """
+        The rows of version `etag` of table `name` in the date partitions overlapping
+        `bounds` ({date column: [(lo, lo_inclusive, hi, hi_inclusive), ..]}), restricted
+        to `columns` if given, in row order with the table's index. None if the version
+        is not on disk or not partitioned on one of those columns. The frame is private
+        to the caller (nothing memory-mapped).
+        """
+        version_dir = self._version_dir(name, etag)
+        try:
+            with open(os.path.join(version_dir, "meta.pkl"), "rb") as fh:
+                meta = pickle.load(fh)
+            partitions = meta.get("partitions") if meta.get("format") == STORE_FORMAT_VERSION else None
+            ranges = bounds.get(str(partitions["column"])) if partitions else None
+            if ranges is None:
+                return None
+
+            parts = [p for p in partitions["parts"] if _overlaps(p, ranges)]
+            chunks = [np.load(os.path.join(version_dir, p["rows"])) for p in parts]
+            positions = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+            order = np.argsort(positions, kind="stable")
+            positions = positions[order]
+
+            wanted = None if columns is None else set(map(str, columns))
+            selected = [i for i, col in enumerate(meta["columns"]) if wanted is None or str(col["name"]) in wanted]
+            selected = selected or [0]
+            arrays = []
+            for i in selected:
+                col = meta["columns"][i]
+                path = os.path.join(version_dir, col["file"])
+                if col["kind"] == "npy":
+                    arrays.append(np.load(path, mmap_mode="r")[positions])
+                elif col["kind"] == "cat":
+                    codes = np.load(path, mmap_mode="r")[positions]
+                    arrays.append(pd.Categorical.from_codes(codes, dtype=col["dtype"]))
+                else:
+                    pieces = []
+                    for p in parts or partitions["parts"][:1]:
+                        with open(os.path.join(version_dir, p["files"][i]), "rb") as fh:
+                            pieces.append(pickle.load(fh))
+                    values = pd.concat([pd.Series(v, copy=False) for v in pieces], ignore_index=True).array
+                    arrays.append(values.take(order) if parts else values[:0])
+        except FileNotFoundError:
+            return None
+
+        df = frame_from_arrays(arrays, meta["columns_index"][selected], meta["index"][positions])
+        df.attrs.update(meta.get("attrs", {}))
+        logging.info(
+            f"[TableStore] '{name}': {len(parts)}/{len(partitions['parts'])} {partitions['grain']} "
+            f"partition(s), {len(df)}/{meta['rows']} rows"
+        )
+        return df
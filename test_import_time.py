@@ -0,0 +1,17 @@
+# Import-time budget for `import app` (import_time_report.py), measured in a fresh
+# interpreter. Run with: python -m pytest -q test_import_time.py
+
+from import_time_report import DEFAULT_BUDGET_SECONDS, measure_import, summarize
+
+# Loaded inside the functions that use them, never by `import app`.
+LAZY_PACKAGES = ("pandas", "numpy", "rapidfuzz", "reportlab", "fitz", "matplotlib")
+
+
+def test_import_app_within_budget():
+    total_s, report = summarize(measure_import("app"))
+    assert total_s <= DEFAULT_BUDGET_SECONDS, f"`import app` took {total_s:.3f}s\n{report}"
+
+
+def test_import_app_skips_heavy_libraries():
+    imported = {name.split(".")[0] for name, _, _, _ in measure_import("app")}
+    assert not imported.intersection(LAZY_PACKAGES)
@@ -0,0 +1,102 @@
+# Value index
+# Distinct values of the text columns of one cached table version, used by
+# fuzzy_correct_code to snap literals in generated code ('Jedah' → 'Jeddah').
+#
+# - Built lazily per column, once per (table, ETag): the index lives on the table cache
+#   entry, so a new blob version gets a fresh index.
+# - All literals of one column are matched in a single rapidfuzz cdist call instead of
+#   one extractOne per literal; literals already present verbatim skip matching.
+# - Corrections are memoized per (column, literal) for the lifetime of the index.
+# - Over a frame holding only some rows of the table (date partitions), only category
+#   columns are indexed: they carry the categories of the whole table, the other text
+#   columns would offer just the values of those rows.
+
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+FUZZY_SCORE_CUTOFF = 85
+MEMO_MAX_ENTRIES = 20000
+
+
+class ValueIndex:
+    """
+    Distinct-value index over the text columns of `df` (one table version);
+    `partial_rows` if `df` holds only some of its rows.
+    """
+
+    def __init__(self, df, partial_rows=False):
+        self._df = df
+        self._partial_rows = partial_rows
+        self._values = {}     # column -> (list of distinct values, set of the same) or None
+        self._memo = {}       # (column, literal) -> (best value, score) or None
+        self._lock = threading.Lock()
+
+    def has_text_column(self, col):
+        return self._column_values(col) is not None
+
+    def _column_values(self, col):
+        with self._lock:
+            if col in self._values:
+                return self._values[col]
+
+        entry = None
+        if col in self._df.columns:
+            # Positional lookup: duplicated column names would return a DataFrame.
+            series = self._df.iloc[:, list(self._df.columns).index(col)]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                if pd.api.types.is_string_dtype(series.cat.categories):
+                    distinct = [str(v) for v in series.cat.categories]
+                    entry = (distinct, set(distinct))
+            elif pd.api.types.is_string_dtype(series) and not self._partial_rows:
+                distinct = pd.unique(series.dropna().astype(str)).tolist()
+                entry = (distinct, set(distinct))
+
+        with self._lock:
+            self._values[col] = entry
+        return entry
+
+    def match(self, col, literals, cutoff=FUZZY_SCORE_CUTOFF):
+        """
+        Returns {literal: (best value, score)} for the literals of `col` that have a
+        distinct value scoring above `cutoff` (token_sort_ratio). Literals without a
+        good enough match are left out. Empty if `col` is not a text column here.
+        """
+        values = self._column_values(col)
+        if values is None:
+            return {}
+        distinct, distinct_set = values
+
+        out, todo = {}, []
+        with self._lock:
+            for lit in dict.fromkeys(literals):
+                key = (col, lit)
+                if key in self._memo:
+                    if self._memo[key] is not None:
+                        out[lit] = self._memo[key]
+                elif lit in distinct_set:
+                    out[lit] = self._memo[key] = (lit, 100.0)
+                else:
+                    todo.append(lit)
+
+        if todo and distinct:
+            from rapidfuzz import process, fuzz
+
+            scores = process.cdist(todo, distinct, scorer=fuzz.token_sort_ratio, dtype=np.float32)
+            best = scores.argmax(axis=1)
+            results = {}
+            for row, lit in enumerate(todo):
+                score = round(float(scores[row, best[row]]), 1)
+                results[lit] = (distinct[best[row]], score) if score > cutoff else None
+            with self._lock:
+                if len(self._memo) > MEMO_MAX_ENTRIES:
+                    self._memo.clear()
+                for lit, res in results.items():
+                    self._memo[(col, lit)] = res
+                    if res is not None:
+                        out[lit] = res
+        elif todo:
+            logging.debug(f"[ValueIndex] column '{col}' has no values to match against")
+        return out
@@ -0,0 +1,199 @@
+# Warm start
+# Snapshot / restore of the process-wide caches (RBAC frames, table catalog, classifier
+# results, ...) to a local file, so a restarted worker does not rebuild everything on
+# the first user requests.
+#
+# Each cache registers itself with register_warm_cache():
+#   dump()    -> picklable payload of the current cache content (or None if empty);
+#             with `epoch`, (payload, tag of the data version the content was built
+#             from) -- recorded when the cache was filled, not when it is saved
+#   restore(payload)  puts a payload back (should not overwrite fresher data)
+#   version   bump it whenever the payload layout changes; old snapshots are then ignored
+#   epoch()   -> tag of the current data version (e.g. hash of the blob ETags).
+#             A restored entry is discarded if its tag differs from the current one.
+
+import os
+import time
+import atexit
+import pickle
+import logging
+import threading
+from collections import OrderedDict
+
+SNAPSHOT_FORMAT_VERSION = 2
+SNAPSHOT_PATH = os.getenv("WARM_SNAPSHOT_PATH", "/tmp/cxqa_warm_snapshot.pkl")
+SNAPSHOT_INTERVAL_SECONDS = int(os.getenv("WARM_SNAPSHOT_INTERVAL_SECONDS", "900"))
+SNAPSHOT_MAX_AGE_SECONDS = int(os.getenv("WARM_SNAPSHOT_MAX_AGE_SECONDS", str(24 * 3600)))
+
+_providers = OrderedDict()
+_providers_lock = threading.Lock()
+_save_lock = threading.Lock()
+_periodic_thread = None
+_stop_event = threading.Event()
+
+
+def register_warm_cache(name, dump, restore, version=1, epoch=None):
+    """
+    Registers a cache to be included in snapshots. Safe to call at import time.
+    """
+    with _providers_lock:
+        _providers[name] = {"dump": dump, "restore": restore, "version": version, "epoch": epoch}
+
+
+def _current_epoch(provider, epoch_memo):
+    # Several caches usually share the same epoch function (one blob listing),
+    # so compute each distinct function only once per restore.
+    fn = provider["epoch"]
+    if fn is None:
+        return None
+    if fn not in epoch_memo:
+        try:
+            epoch_memo[fn] = fn()
+        except Exception as e:
+            logging.warning(f"[WarmStart] epoch lookup failed: {e}")
+            epoch_memo[fn] = None
+    return epoch_memo[fn]
+
+
+def save_snapshot(path=None):
+    """
+    Serializes every registered cache to `path` (atomic replace).
+    Returns True if a snapshot was written.
+    """
+    path = path or SNAPSHOT_PATH
+    with _providers_lock:
+        providers = list(_providers.items())
+
+    with _save_lock:
+        started = time.time()
+        caches = {}
+        for name, provider in providers:
+            try:
+                dumped = provider["dump"]()
+            except Exception as e:
+                logging.warning(f"[WarmStart] dump of '{name}' failed: {e}")
+                continue
+            if dumped is None:
+                continue
+            payload, epoch = dumped if provider["epoch"] is not None else (dumped, None)
+            if payload is None or (provider["epoch"] is not None and epoch is None):
+                continue
+            caches[name] = {"version": provider["version"], "epoch": epoch, "payload": payload}
+
+        if not caches:
+            return False
+
+        snapshot = {
+            "format": SNAPSHOT_FORMAT_VERSION,
+            "created": time.time(),
+            "caches": caches,
+        }
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(tmp_path, "wb") as fh:
+                pickle.dump(snapshot, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logging.warning(f"[WarmStart] could not write snapshot {path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+
+        logging.info(
+            f"[WarmStart] snapshot saved: {sorted(caches)} in {time.time() - started:.2f}s → {path}"
+        )
+        return True
+
+
+def restore_snapshot(path=None):
+    """
+    Loads the snapshot at `path` and hands each valid entry back to its cache.
+    Entries with an unknown cache name, another version, or a stale / unknown
+    data epoch are discarded. Returns {cache_name: "restored" | reason}.
+    """
+    path = path or SNAPSHOT_PATH
+    report = {}
+    if not os.path.exists(path):
+        return report
+
+    try:
+        with open(path, "rb") as fh:
+            snapshot = pickle.load(fh)
+    except Exception as e:
+        logging.warning(f"[WarmStart] unreadable snapshot {path}: {e}")
+        return report
+
+    if not isinstance(snapshot, dict) or snapshot.get("format") != SNAPSHOT_FORMAT_VERSION:
+        logging.info("[WarmStart] snapshot format changed, ignoring it")
+        return report
+    age = time.time() - snapshot.get("created", 0)
+    if age > SNAPSHOT_MAX_AGE_SECONDS:
+        logging.info(f"[WarmStart] snapshot is {age / 3600:.1f}h old, ignoring it")
+        return report
+
+    with _providers_lock:
+        providers = dict(_providers)
+
+    epoch_memo = {}
+    for name, entry in snapshot.get("caches", {}).items():
+        provider = providers.get(name)
+        if provider is None:
+            report[name] = "unknown cache"
+            continue
+        if entry.get("version") != provider["version"]:
+            report[name] = "version mismatch"
+            continue
+        if provider["epoch"] is not None:
+            current = _current_epoch(provider, epoch_memo)
+            if current is None or current != entry.get("epoch"):
+                report[name] = "stale data epoch"
+                continue
+        try:
+            provider["restore"](entry["payload"])
+            report[name] = "restored"
+        except Exception as e:
+            report[name] = f"restore failed: {e}"
+
+    logging.info(f"[WarmStart] restore from {path}: {report}")
+    return report
+
+
+def _periodic_loop(interval):
+    while not _stop_event.wait(interval):
+        try:
+            save_snapshot()
+        except Exception as e:
+            logging.warning(f"[WarmStart] periodic snapshot failed: {e}")
+
+
+def start_periodic_snapshots(interval=None):
+    """
+    Starts a daemon thread that snapshots every `interval` seconds and
+    registers a final snapshot at interpreter exit. Idempotent.
+    """
+    global _periodic_thread
+    if _periodic_thread is not None:
+        return
+    interval = interval or SNAPSHOT_INTERVAL_SECONDS
+    _periodic_thread = threading.Thread(
+        target=_periodic_loop, args=(interval,), name="warm-snapshot", daemon=True
+    )
+    _periodic_thread.start()
+    atexit.register(shutdown)
+
+
+def shutdown():
+    """
+    Graceful-shutdown hook: stops the periodic thread and writes a last snapshot.
+    Runs once, even if called from both the gunicorn hook and atexit.
+    """
+    if _stop_event.is_set():
+        return
+    _stop_event.set()
+    try:
+        save_snapshot()
+    except Exception as e:
+        logging.warning(f"[WarmStart] final snapshot failed: {e}")